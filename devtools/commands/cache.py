@@ -0,0 +1,147 @@
+""" Commands for the local download cache """
+from __future__ import annotations
+
+import http.server
+import logging
+import os
+import re
+import shutil
+from collections.abc import Sequence
+from typing import cast
+
+from devtools import constants
+from devtools.lib import gitcache
+from devtools.lib.context import Context
+from devtools.lib.modules import argument
+from devtools.lib.modules import argument_fn
+from devtools.lib.modules import command
+from devtools.lib.modules import ExitCode
+from devtools.lib.modules import ModuleDef
+from devtools.lib.modules import ParserFn
+
+logger = logging.getLogger(__name__)
+
+module_info = ModuleDef(
+    module_name=__name__,
+    name="cache",
+    help="Manage the download and git object caches",
+)
+
+SHA256_RE = re.compile(r"^/([0-9a-f]{64})$")
+
+
+class CacheRequestHandler(http.server.BaseHTTPRequestHandler):
+    """Serves cached artifacts as /<sha256>"""
+
+    protocol_version = "HTTP/1.1"
+    cache_root = constants.cache_root
+
+    def log_message(self, format: str, *args: object) -> None:
+        logger.info("%s %s", self.address_string(), format % args)
+
+    def send_head(self) -> str | None:
+        m = SHA256_RE.match(self.path)
+        path = os.path.join(self.cache_root, m.group(1)) if m else ""
+        if not (path and os.path.isfile(path)):
+            self.send_error(404)
+            return None
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(os.path.getsize(path)))
+        self.end_headers()
+        return path
+
+    def do_HEAD(self) -> None:
+        self.send_head()
+
+    def do_GET(self) -> None:
+        path = self.send_head()
+        if path:
+            with open(path, "rb") as f:
+                shutil.copyfileobj(f, self.wfile)
+
+
+@command("serve", help="Serve the download cache over HTTP")
+@argument(
+    "-b",
+    "--bind",
+    var="address",
+    required=False,
+    help="Address to listen on (default 127.0.0.1, this machine only; "
+    "use 0.0.0.0 to serve the network)",
+)
+@argument(
+    "-p",
+    "--port",
+    var="port",
+    required=False,
+    help="Port to listen on (default 8765)",
+)
+def serve(context: Context, argv: Sequence[str] | None) -> ExitCode:
+    """
+    Serves the local content-addressed download cache, so this machine can
+    be listed as a mirror in other machines' devtools configuration.
+
+    Only this machine can connect unless an address is given with --bind,
+    e.g. `devtools cache serve --bind 0.0.0.0`.
+    """
+    args = context["args"]
+    address = args.bind or "127.0.0.1"
+    port = int(args.port or 8765)
+
+    server = http.server.ThreadingHTTPServer(
+        (address, port), CacheRequestHandler
+    )
+    print(f"Serving {constants.cache_root} on http://{address}:{port}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+@command("refresh-git", help="Fetch new objects into the shared git cache")
+@argument_fn(
+    cast(
+        ParserFn,
+        lambda p: p.add_argument(
+            "repos",
+            nargs="*",
+            help="owner/repo to refresh (default: every cached repository)",
+        ),
+    )
+)
+@argument(
+    "-j",
+    "--jobs",
+    var="jobs",
+    required=False,
+    help="Number of repositories to fetch at once (default 4)",
+)
+@argument(
+    "-b",
+    "--background",
+    required=False,
+    help="Refresh in a detached process and return immediately",
+)
+def refresh_git(context: Context, argv: Sequence[str] | None) -> ExitCode:
+    """
+    Fetches the repositories registered with the shared git object cache,
+    which `github fetch` registers clones with when the cache is enabled
+    (`git_cache = true`). Cached objects are never pruned, since clones
+    borrow them.
+    """
+    args = context["args"]
+    repos = args.repos or None
+
+    if args.background:
+        pid = gitcache.refresh_in_background(repos)
+        print(f"Refreshing {gitcache.cache_path()} in the background ({pid})")
+        return 0
+
+    if not gitcache.refresh(repos, jobs=int(args.jobs or 4)):
+        print("A refresh of the git cache is already running")
+    return 0
@@ -1,6 +1,5 @@
 from __future__ import annotations
 
-import configparser
 import logging
 import os
 import sys
@@ -8,6 +7,7 @@ from collections.abc import Sequence
 from typing import cast
 
 from devtools import constants
+from devtools.lib.config import get_config
 from devtools.lib.config import update_config
 from devtools.lib.context import Context
 from devtools.lib.modules import argument
@@ -69,9 +69,7 @@ def show_config(
 
     logger.info("Reading config file from %s", config_path)
 
-    parser = configparser.ConfigParser()
-    parser.read(config_path)
-    parser.write(sys.stdout)
+    get_config(config_path).write(sys.stdout)
     return 0
 
 
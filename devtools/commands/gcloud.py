@@ -3,6 +3,8 @@ from __future__ import annotations
 
 import csv
 import logging
+import os
+import re
 import sys
 from collections.abc import Sequence
 from typing import cast
@@ -46,43 +48,90 @@ def whoami(context: Context, argv: Sequence[str] | None) -> ExitCode:
     return str(identity)
 
 
+def _impersonate(context: Context, user: str) -> gcptools.Identity:
+    """A token for `user`, a service account or an alias from the repo"""
+    if "@" in user:
+        return gcptools.sudo(user)
+
+    repo = context["repo"]
+    if repo is None:
+        raise SystemExit(f"Invalid target identity {colors.red(user)}")
+    logger.debug("Assuming %s is an alias", colors.green(user))
+    return gcptools.sudo_alias(repo, user)
+
+
+def _token_file(user: str, identity: gcptools.Identity, pid: int) -> str:
+    """Writes a token file for `identity`, kept fresh while `pid` runs"""
+    path = gcptools.token_file_path(identity.account, pid)
+    gcptools.write_token_file(path, identity)
+    gcptools.start_refresher(user, path, pid)
+    return path
+
+
+def _env_prefix(alias: str) -> str:
+    return re.sub(r"[^A-Z0-9]", "_", alias.upper()) + "_"
+
+
 @command("sudo", help="Run a command with sudo permissions")
 @argument("-u", var="user", required=True, help="Target account for sudo")
+@argument(
+    "--refresh",
+    required=False,
+    help="Renew the token in the background for as long as the command "
+    "runs (for gcloud, via CLOUDSDK_AUTH_ACCESS_TOKEN_FILE)",
+)
+@argument(
+    "--no-exec",
+    required=False,
+    help="Run the command as a child of devtools rather than in its place",
+)
 def sudo(context: Context, argv: Sequence[str] | None) -> ExitCode:
     """
     Ported from Tacos-GHA
 
     The username supplied needs to be specified in {repo}/.devtools/config.ini.
+
+    The command replaces devtools (unless --no-exec), so its exit code,
+    signals and terminal are passed straight through.
     """
     if not argv:
         return "Nothing to run"
 
     args = context["args"]
-    target_alias = args.user
-    if "@" not in target_alias:
-        repo = context["repo"]
-        if repo is None:
-            raise SystemExit(
-                f"Invalid target identity {colors.red(target_alias)}"
-            )
-        logger.debug("Assuming %s is an alias", colors.green(target_alias))
-
-        new_token = gcptools.sudo_alias(repo, target_alias)
-    else:
-        new_token = gcptools.sudo(target_alias)
+    new_token = _impersonate(context, args.user)
+    token_file = None
+    if args.refresh:
+        token_file = _token_file(args.user, new_token, os.getpid())
 
-    proc.run(
-        argv,
-        env=gcptools.to_env(new_token),
-        stdout=sys.stdout,
-        stderr=sys.stderr,
-    )
+    env = gcptools.to_env(new_token, token_file)
+    if not args.no_exec:
+        proc.exec_replace(argv, env=env)
+
+    proc.run(argv, env=env, stdout=sys.stdout, stderr=sys.stderr)
 
     return "sudo executed successfully"
 
 
 @command("sudo-env", help="Output environment values for gcp-sudo")
-@argument("-u", var="user", required=True, help="Target account for sudo")
+@argument_fn(
+    cast(
+        ParserFn,
+        lambda x: x.add_argument(
+            "-u",
+            dest="user",
+            metavar="user",
+            action="append",
+            required=True,
+            help="Target account for sudo; repeat for several, each exported "
+            "with the alias as a prefix (e.g. DEPLOY_CLOUDSDK_CORE_ACCOUNT)",
+        ),
+    )
+)
+@argument(
+    "--refresh",
+    required=False,
+    help="Renew the token in the background for as long as the shell runs",
+)
 @require_repo
 def sudo_env(context: Context, argv: Sequence[str] | None) -> ExitCode:
     """
@@ -93,9 +142,21 @@ def sudo_env(context: Context, argv: Sequence[str] | None) -> ExitCode:
     assert repo is not None
 
     args = context["args"]
-    target_alias = args.user
-
-    env = gcptools.to_env(gcptools.sudo_alias(repo, target_alias))
+    aliases = list(dict.fromkeys(args.user))
+
+    identities = gcptools.sudo_many(repo, aliases)
+    env = {}
+    for alias, identity in identities.items():
+        token_file = None
+        if args.refresh:
+            # the shell evaluating our output
+            token_file = _token_file(alias, identity, os.getppid())
+        alias_env = gcptools.to_env(identity, token_file)
+        if len(aliases) == 1:
+            env.update(alias_env)
+        else:
+            prefix = _env_prefix(alias)
+            env.update({prefix + k: v for k, v in alias_env.items()})
 
     if "fish" in constants.shell:
         for k, v in env.items():
@@ -106,6 +167,35 @@ def sudo_env(context: Context, argv: Sequence[str] | None) -> ExitCode:
     return 0
 
 
+@command("refresh-token", help="Keep a sudo token file fresh")
+@argument("-u", var="user", required=True, help="Target account for sudo")
+@argument("--file", var="file", required=True, help="Token file to write")
+@argument("--pid", var="pid", required=True, help="Stop once this exits")
+def refresh_token(context: Context, argv: Sequence[str] | None) -> ExitCode:
+    """
+    Renews the token for an account or alias ahead of its expiry, writing it
+    to --file until process --pid exits. `sudo --refresh` and
+    `sudo-env --refresh` start this in the background.
+    """
+    args = context["args"]
+    gcptools.keep_token_file(
+        args.file, lambda: _impersonate(context, args.user), int(args.pid)
+    )
+    return 0
+
+
+@command("credential-helper", help="Print a valid sudo token")
+@argument("-u", var="user", required=True, help="Target account for sudo")
+def credential_helper(context: Context, argv: Sequence[str] | None) -> ExitCode:
+    """
+    Prints just an access token for an account or alias, minting a new one
+    only when the cached one is about to expire, for tools which run a
+    command to get their credentials.
+    """
+    print(_impersonate(context, context["args"].user).token)
+    return 0
+
+
 @command("create-alias", help="Create a repo-specific sudo alias")
 @argument("name", help="name of the alias to create")
 @argument(
@@ -176,6 +266,7 @@ def clear_env(context: Context, argv: Sequence[str] | None) -> ExitCode:
 unset CLOUDSDK_CORE_ACCOUNT
 unset GOOGLE_OAUTH_ACCESS_TOKEN
 unset CLOUDSDK_AUTH_ACCESS_TOKEN
+unset CLOUDSDK_AUTH_ACCESS_TOKEN_FILE
 """
     )
     return 0
@@ -1,15 +1,30 @@
 from __future__ import annotations
 
+import glob
+import hashlib
+import json
 import logging
 import os
+import random
 import re
+import shutil
 import subprocess
 import sys
+import threading
+import time
+from collections.abc import Iterable
 from collections.abc import Sequence
-from functools import lru_cache
+from dataclasses import dataclass
+from pathlib import Path
 from typing import cast
 
+from devtools import constants
+from devtools.lib import fs
+from devtools.lib import gitcache
+from devtools.lib import httpclient
+from devtools.lib import parallel
 from devtools.lib import proc
+from devtools.lib import text
 from devtools.lib.context import Context
 from devtools.lib.modules import argument
 from devtools.lib.modules import argument_fn
@@ -17,28 +32,276 @@ from devtools.lib.modules import command
 from devtools.lib.modules import ExitCode
 from devtools.lib.modules import ModuleDef
 from devtools.lib.modules import ParserFn
+from devtools.lib.text import StatusLine
 
 logger = logging.getLogger(__name__)
 
+FETCH_JOBS = 4
+FETCH_RETRIES = 3
+# seconds before the first retry; doubled for each retry after that
+FETCH_BACKOFF = 2.0
 
-@lru_cache(maxsize=None)
-def get_sha(repo: str, ref: str) -> str:
+PIN_JOBS = 8
+
+RESOLVERS = ("ls-remote", "graphql")
+GRAPHQL_URL = "https://api.github.com/graphql"
+# refs per GraphQL request; each costs two ref lookups
+GRAPHQL_BATCH = 100
+
+# how long a resolved SHA is trusted, by kind of ref (see ref_kind)
+REF_TTL = {"release": 30 * 24 * 60 * 60, "tag": 24 * 60 * 60, "branch": 60 * 60}
+RELEASE_TAG_RE = re.compile(r"^v?\d+\.\d+\.\d+$")
+
+ACTION_VERSION_RE = re.compile(r"(?<=uses: )(?P<action>.*)@(?P<ref>[^#\s]+)")
+
+# (owner/repo, ref)
+ActionRef = tuple[str, str]
+
+
+def is_sha(ref: str) -> bool:
     if len(ref) == 40:
         try:
             int(ref, 16)
         except ValueError:
             pass
         else:
-            return ref
+            return True
+    return False
+
+
+def ref_kind(refname: str) -> str:
+    """Classifies a full refname by how long its SHA can be trusted"""
+    if refname.startswith("refs/heads/"):
+        return "branch"
+    if RELEASE_TAG_RE.match(refname.removeprefix("refs/tags/")):
+        return "release"
+    # e.g. v4, which is moved along with each v4.x.y release
+    return "tag"
+
+
+class RefCache:
+    """
+    An on-disk cache of (repo, ref) -> SHA, shared by every invocation.
+    Entries expire by the kind of ref (see REF_TTL).
+    """
+
+    def __init__(self, path: str | None = None) -> None:
+        self.path = path or os.path.join(
+            constants.root, "cache", "github-refs.json"
+        )
+        self._lock = threading.Lock()
+        self._entries = self._load()
+        self._dirty: dict[str, dict[str, str | float]] = {}
+
+    def _load(self) -> dict[str, dict[str, str | float]]:
+        data = fs.read_json(self.path, version=1)
+        return cast("dict[str, dict[str, str | float]]", data.get("refs", {}))
+
+    def get(self, repo: str, ref: str) -> str | None:
+        with self._lock:
+            entry = self._entries.get(f"{repo}@{ref}")
+        if entry is None:
+            return None
+        ttl = REF_TTL.get(str(entry["kind"]), 0)
+        if time.time() - float(entry["resolved"]) > ttl:
+            return None
+        return str(entry["sha"])
+
+    def put(self, repo: str, ref: str, sha: str, kind: str) -> None:
+        entry: dict[str, str | float] = {
+            "sha": sha,
+            "kind": kind,
+            "resolved": time.time(),
+        }
+        with self._lock:
+            self._entries[f"{repo}@{ref}"] = self._dirty[
+                f"{repo}@{ref}"
+            ] = entry
+
+    def save(self) -> None:
+        """Writes new entries, merged with any written meanwhile"""
+        with self._lock:
+            if not self._dirty:
+                return
+            entries = {**self._load(), **self._dirty}
+            if not fs.write_json(self.path, {"version": 1, "refs": entries}):
+                return
+            self._entries = entries
+            self._dirty.clear()
+
+
+@dataclass(frozen=True)
+class RefTable:
+    """The branches and tags of a repository, as listed by ls-remote"""
+
+    repo: str
+    heads: dict[str, str]
+    tags: dict[str, str]
 
-    cmd = ("git", "ls-remote", "--exit-code", f"https://github.com/{repo}", ref)
+    @classmethod
+    def parse(cls, repo: str, output: str) -> RefTable:
+        heads: dict[str, str] = {}
+        tags: dict[str, str] = {}
+        peeled: dict[str, str] = {}
+        for line in output.splitlines():
+            sha, refname = line.split()
+            if refname.startswith("refs/heads/"):
+                heads[refname.removeprefix("refs/heads/")] = sha
+            elif refname.endswith("^{}"):
+                # an annotated tag's commit, rather than the tag object
+                peeled[refname.removeprefix("refs/tags/")[:-3]] = sha
+            elif refname.startswith("refs/tags/"):
+                tags[refname.removeprefix("refs/tags/")] = sha
+        return cls(repo, heads, {**tags, **peeled})
+
+    def resolve(self, ref: str) -> tuple[str, str]:
+        """Returns the commit SHA and kind of `ref`; tags win, like git"""
+        if ref in self.tags:
+            return self.tags[ref], ref_kind(f"refs/tags/{ref}")
+        if ref in self.heads:
+            return self.heads[ref], "branch"
+        raise LookupError(f"unknown ref: {self.repo}@{ref}")
+
+
+def _ls_remote(repo: str) -> RefTable:
+    cmd = (
+        "git",
+        "ls-remote",
+        "--tags",
+        "--heads",
+        f"https://github.com/{repo}",
+    )
     out = subprocess.check_output(cmd)
-    for line in out.decode().splitlines():
-        sha, refname = line.split()
-        if refname in (f"refs/tags/{ref}", f"refs/heads/{ref}"):
-            return sha
-    else:
-        raise AssertionError(f"unknown ref: {repo}@{ref}")
+    return RefTable.parse(repo, out.decode())
+
+
+def _resolve_repo(
+    repo: str, refs: Sequence[str], cache: RefCache | None, refresh: bool
+) -> dict[str, str | Exception]:
+    """Resolves refs of one repository, with at most one ls-remote"""
+    results: dict[str, str | Exception] = {}
+    missing = []
+    for ref in refs:
+        sha = cache.get(repo, ref) if cache and not refresh else None
+        if sha is None:
+            missing.append(ref)
+        else:
+            results[ref] = sha
+
+    if missing:
+        table = _ls_remote(repo)
+        for ref in missing:
+            try:
+                sha, kind = table.resolve(ref)
+            except LookupError as e:
+                results[ref] = e
+                continue
+            results[ref] = sha
+            if cache is not None:
+                cache.put(repo, ref, sha, kind)
+    return results
+
+
+def _github_token() -> str | None:
+    return os.environ.get("GITHUB_TOKEN") or os.environ.get("GH_TOKEN")
+
+
+def _graphql_query(refs: Sequence[ActionRef]) -> str:
+    """
+    A query for the commits of `refs`, looking each up as both a tag and a
+    branch. Fields are aliased r<repo>/t<ref> and r<repo>/h<ref>.
+    """
+    by_repo: dict[str, list[tuple[int, str]]] = {}
+    for i, (repo, ref) in enumerate(refs):
+        by_repo.setdefault(repo, []).append((i, ref))
+
+    target = "target { oid ... on Tag { target { oid } } }"
+    fields = []
+    for r, (repo, repo_refs) in enumerate(by_repo.items()):
+        owner, name = repo.split("/")
+        lookups = " ".join(
+            f"{kind}{i}: ref(qualifiedName: {json.dumps(prefix + ref)}) {{ {target} }}"
+            for i, ref in repo_refs
+            for kind, prefix in (("t", "refs/tags/"), ("h", "refs/heads/"))
+        )
+        fields.append(
+            f"r{r}: repository(owner: {json.dumps(owner)}, name: {json.dumps(name)}) {{ {lookups} }}"
+        )
+    return "query { %s }" % " ".join(fields)
+
+
+def _json_get(data: object, *keys: str) -> object:
+    """Looks up a path of `keys` in nested JSON objects, or None"""
+    for key in keys:
+        if not isinstance(data, dict):
+            return None
+        data = data.get(key)
+    return data
+
+
+def _graphql_batch(
+    refs: Sequence[ActionRef], token: str
+) -> dict[ActionRef, tuple[str, str]]:
+    response = httpclient.post_json(
+        GRAPHQL_URL,
+        {"query": _graphql_query(refs)},
+        headers={"Authorization": f"bearer {token}"},
+    )
+    found: dict[ActionRef, tuple[str, str]] = {}
+    repos = list(dict.fromkeys(repo for repo, _ in refs))
+    for i, (repo, ref) in enumerate(refs):
+        for kind, refname in (
+            ("t", f"refs/tags/{ref}"),
+            ("h", f"refs/heads/{ref}"),
+        ):
+            target = _json_get(
+                response,
+                "data",
+                f"r{repos.index(repo)}",
+                f"{kind}{i}",
+                "target",
+            )
+            # annotated tags point at a tag object; we want its commit
+            sha = _json_get(target, "target", "oid") or _json_get(target, "oid")
+            if isinstance(sha, str):
+                found[repo, ref] = (sha, ref_kind(refname))
+                break
+    return found
+
+
+def graphql_resolve(
+    refs: Sequence[ActionRef],
+) -> dict[ActionRef, tuple[str, str]]:
+    """
+    Resolves refs through GitHub's GraphQL API, many per request over one
+    pooled connection. Returns the SHA and kind of each ref found; refs
+    which aren't (or if the API can't be used) are left for ls-remote.
+    """
+    token = _github_token()
+    if not token:
+        logger.warning("GITHUB_TOKEN is not set; resolving refs with ls-remote")
+        return {}
+
+    found: dict[ActionRef, tuple[str, str]] = {}
+    for start in range(0, len(refs), GRAPHQL_BATCH):
+        batch = refs[start : start + GRAPHQL_BATCH]
+        try:
+            found.update(_graphql_batch(batch, token))
+        except (httpclient.HTTPError, OSError, ValueError) as e:
+            logger.warning("GraphQL ref lookup failed: %s", e)
+    return found
+
+
+def get_sha(
+    repo: str, ref: str, cache: RefCache | None = None, refresh: bool = False
+) -> str:
+    if is_sha(ref):
+        return ref
+
+    result = _resolve_repo(repo, (ref,), cache, refresh)[ref]
+    if isinstance(result, Exception):
+        raise result
+    return result
 
 
 def extract_repo(action: str) -> str:
@@ -49,101 +312,556 @@ def extract_repo(action: str) -> str:
     return f"{parts[0]}/{parts[1]}"
 
 
+def scan_refs(lines: Iterable[str]) -> set[ActionRef]:
+    """The action repositories and refs in a workflow which aren't pinned"""
+    refs = set()
+    for line in lines:
+        m = ACTION_VERSION_RE.search(line)
+        if m and not is_sha(m["ref"]):
+            refs.add((extract_repo(m["action"]), m["ref"]))
+    return refs
+
+
+def resolve_refs(
+    refs: Iterable[ActionRef],
+    jobs: int = PIN_JOBS,
+    cache: RefCache | None = None,
+    refresh: bool = False,
+    resolver: str = "ls-remote",
+) -> tuple[dict[ActionRef, str], dict[ActionRef, Exception]]:
+    """
+    Resolves refs to SHAs concurrently, one repository at a time so each
+    is listed once; returns (shas, errors)
+
+    With the graphql resolver, refs are first looked up in batches through
+    the GitHub API, and only those it can't resolve are listed.
+    """
+    refs = sorted(refs)
+    shas: dict[ActionRef, str] = {}
+    errors: dict[ActionRef, Exception] = {}
+
+    if resolver == "graphql":
+        missing = [
+            ref
+            for ref in refs
+            if refresh or cache is None or cache.get(*ref) is None
+        ]
+        for (repo, ref), (sha, kind) in graphql_resolve(missing).items():
+            shas[repo, ref] = sha
+            if cache is not None:
+                cache.put(repo, ref, sha, kind)
+        refs = [ref for ref in refs if ref not in shas]
+
+    by_repo: dict[str, list[str]] = {}
+    for repo, ref in refs:
+        by_repo.setdefault(repo, []).append(ref)
+
+    outcomes = parallel.run_all(
+        lambda repo: _resolve_repo(repo, by_repo[repo], cache, refresh),
+        by_repo,
+        jobs=jobs,
+    )
+
+    for outcome in outcomes:
+        repo = outcome.item
+        if outcome.error is not None:
+            for ref in by_repo[repo]:
+                errors[repo, ref] = outcome.error
+            continue
+        for ref, result in (outcome.value or {}).items():
+            if isinstance(result, Exception):
+                errors[repo, ref] = result
+            else:
+                shas[repo, ref] = result
+    return shas, errors
+
+
+class PinIndex:
+    """
+    Workflow files known to be fully pinned, by path, with their stat data
+    and content hash, so that unchanged files needn't be read again.
+    """
+
+    def __init__(self, path: str | None = None) -> None:
+        self.path = path or os.path.join(
+            constants.root, "cache", "pin-gha-index.json"
+        )
+        self._entries = self._load()
+        self._changed: dict[str, list[int | str] | None] = {}
+
+    def _load(self) -> dict[str, list[int | str]]:
+        data = fs.read_json(self.path, version=1)
+        return cast("dict[str, list[int | str]]", data.get("files", {}))
+
+    def is_pinned(self, path: str, st: os.stat_result) -> bool:
+        entry = self._entries.get(path)
+        return entry is not None and entry[:2] == [st.st_mtime_ns, st.st_size]
+
+    def has_digest(self, path: str, digest: str) -> bool:
+        entry = self._entries.get(path)
+        return entry is not None and entry[2] == digest
+
+    def set(self, path: str, st: os.stat_result, digest: str | None) -> None:
+        """Records `path` as pinned, or not, if `digest` is None"""
+        entry: list[int | str] | None = None
+        if digest is not None:
+            entry = [st.st_mtime_ns, st.st_size, digest]
+        if self._entries.get(path) != entry:
+            self._changed[path] = entry
+        if entry is None:
+            self._entries.pop(path, None)
+        else:
+            self._entries[path] = entry
+
+    def save(self) -> None:
+        """Writes changed entries, merged with any written meanwhile"""
+        if not self._changed:
+            return
+        entries = self._load()
+        for path, entry in self._changed.items():
+            if entry is None:
+                entries.pop(path, None)
+            else:
+                entries[path] = entry
+        fs.write_json(self.path, {"version": 1, "files": entries})
+        self._changed.clear()
+
+
+def find_workflows(paths: Sequence[str]) -> list[str]:
+    """
+    Expands globs and directories into workflow files. Directories are
+    searched for YAML files under .github directories, skipping other
+    hidden directories and node_modules.
+    """
+    found: dict[str, None] = {}
+    for path in paths:
+        matches = (
+            glob.glob(path, recursive=True)
+            if any(c in path for c in "*?[")
+            else [path]
+        )
+        if not any(os.path.exists(match) for match in matches):
+            raise SystemExit(f"{path}: no such file or directory")
+
+        for match in sorted(matches):
+            if not os.path.isdir(match):
+                found[match] = None
+                continue
+            for root, dirs, files in os.walk(match):
+                dirs[:] = sorted(
+                    d
+                    for d in dirs
+                    if d == ".github"
+                    or not (d.startswith(".") or d == "node_modules")
+                )
+                if ".github" not in Path(os.path.abspath(root)).parts:
+                    continue
+                for name in sorted(files):
+                    if name.endswith((".yml", ".yaml")):
+                        found[os.path.join(root, name)] = None
+    return list(found)
+
+
+def pin_lines(lines: Iterable[str], shas: dict[ActionRef, str]) -> list[str]:
+    """Rewrites the resolvable refs in a workflow to SHAs"""
+    newlines = []
+    for line in lines:
+        m = ACTION_VERSION_RE.search(line)
+        if m:
+            sha = shas.get((extract_repo(m["action"]), m["ref"]))
+            if sha is not None and sha != m["ref"]:
+                line = ACTION_VERSION_RE.sub(rf"\1@{sha} # \2", line)
+        newlines.append(line)
+    return newlines
+
+
 @command("pin-gha", "Pins github actions to SHAs instead of tags")
 @argument_fn(
     cast(
         ParserFn,
         lambda p: p.add_argument(
-            "files", nargs="+", type=str, help="path to github actions file"
+            "files",
+            nargs="+",
+            type=str,
+            help="github actions files, directories or globs",
         ),
     )
 )
+@argument(
+    "-j",
+    "--jobs",
+    var="jobs",
+    required=False,
+    help=f"Number of repositories to query at once (default {PIN_JOBS})",
+)
+@argument(
+    "--refresh",
+    required=False,
+    help="Resolve every ref again, ignoring cached SHAs",
+)
+@argument(
+    "--resolver",
+    choices=RESOLVERS,
+    required=False,
+    help="How to resolve refs: git ls-remote (default), or the GitHub "
+    "GraphQL API (needs GITHUB_TOKEN), falling back to ls-remote",
+)
+@argument(
+    "--check",
+    required=False,
+    help="List unpinned refs and exit non-zero if any, without rewriting",
+)
 def pin_gha(context: Context, argv: Sequence[str] | None = None) -> int:
     """
     Any supplied Github action files containing references to branches or tags will be modified to
-    refer to specific SHAs instead.
+    refer to specific SHAs instead. Directories are searched for workflows
+    under .github directories, e.g. `.github/` or a whole workspace.
+
+    This process rewrites the action YAML files in place, when they change.
+
+    Resolved SHAs are cached across runs: release tags (v1.2.3) for
+    30 days, other tags (v4) for a day and branches for an hour. Files
+    which were fully pinned are skipped until they change.
 
-    This process rewrites the action YAML files in place.
+    With --check, nothing is resolved or rewritten, so there is no network
+    access.
     """
     args = context["args"]
-    files: list[str] = args.files
-
-    ACTION_VERSION_RE = re.compile(
-        r"(?<=uses: )(?P<action>.*)@(?P<ref>[^#\s]+)"
-    )
+    files = find_workflows(args.files)
+    index = PinIndex()
 
+    # read everything first, so that each distinct ref is resolved once
+    contents: dict[str, list[str]] = {}
     for fp in files:
-        with open(fp, "r+") as f:
-            newlines: list[str] = []
-            for line in f:
-                m = ACTION_VERSION_RE.search(line)
-                if not m:
-                    newlines.append(line)
-                    continue
-                d = m.groupdict()
-                sha = get_sha(extract_repo(d["action"]), ref=d["ref"])
-                if sha != d["ref"]:
-                    line = ACTION_VERSION_RE.sub(rf"\1@{sha} # \2", line)
-                newlines.append(line)
-            f.seek(0)
-            f.truncate()
-            f.writelines(newlines)
+        path = os.path.realpath(fp)
+        st = os.stat(path)
+        if index.is_pinned(path, st):
+            continue
+        with open(path, "rb") as f:
+            data = f.read()
+        digest = hashlib.sha256(data).hexdigest()
+        if index.has_digest(path, digest):
+            index.set(path, st, digest)
+            continue
+
+        lines = data.decode().splitlines(keepends=True)
+        if scan_refs(lines):
+            contents[fp] = lines
+        else:
+            index.set(path, st, digest)
+
+    if args.check:
+        index.save()
+        for fp, lines in contents.items():
+            for repo, ref in sorted(scan_refs(lines)):
+                print(f"{fp}: {repo}@{ref} is not pinned")
+        return 1 if contents else 0
+
+    refs = set().union(*(scan_refs(lines) for lines in contents.values()))
+    cache = RefCache()
+    try:
+        shas, errors = resolve_refs(
+            refs,
+            jobs=int(args.jobs or PIN_JOBS),
+            cache=cache,
+            refresh=args.refresh,
+            resolver=args.resolver or "ls-remote",
+        )
+    finally:
+        cache.save()
+    for (repo, ref), error in sorted(errors.items()):
+        logger.error("Could not resolve %s@%s: %s", repo, ref, error)
+
+    for fp, lines in contents.items():
+        path = os.path.realpath(fp)
+        pinned = pin_lines(lines, shas)
+        if pinned != lines:
+            fs.atomic_write(path, "".join(pinned))
+            print(f"Pinned {fp}")
+        digest = None
+        if not scan_refs(pinned):
+            digest = hashlib.sha256("".join(pinned).encode()).hexdigest()
+        index.set(path, os.stat(path), digest)
+    index.save()
 
-    return 0
+    return 1 if errors else 0
 
 
-@command("fetch", "Fetches a repository")
-@argument("repo", help="the repository to fetch")
+@command("fetch", "Fetches repositories")
+@argument_fn(
+    cast(
+        ParserFn,
+        lambda p: p.add_argument(
+            "repos", nargs="*", help="the repositories to fetch (owner/repo)"
+        ),
+    )
+)
+@argument(
+    "-m",
+    "--manifest",
+    var="manifest",
+    required=False,
+    help="File listing repositories to fetch, one per line",
+)
+@argument(
+    "-j",
+    "--jobs",
+    var="jobs",
+    required=False,
+    help=f"Number of repositories to clone at once (default {FETCH_JOBS})",
+)
+@argument(
+    "--git-cache",
+    required=False,
+    help="Borrow objects from the shared git cache (the git_cache setting)",
+)
+@argument(
+    "--retries",
+    var="retries",
+    required=False,
+    help=f"Times to retry a failed clone (default {FETCH_RETRIES})",
+)
 def main(context: Context, argv: Sequence[str] | None = None) -> ExitCode:
+    """
+    Clones repositories from GitHub into the workspace, several at a time.
+    Repositories which are already checked out are left alone.
+
+    A manifest lists one owner/repo per line; blank lines and anything after
+    a '#' are ignored.
+    """
     args = context["args"]
     workspace = context["workspace"]
 
-    if "/" not in args.repo:
+    repos: list[str] = list(args.repos)
+    if args.manifest:
+        repos.extend(read_manifest(args.manifest))
+    if not repos:
+        raise SystemExit("No repositories given")
+
+    invalid = [repo for repo in repos if repo.count("/") != 1]
+    if invalid:
         print("Repository names must be in the form of <owner>/<repo>")
         return 1
-    fetch(workspace, args.repo)
-    return 0
 
+    results = fetch_many(
+        workspace,
+        repos,
+        jobs=int(args.jobs or FETCH_JOBS),
+        retries=int(FETCH_RETRIES if args.retries is None else args.retries),
+        git_cache=True if args.git_cache else None,
+    )
+    return 1 if any(r.error for r in results) else 0
 
-def fetch(
-    workspace: str, repo: str, auth: bool = True, sync: bool = True
-) -> None:
-    org, slug = repo.split("/")
 
-    codepath = f"{workspace}/{slug}"
+def read_manifest(path: str) -> list[str]:
+    with open(path) as f:
+        return [
+            line.split("#", 1)[0].strip()
+            for line in f
+            if line.split("#", 1)[0].strip()
+        ]
 
-    if os.path.exists(codepath):
-        print(f"{codepath} already exists")
-        return
 
-    print(f"Fetching {repo} into {codepath}")
+def _clone_url(repo: str, auth: bool) -> str:
+    return f"git@github.com:{repo}" if auth else f"https://github.com/{repo}"
+
 
+def _clone_cmd(
+    workspace: str, repo: str, auth: bool, git_cache: bool = False
+) -> tuple[str, ...]:
     additional_args = (
-        (f"git@github.com:{repo}",)
+        (_clone_url(repo, auth),)
         if auth
         else (
             "--depth",
             "1",
             "--single-branch",
             f"--branch={os.environ['SENTRY_BRANCH']}",
-            f"https://github.com/{repo}",
+            _clone_url(repo, auth),
         )
     )
 
-    proc.run(
-        (
-            "git",
-            "-C",
-            workspace,
-            "clone",
-            "--filter=blob:none",
-            "--progress",
-            *additional_args,
-        ),
-        stdout=sys.stdout,
+    return (
+        "git",
+        "-C",
+        workspace,
+        "clone",
+        "--filter=blob:none",
+        "--progress",
+        *(gitcache.clone_args() if git_cache else ()),
+        *additional_args,
     )
 
 
+def fetch(
+    workspace: str, repo: str, auth: bool = True, sync: bool = True
+) -> None:
+    org, slug = repo.split("/")
+
+    codepath = f"{workspace}/{slug}"
+
+    if os.path.exists(codepath):
+        print(f"{codepath} already exists")
+        return
+
+    print(f"Fetching {repo} into {codepath}")
+
+    proc.run(_clone_cmd(workspace, repo, auth), stdout=sys.stdout)
+
+
+@dataclass(frozen=True)
+class FetchResult:
+    repo: str
+    path: str
+    cloned: bool
+    attempts: int
+    duration: float
+    error: str | None = None
+
+
+def _clone(
+    workspace: str,
+    repo: str,
+    auth: bool,
+    retries: int,
+    git_cache: bool,
+    status: StatusLine,
+) -> FetchResult:
+    codepath = f"{workspace}/{repo.split('/')[1]}"
+    if os.path.exists(codepath):
+        status.message(f"{codepath} already exists")
+        return FetchResult(repo, codepath, False, 0, 0.0)
+
+    start = time.monotonic()
+    cmd = _clone_cmd(workspace, repo, auth, git_cache)
+    attempt = 0
+    while True:
+        attempt += 1
+        status.update(repo, "starting")
+        output: list[str] = []
+        created = not os.path.exists(codepath)
+
+        def on_line(line: str) -> None:
+            line = line.removeprefix("remote: ").strip()
+            if line:
+                output.append(line)
+                status.update(repo, line.split(",", 1)[0])
+
+        try:
+            proc.run_lines(cmd, on_line)
+        except SystemExit as e:
+            # don't leave a partial checkout behind to be mistaken for one,
+            # but never remove a directory this attempt didn't make
+            if created:
+                shutil.rmtree(codepath, ignore_errors=True)
+            error = output[-1] if output else str(e)
+            if attempt > retries:
+                status.message(f"Failed to fetch {repo}: {error}", done=repo)
+                return FetchResult(
+                    repo,
+                    codepath,
+                    False,
+                    attempt,
+                    time.monotonic() - start,
+                    error,
+                )
+
+            delay = FETCH_BACKOFF * 2 ** (attempt - 1)
+            delay += random.uniform(0, FETCH_BACKOFF)
+            status.message(
+                f"Fetching {repo} failed ({error}); retrying in {delay:.0f}s"
+            )
+            status.update(repo, "waiting to retry")
+            time.sleep(delay)
+        else:
+            duration = time.monotonic() - start
+            status.message(
+                f"Fetched {repo} into {codepath} ({duration:.1f}s)", done=repo
+            )
+            return FetchResult(repo, codepath, True, attempt, duration)
+
+
+def fetch_many(
+    workspace: str,
+    repos: Sequence[str],
+    auth: bool = True,
+    jobs: int = FETCH_JOBS,
+    retries: int = FETCH_RETRIES,
+    git_cache: bool | None = None,
+) -> list[FetchResult]:
+    """
+    Clones `repos` into the workspace on a bounded pool, retrying failed
+    clones with exponential backoff. Clone progress is shown on a single
+    status line, followed by a summary.
+
+    With the git cache (by default, if the `git_cache` setting is on),
+    clones borrow objects from the shared cache. Repositories new to the
+    cache are registered and fetched into it before cloning; later
+    `devtools cache refresh-git` runs keep them up to date.
+    """
+    repos = list(dict.fromkeys(repos))
+    # every repository is cloned into a directory named after it, so
+    # repositories of the same name from different owners would collide
+    by_name: dict[str, list[str]] = {}
+    for repo in repos:
+        by_name.setdefault(repo.split("/")[1], []).append(repo)
+    conflicts = [names for names in by_name.values() if len(names) > 1]
+    if conflicts:
+        raise SystemExit(
+            "Repositories would be cloned into the same directory: "
+            + "; ".join(", ".join(names) for names in conflicts)
+        )
+
+    if git_cache is None:
+        git_cache = gitcache.is_enabled()
+    if git_cache:
+        cached = set(gitcache.remotes())
+        # registered up front; concurrent `git remote add`s would contend
+        # for the cache's config lock
+        for repo in repos:
+            gitcache.add(repo, _clone_url(repo, auth))
+        new = [repo for repo in repos if repo not in cached]
+        if new:
+            try:
+                gitcache.refresh(new, jobs=jobs)
+            except SystemExit as e:
+                # the clones can still fetch whatever the cache lacks
+                logger.warning("Could not fill the git cache: %s", e)
+
+    status = StatusLine()
+    try:
+        outcomes = parallel.run_all(
+            lambda repo: _clone(
+                workspace, repo, auth, retries, git_cache, status
+            ),
+            repos,
+            jobs=jobs,
+        )
+    finally:
+        status.close()
+
+    results = []
+    for outcome in outcomes:
+        if outcome.value is None:
+            # not a clone failure, something unexpected
+            raise SystemExit(f"Failed to fetch {outcome.item}: {outcome.error}")
+        results.append(outcome.value)
+
+    if len(results) > 1:
+        width = max(len(r.repo) for r in results)
+        print()
+        for r in results:
+            if r.error:
+                state = text.error_sty(f"failed after {r.attempts} attempts")
+            elif r.cloned:
+                retried = f" ({r.attempts} attempts)" if r.attempts > 1 else ""
+                state = text.label_sty(f"cloned{retried}")
+            else:
+                state = text.extra_sty("exists")
+            print(f"{r.repo:<{width}}  {r.duration:>6.1f}s  {state}")
+    return results
+
+
 module_info = ModuleDef(
     module_name=__name__, name="github", help="Github actions"
 )
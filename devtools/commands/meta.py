@@ -284,21 +284,21 @@ def mkpipe(context: Context, argv: Sequence[str] | None) -> ExitCode:
         ):
             return 0
 
-    venvs = repo.find_venvs()
+    venvs = {venv.name: venv for venv in repo.venvs()}
     if not venvs:
         raise SystemExit("No virtual env found")
 
     if len(venvs) > 2 and not args.env:
-        print(f"Multiple virtual environments found: {venvs}")
+        print(f"Multiple virtual environments found: {list(venvs)}")
         raise SystemExit("Target environment needs to be specified with --env")
 
     if args.env and args.env not in venvs:
         raise SystemExit(
-            f"Specified environment {args.env} not known; found: {venvs}"
+            f"Specified environment {args.env} not known; found: {list(venvs)}"
         )
 
-    venv = args.env if args.env else venvs[0]
-    interpreter = os.path.join(repo.get_venv(venv), "bin", "python")
+    venv = venvs[args.env] if args.env else next(iter(venvs.values()))
+    interpreter = venv.interpreter
 
     jenv = jinja.get_env(mkpipe)
     output = []
@@ -306,7 +306,7 @@ def mkpipe(context: Context, argv: Sequence[str] | None) -> ExitCode:
     template = jenv.get_template("script.jinja")
     output.append(template.render(interpreter=interpreter))
 
-    logger.info("Creating %s using env:%s", target, venv)
+    logger.info("Creating %s using env:%s", target, venv.name)
     with open(target, "w") as f:
         f.write("".join(output))
     os.chmod(target, 0o755)
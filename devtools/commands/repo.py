@@ -1,18 +1,33 @@
 """ A set of commands in repo """
 from __future__ import annotations
 
+import argparse
+import fnmatch
 import logging
 import os
+import sys
+import threading
+import time
+from collections.abc import Callable
 from collections.abc import Sequence
+from typing import cast
 
+from devtools import constants
 from devtools.internal import parsehelp
 from devtools.lib import jinja
+from devtools.lib import maintenance
+from devtools.lib import parallel
+from devtools.lib import proc
 from devtools.lib import text
+from devtools.lib import workspace
 from devtools.lib.context import Context
+from devtools.lib.modules import Action
 from devtools.lib.modules import argument
+from devtools.lib.modules import argument_fn
 from devtools.lib.modules import command
 from devtools.lib.modules import ExitCode
 from devtools.lib.modules import ModuleDef
+from devtools.lib.modules import ParserFn
 from devtools.lib.modules import require_repo
 
 logger = logging.getLogger(__name__)
@@ -49,25 +64,24 @@ def mkscript(context: Context, argv: Sequence[str] | None) -> ExitCode:
         ):
             return 0
 
-    venvs = repo.find_venvs()
+    venvs = {venv.name: venv for venv in repo.venvs()}
     if not venvs:
         raise SystemExit("No virtual env found")
 
     if len(venvs) > 2 and not args.env:
-        print(f"Multiple virtual environments found: {venvs}")
+        print(f"Multiple virtual environments found: {list(venvs)}")
         raise SystemExit("Target environment needs to be specified with --env")
 
     if args.env and args.env not in venvs:
         raise SystemExit(
-            f"Specified environment {args.env} not known; found: {venvs}"
+            f"Specified environment {args.env} not known; found: {list(venvs)}"
         )
 
-    venv = args.env if args.env else venvs[0]
-    interpreter = os.path.join(repo.get_venv(venv), "bin", "python")
-    if not os.path.exists(interpreter):
-        raise SystemExit(f"Python interpreter not found at {interpreter}")
+    venv = venvs[args.env] if args.env else next(iter(venvs.values()))
+    if not venv.exists:
+        raise SystemExit(f"Python interpreter not found at {venv.interpreter}")
 
-    interpreter = os.path.relpath(interpreter, repo.bin_path())
+    interpreter = os.path.relpath(venv.interpreter, repo.bin_path())
 
     arguments = []
     while True:
@@ -97,9 +111,332 @@ def mkscript(context: Context, argv: Sequence[str] | None) -> ExitCode:
                                   interpreter=interpreter,
                                   arguments=arguments))
 
-    logger.info("Creating %s using env:%s", target, venv)
+    logger.info("Creating %s using env:%s", target, venv.name)
     with open(target, "w") as f:
         f.write("".join(output))
     os.chmod(target, 0o755)
 
     return "mkscript executed successfully"
+
+
+@command("list", help="List the repositories in the workspace")
+@argument(
+    "-j",
+    "--jobs",
+    var="jobs",
+    required=False,
+    help=f"Number of repositories to scan at once (default {workspace.DEFAULT_JOBS})",
+)
+@argument(
+    "--no-status",
+    required=False,
+    help="Only list repositories, without their branch or dirty state",
+)
+def list_repos(context: Context, argv: Sequence[str] | None) -> ExitCode:
+    """
+    Lists the git checkouts and devtools-enabled directories in the
+    workspace, with their current branch. Repositories with modified
+    tracked files are marked with '*' (or '?' if that can't be determined).
+    """
+    args = context["args"]
+    jobs = int(args.jobs or workspace.DEFAULT_JOBS)
+
+    ws = workspace.Workspace(context["workspace"])
+    repos = ws.repos(jobs=jobs)
+    if args.no_status:
+        for repo in repos:
+            print(repo.name)
+        return 0
+
+    width = max((len(repo.name) for repo in repos), default=0)
+    for status in ws.status(repos, jobs=jobs):
+        mark = {True: "*", False: " ", None: "?"}[status.dirty]
+        if not status.repo.git_dir:
+            mark = " "
+        tags = " (devtools)" if status.repo.has_devtools else ""
+        print(
+            f"{status.repo.name:<{width}} {mark} {status.branch or '-'}{tags}"
+        )
+    return 0
+
+
+_output_lock = threading.Lock()
+
+
+def _write(output: str) -> None:
+    with _output_lock:
+        sys.stdout.write(output)
+        sys.stdout.flush()
+
+
+def _run_in(
+    repo: workspace.WorkspaceRepo, cmd: Sequence[str], prefix: str | None
+) -> tuple[int, str]:
+    """
+    Runs `cmd` in `repo`, returning its exit code and combined output. With
+    a `prefix`, output lines are instead written out as they arrive.
+    """
+    lines: list[str] = []
+
+    def on_line(line: str) -> None:
+        if prefix is None:
+            lines.append(f"{line}\n")
+        else:
+            _write(f"{prefix}{line}\n")
+
+    try:
+        code = proc.run_lines(cmd, on_line, cwd=repo.path)
+    except proc.CommandError as e:
+        code = int(e.code or 1)
+    except SystemExit as e:
+        # the command wasn't found
+        on_line(str(e))
+        code = 127
+    return code, "".join(lines)
+
+
+def _filter_argument(verb: str) -> Callable[[Action], Action]:
+    """A repeatable -f/--filter glob, see `_filter_repos`"""
+    return argument_fn(
+        cast(
+            ParserFn,
+            lambda p: p.add_argument(
+                "-f",
+                "--filter",
+                action="append",
+                metavar="glob",
+                help=f"Only {verb} repositories whose name matches "
+                "(repeatable)",
+            ),
+        )
+    )
+
+
+def _filter_repos(
+    repos: Sequence[workspace.WorkspaceRepo], globs: Sequence[str] | None
+) -> list[workspace.WorkspaceRepo]:
+    """The repositories whose name matches any of `globs`, if given"""
+    if not globs:
+        return list(repos)
+    return [
+        repo
+        for repo in repos
+        if any(fnmatch.fnmatch(repo.name, glob) for glob in globs)
+    ]
+
+
+@command("foreach", help="Run a command in every repository of the workspace")
+@argument(
+    "-j",
+    "--jobs",
+    var="jobs",
+    required=False,
+    help="Number of repositories to run in at once (default: CPU count)",
+)
+@_filter_argument("run in")
+@argument(
+    "-g",
+    "--group",
+    required=False,
+    help="Print each repository's output in one block once it finishes",
+)
+@argument(
+    "--fail-fast",
+    required=False,
+    help="Don't start any more repositories once one has failed",
+)
+@argument(
+    "-d",
+    "--devtools",
+    required=False,
+    help="Run a devtools command instead of an executable",
+)
+@argument_fn(
+    cast(
+        ParserFn,
+        lambda p: p.add_argument(
+            "cmd",
+            nargs=argparse.REMAINDER,
+            help="command to run; a single argument is run by the shell",
+        ),
+    )
+)
+def foreach(context: Context, argv: Sequence[str] | None) -> ExitCode:
+    """
+    Runs a command in every repository of the workspace (see `repo list`),
+    or those matching --filter, several at a time.
+
+        devtools repo foreach -j 8 -- git fetch --prune
+        devtools repo foreach -f 'sentry*' 'make lint | tail -n1'
+        devtools repo foreach --devtools -- repo list
+
+    Output lines are prefixed with the repository name unless --group is
+    given. A summary of exit codes and durations is printed at the end, and
+    the exit code is non-zero if the command failed anywhere.
+    """
+    args = context["args"]
+    cmd: list[str] = list(args.cmd)
+    if cmd[:1] == ["--"]:
+        cmd = cmd[1:]
+    if not cmd:
+        raise SystemExit("No command given")
+
+    if args.devtools:
+        cmd = [sys.executable, "-m", constants.APP_NAME, *cmd]
+    elif len(cmd) == 1:
+        cmd = [constants.shell_path, "-c", cmd[0]]
+
+    repos = workspace.Workspace(context["workspace"]).repos()
+    repos = _filter_repos(repos, args.filter)
+    if not repos:
+        raise SystemExit("No matching repositories found")
+
+    width = max(len(repo.name) for repo in repos)
+
+    def run(repo: workspace.WorkspaceRepo) -> tuple[int, str]:
+        if args.group:
+            return _run_in(repo, cmd, None)
+        prefix = f"{text.label_sty(repo.name.ljust(width))} | "
+        return _run_in(repo, cmd, prefix)
+
+    def report(
+        outcome: parallel.Outcome[workspace.WorkspaceRepo, tuple[int, str]]
+    ) -> None:
+        if not args.group or outcome.value is None:
+            return
+        code, output = outcome.value
+        header = f"{outcome.item.name} (exit {code}, {outcome.duration:.1f}s)"
+        _write(f"{text.banner(header)}\n{output}")
+
+    outcomes = parallel.run_all(
+        run,
+        repos,
+        jobs=int(args.jobs) if args.jobs else None,
+        fail_fast=args.fail_fast,
+        failed=lambda o: o.value is None or o.value[0] != 0,
+        on_done=report,
+    )
+
+    failures = 0
+    print()
+    for outcome in outcomes:
+        if outcome.skipped:
+            status, duration = text.extra_sty("skipped"), "-"
+        elif outcome.value is None:
+            status, duration = text.error_sty(f"error: {outcome.error}"), "-"
+        else:
+            code = outcome.value[0]
+            status = (
+                text.label_sty("ok")
+                if code == 0
+                else text.error_sty(f"exit {code}")
+            )
+            duration = f"{outcome.duration:.1f}s"
+        if outcome.skipped or outcome.value is None or outcome.value[0]:
+            failures += 1
+        print(f"{outcome.item.name:<{width}}  {duration:>7}  {status}")
+
+    return 1 if failures else 0
+
+
+@command("maintain", help="Run and schedule git maintenance for the workspace")
+@argument(
+    "-j",
+    "--jobs",
+    var="jobs",
+    required=False,
+    help="Number of repositories to maintain at once (default 2)",
+)
+@_filter_argument("maintain")
+@argument_fn(
+    cast(
+        ParserFn,
+        lambda p: p.add_argument(
+            "-t",
+            "--task",
+            action="append",
+            choices=maintenance.TASKS,
+            help="Tasks to run and schedule (repeatable; default all)",
+        ),
+    )
+)
+@argument(
+    "--schedule",
+    required=False,
+    help="Also install git's system scheduler (`git maintenance start`)",
+)
+@argument(
+    "--no-run",
+    required=False,
+    help="Only register repositories, without running maintenance now",
+)
+@argument(
+    "--status",
+    required=False,
+    help="Show when each repository was last maintained, and exit",
+)
+def maintain(context: Context, argv: Sequence[str] | None) -> ExitCode:
+    """
+    Registers the workspace's repositories for scheduled `git maintenance`
+    (prefetch, commit-graph, loose-objects and incremental-repack), then
+    runs those tasks now at low CPU and I/O priority, a few repositories at
+    a time, so that pulls and fetches stay fast. Linked worktrees are
+    skipped since their main checkout covers them.
+    """
+    args = context["args"]
+    tasks = args.task or maintenance.TASKS
+
+    repos = [
+        repo
+        for repo in workspace.Workspace(context["workspace"]).repos()
+        if repo.git_dir and not maintenance.is_worktree(repo)
+    ]
+    repos = _filter_repos(repos, args.filter)
+    if not repos:
+        raise SystemExit("No matching repositories found")
+
+    width = max(len(repo.name) for repo in repos)
+
+    if args.status:
+        stats = maintenance.load_stats()
+        for repo in repos:
+            last = stats.get(repo.path)
+            if last is None:
+                print(f"{repo.name:<{width}}  never")
+                continue
+            when = time.strftime("%Y-%m-%d %H:%M", time.localtime(last.started))
+            state = "ok" if last.code == 0 else f"exit {last.code}"
+            print(
+                f"{repo.name:<{width}}  {when}  {last.duration:>6.1f}s  {state}"
+            )
+        return 0
+
+    # registering writes the global git config, so one at a time
+    for repo in repos:
+        maintenance.register(repo, tasks)
+    if args.schedule:
+        maintenance.schedule()
+    print(f"Registered {len(repos)} repositories for git maintenance")
+    if args.no_run:
+        return 0
+
+    status = text.StatusLine()
+
+    def run(repo: workspace.WorkspaceRepo) -> maintenance.RunStats:
+        status.update(repo.name, "running")
+        stats = maintenance.run(repo, tasks)
+        state = "done" if stats.code == 0 else f"failed: {stats.error}"
+        status.message(
+            f"{repo.name}: {state} ({stats.duration:.1f}s)", done=repo.name
+        )
+        return stats
+
+    try:
+        outcomes = parallel.run_all(run, repos, jobs=int(args.jobs or 2))
+    finally:
+        status.close()
+
+    maintenance.save_stats(
+        {o.item.path: o.value for o in outcomes if o.value is not None}
+    )
+    return 1 if any(o.value is None or o.value.code for o in outcomes) else 0
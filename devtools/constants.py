@@ -46,6 +46,9 @@ root = os.path.join(os.path.expanduser("~/.local/share/"), APP_FULLNAME)
 
 config = os.getenv("CONFIG_PATH", os.path.join(root, "config.ini"))
 
+# content-addressed download cache, keyed by sha256
+cache_root = os.path.join(home, ".cache", APP_FULLNAME)
+
 homebrew_repo = "/opt/homebrew"
 homebrew_bin = f"{homebrew_repo}/bin"
 if INTEL_MAC:
@@ -1,8 +1,9 @@
 from __future__ import annotations
 
 import configparser
-import functools
+import hashlib
 import logging
+import marshal
 import os
 import sys
 from collections.abc import Callable
@@ -44,30 +45,140 @@ def read_config(path: str) -> configparser.ConfigParser:
     return config
 
 
-@functools.lru_cache(maxsize=None)
+# path -> ((mtime_ns, size) or None if missing, parsed config)
+_config_cache: dict[
+    str, tuple[tuple[int, int] | None, configparser.ConfigParser]
+] = {}
+
+
+def _stat_key(path: str) -> tuple[int, int] | None:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
 def get_config(config_path: str | None = None) -> configparser.ConfigParser:
-    """Reads a configuration file from disk, with caching"""
+    """
+    Reads a configuration file from disk, with caching
+
+    The cached copy is reused until the file's mtime or size changes, so
+    callers must treat the result as read-only.
+    """
     if not config_path:
         config_path = constants.config
 
-    config = configparser.ConfigParser()
-    config.read(config_path)
+    key = _stat_key(config_path)
+    cached = _config_cache.get(config_path)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+
+    logger.debug("Parsing config %s", config_path)
+    config = read_config(config_path)
+    _config_cache[config_path] = key, config
     return config
 
 
-def verify_config(
-    section: str, opts: Sequence[ConfigOpt], config_path: str | None = None
-) -> bool:
-    """Checks to ensure that the configuration exists and is complete"""
-    config = configparser.ConfigParser()
-    config_path = config_path or constants.config
-
-    # Read existing configuration, if present
-    if os.path.exists(config_path):
-        config.read(config_path)
+def clear_config_cache(config_path: str | None = None) -> None:
+    if config_path:
+        _config_cache.pop(config_path, None)
     else:
-        return False
-
+        _config_cache.clear()
+
+
+class ConfigSnapshot:
+    """
+    A read-only, merged view of several configuration files.
+
+    Snapshots are compiled with marshal next to the user configuration and
+    reused for as long as none of their source files change, so loading one
+    costs a stat per source and a single read. The INI files remain the
+    source of truth.
+    """
+
+    def __init__(self, sections: dict[str, dict[str, str]]) -> None:
+        self._sections = sections
+
+    def sections(self) -> list[str]:
+        return list(self._sections)
+
+    def has_section(self, section: str) -> bool:
+        return section in self._sections
+
+    def get(
+        self, section: str, option: str, *, fallback: str | None = None
+    ) -> str | None:
+        return self._sections.get(section, {}).get(option.lower(), fallback)
+
+
+SNAPSHOT_VERSION = 1
+
+
+def _flatten(config: configparser.ConfigParser) -> dict[str, dict[str, str]]:
+    sections: dict[str, dict[str, str]] = {}
+    for section in config.sections():
+        values = sections[section] = {}
+        for option in config.options(section):
+            try:
+                values[option] = config.get(section, option)
+            except configparser.InterpolationError:
+                values[option] = config.get(section, option, raw=True)
+    return sections
+
+
+def _snapshot_path(sources: Sequence[str]) -> str:
+    digest = hashlib.sha1("\0".join(sources).encode()).hexdigest()[:16]
+    return os.path.join(constants.root, "cache", f"config-{digest}.marshal")
+
+
+def load_snapshot(reporoot: str | None = None) -> ConfigSnapshot:
+    """
+    Loads the user configuration merged with the repository's
+    .devtools/config.ini, if any; the repository's values take precedence.
+    """
+    sources = [constants.config]
+    if reporoot:
+        sources.append(os.path.join(reporoot, constants.APP_DIR, "config.ini"))
+    keys = [_stat_key(source) for source in sources]
+
+    path = _snapshot_path(sources)
+    try:
+        with open(path, "rb") as f:
+            version, stored_sources, stored_keys, sections = marshal.load(f)
+        if (version, stored_sources, stored_keys) == (
+            SNAPSHOT_VERSION,
+            sources,
+            keys,
+        ):
+            return ConfigSnapshot(sections)
+    except (OSError, EOFError, ValueError, TypeError):
+        pass
+
+    sections = {}
+    for source in sources:
+        for section, values in _flatten(get_config(source)).items():
+            sections.setdefault(section, {}).update(values)
+
+    # Nothing is written for a user who hasn't configured devtools yet
+    if os.path.isdir(constants.root):
+        # fs imports this module
+        from devtools.lib import fs
+
+        try:
+            with fs.atomic_path(path) as tmp, open(tmp, "wb") as f:
+                marshal.dump((SNAPSHOT_VERSION, sources, keys, sections), f)
+        except OSError as e:
+            logger.debug("Could not write config snapshot: %s", e)
+
+    return ConfigSnapshot(sections)
+
+
+def is_complete(
+    config: configparser.ConfigParser | ConfigSnapshot,
+    section: str,
+    opts: Sequence[ConfigOpt],
+) -> bool:
     if not config.has_section(section):
         return False
 
@@ -79,22 +190,36 @@ def verify_config(
     return True
 
 
+def verify_config(
+    section: str, opts: Sequence[ConfigOpt], config_path: str | None = None
+) -> bool:
+    """Checks to ensure that the configuration exists and is complete"""
+    config_path = config_path or constants.config
+
+    # Read existing configuration, if present
+    if not os.path.exists(config_path):
+        return False
+
+    return is_complete(get_config(config_path), section, opts)
+
+
 def update_config(
     section: str,
     opts: Sequence[ConfigOpt],
     overrides: Config | None = None,
     config_path: str | None = None,
 ) -> None:
-    config = configparser.ConfigParser()
     needs_save = False
 
     if not config_path:
         config_path = constants.config
 
-    # Read existing configuration, if present
+    # Read existing configuration, if present. This copy is modified, so it
+    # must not be the shared cached one.
     if os.path.exists(config_path):
-        config.read(config_path)
+        config = read_config(config_path)
     else:
+        config = configparser.ConfigParser()
         os.makedirs(os.path.dirname(config_path), exist_ok=True)
 
     if not config.has_section(section):
@@ -132,7 +257,7 @@ def save_config(config_path: str, config: configparser.ConfigParser) -> None:
     with open(config_path, "w") as f:
         config.write(f)
 
-    get_config.cache_clear()
+    clear_config_cache(config_path)
 
 
 def get_repo(reporoot: str) -> configparser.ConfigParser:
@@ -1,23 +1,37 @@
 from __future__ import annotations
 
 import contextlib
+import fcntl
 import hashlib
+import http.client
+import json
 import logging
 import os
 import secrets
+import shutil
+import stat
 import tarfile
 import tempfile
 import urllib.parse
-import urllib.request
 from collections.abc import Iterator
-from urllib.error import HTTPError
+from collections.abc import Sequence
+from typing import cast
+from typing import TypeAlias
 
+from devtools.constants import cache_root
 from devtools.constants import home
 from devtools.constants import shell
+from devtools.lib import config
+from devtools.lib import httpclient
 from devtools.lib import text
 
 logger = logging.getLogger(__name__)
 
+CHUNK_SIZE = 1024 * 1024
+
+# seconds to wait on a mirror before moving on (the `mirror_timeout` setting)
+MIRROR_TIMEOUT = 10.0
+
 
 def shellrc() -> str:
     if shell == "zsh":
@@ -29,49 +43,138 @@ def shellrc() -> str:
     raise NotImplementedError(f"unsupported shell: {shell}")
 
 
-def idempotent_add(filepath: str, text: str, trim: bool = True) -> None:
-    text = text.strip()
-    if trim:
-        new_lines = text.split()
+def _contains(haystack: Sequence[str], needle: Sequence[str]) -> bool:
+    """Knuth-Morris-Pratt search for a contiguous run of tokens"""
+    if not needle:
+        return True
+
+    # failure[i] is the length of the longest proper prefix of
+    # needle[: i + 1] which is also a suffix of it
+    failure = [0] * len(needle)
+    k = 0
+    for i in range(1, len(needle)):
+        while k and needle[i] != needle[k]:
+            k = failure[k - 1]
+        if needle[i] == needle[k]:
+            k += 1
+        failure[i] = k
+
+    k = 0
+    for token in haystack:
+        while k and token != needle[k]:
+            k = failure[k - 1]
+        if token == needle[k]:
+            k += 1
+            if k == len(needle):
+                return True
+    return False
+
+
+def _tokenize(text: str, trim: bool) -> list[str]:
+    return text.split() if trim else text.split("\n")
+
+
+def idempotent_add_many(
+    filepath: str, texts: Sequence[str], trim: bool = True
+) -> None:
+    """
+    Appends each snippet in `texts` to `filepath` unless it is already present.
+
+    The file is read once, and every missing snippet is appended with a single
+    atomic write. With `trim`, snippets are compared token by token ignoring
+    whitespace; otherwise they are compared line by line.
+    """
+    if os.path.exists(filepath):
+        filepath = os.path.realpath(filepath)
+        with open(filepath, "r") as f:
+            contents = f.read()
+        exists = True
     else:
-        new_lines = text.split("\n")
-
-    if not new_lines:
+        contents = ""
+        exists = False
+
+    existing = _tokenize(contents, trim)
+    additions: list[str] = []
+
+    for snippet in texts:
+        snippet = snippet.strip()
+        new_lines = _tokenize(snippet, trim)
+
+        if not new_lines:
+            continue
+
+        # a missing file gets its first snippet unconditionally
+        if exists or additions:
+            if _contains(existing, new_lines):
+                continue
+
+        if not trim and (not contents or contents[-1] == "\n"):
+            # the trailing "" after the final newline becomes the new text
+            existing.pop()
+        existing.extend(new_lines)
+        if not trim:
+            existing.append("")
+
+        addition = f"{snippet}\n"
+        if contents and contents[-1] != "\n":
+            addition = f"\n{addition}"
+        additions.append(addition)
+        contents += addition
+
+    if not additions:
         return
 
-    if not os.path.exists(filepath):
+    if not exists:
         with open(filepath, "w") as f:
-            f.write(f"{text}\n")
-            return
-    with open(filepath, "r+") as f:
-        contents = f.read()
-
-        if trim:
-            existing_lines = contents.split()
-        else:
-            existing_lines = contents.split("\n")
-
-        start = new_lines[0]
-        if len(existing_lines) >= len(new_lines):
-            scan_range = existing_lines[
-                : len(existing_lines) - (len(new_lines)) + 1
-            ]
-        else:
-            scan_range = []
-
-        for x, current in enumerate(scan_range):
-            if current == start:
-                for y, line in enumerate(new_lines):
-                    if existing_lines[x + y] != line:
-                        break
-                else:
-                    # Found
-                    break
-        else:
-            # Never found
-            if contents and contents[-1] != "\n":
-                f.write("\n")
-            f.write(f"{text}\n")
+            f.write(contents)
+        return
+
+    atomic_write(filepath, contents)
+
+
+def atomic_write(filepath: str, contents: str) -> None:
+    """
+    Replaces an existing file's contents all at once, keeping its mode;
+    readers see either the old or the new contents, never a partial write.
+    """
+    filepath = os.path.realpath(filepath)
+    with atomic_path(filepath) as tmp:
+        with open(tmp, "w") as f:
+            f.write(contents)
+        shutil.copymode(filepath, tmp)
+
+
+def read_json(path: str, version: int) -> dict[str, object]:
+    """
+    Reads a JSON object written by `write_json`; an unreadable file or one
+    with another "version" reads as empty.
+    """
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(data, dict) or data.get("version") != version:
+        return {}
+    return cast("dict[str, object]", data)
+
+
+def write_json(path: str, data: dict[str, object]) -> bool:
+    """
+    Atomically replaces `path` with `data`, creating it readable only by
+    the owner. Failures are logged and return False.
+    """
+    try:
+        with atomic_path(path) as tmp, open(tmp, "w") as f:
+            json.dump(data, f)
+    except OSError as e:
+        logger.warning("Could not save %s: %s", path, e)
+        return False
+    return True
+
+
+def idempotent_add(filepath: str, text: str, trim: bool = True) -> None:
+    idempotent_add_many(filepath, (text,), trim=trim)
 
 
 def write_file(filepath: str, text: str, mode: int = 0o664) -> None:
@@ -135,19 +238,25 @@ def checksum(path: str) -> str:
         return sha.hexdigest()
 
 
-def retrieve_file(url: str, path: str, sha256: str | None = None) -> None:
-    logger.debug("Retrieving %s to %s", url, path)
-
-    def reporter(block: int, received: int, size: int) -> None:
-        logger.debug("Downloading%s", text.decoration_sty("." * block))
-
-    try:
-        urllib.request.urlretrieve(url, path, reporthook=reporter)
-    except HTTPError as e:
-        raise SystemExit(f"Error getting {url}: {e}")
+def _retrieve(
+    url: str,
+    path: str,
+    sha256: str | None,
+    timeout: float = httpclient.DEFAULT_TIMEOUT,
+) -> None:
+    sha = hashlib.sha256()
+    with httpclient.urlopen("GET", url, timeout=timeout) as response, open(
+        path, "wb"
+    ) as f:
+        for block, buf in enumerate(
+            iter(lambda: response.read(CHUNK_SIZE), b"")
+        ):
+            logger.debug("Downloading%s", text.decoration_sty("." * block))
+            sha.update(buf)
+            f.write(buf)
 
     if sha256:
-        other256 = checksum(path)
+        other256 = sha.hexdigest()
 
         if not secrets.compare_digest(other256, sha256):
             raise RuntimeError(
@@ -157,6 +266,43 @@ def retrieve_file(url: str, path: str, sha256: str | None = None) -> None:
             )
 
 
+def retrieve_file(url: str, path: str, sha256: str | None = None) -> None:
+    logger.debug("Retrieving %s to %s", url, path)
+
+    try:
+        _retrieve(url, path, sha256)
+    except httpclient.HTTPError as e:
+        raise SystemExit(f"Error getting {url}: {e}")
+
+
+def mirror_timeout() -> float:
+    value = config.get_value("mirror_timeout")
+    try:
+        return float(value) if value else MIRROR_TIMEOUT
+    except ValueError:
+        logger.warning("Ignoring invalid mirror_timeout %r", value)
+        return MIRROR_TIMEOUT
+
+
+def mirror_urls(url: str, sha256: str) -> list[str]:
+    """
+    Returns the mirrors configured for an artifact, in the order to try them.
+
+    Each line of the `mirrors` setting is either a base url, which serves
+    artifacts by sha256 (e.g. another machine's `devtools cache serve`), or
+    a `<prefix> <replacement>` pair which rewrites matching upstream urls.
+    Mirrors are safe to use since every download is verified by its sha256.
+    """
+    urls = []
+    for line in (config.get_value("mirrors") or "").splitlines():
+        match line.split():
+            case [base]:
+                urls.append(f"{base.rstrip('/')}/{sha256}")
+            case [prefix, replacement] if url.startswith(prefix):
+                urls.append(f"{replacement}{url[len(prefix):]}")
+    return urls
+
+
 def atomic_replace(src: str, dest: str) -> None:
     if os.path.dirname(src) != os.path.dirname(dest):
         raise RuntimeError(
@@ -165,11 +311,76 @@ def atomic_replace(src: str, dest: str) -> None:
     os.replace(src, dest)
 
 
+@contextlib.contextmanager
+def atomic_path(path: str) -> Iterator[str]:
+    """
+    Yields a temporary path next to `path` to write the new contents to;
+    it replaces `path` once the block completes, so readers see either the
+    old or the new contents, never a partial write. The temporary file is
+    removed if anything fails, and is created readable only by the owner.
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(
+        prefix=f".{os.path.basename(path)}.", dir=directory
+    )
+    os.close(fd)
+    try:
+        yield tmp
+        atomic_replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+@contextlib.contextmanager
+def _lock(path: str) -> Iterator[None]:
+    """
+    Holds an exclusive advisory lock on `path`.lock for the duration.
+
+    flock(2) locks are released by the kernel when their holder exits, so a
+    crashed process never leaves a lock behind; the lock file itself is
+    intentionally never removed.
+    """
+    lockpath = f"{path}.lock"
+    while True:
+        f = open(lockpath, "a+")
+        try:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                f.seek(0)
+                holder = f.read().strip() or "unknown"
+                logger.info(
+                    "Waiting for process %s to finish with %s", holder, path
+                )
+                fcntl.flock(f, fcntl.LOCK_EX)
+
+            # the lock file may have been removed while we waited
+            try:
+                current = os.stat(lockpath)
+            except FileNotFoundError:
+                continue
+            if not os.path.samestat(current, os.fstat(f.fileno())):
+                continue
+
+            f.seek(0)
+            f.truncate()
+            f.write(f"{os.getpid()}\n")
+            f.flush()
+            try:
+                yield
+            finally:
+                f.truncate(0)
+            return
+        finally:
+            f.close()
+
+
 def download(url: str, sha256: str, dest: str = "") -> str:
     """Downloads a file to the cache directory using sha256 as a unique identifier or a target path name"""
     if not dest:
-        cache_root = f"{home}/.cache/sentry-devtools"
-        dest = f"{cache_root}/{sha256}"
+        dest = os.path.join(cache_root, sha256)
 
     if os.path.isdir(dest):
         raise SystemExit(f"Destination {dest} is a directory")
@@ -181,22 +392,151 @@ def download(url: str, sha256: str, dest: str = "") -> str:
     if not os.path.exists(target_dir):
         os.makedirs(target_dir, exist_ok=True)
 
-    # Make an empty file
-    fd, local_tmp = tempfile.mkstemp(suffix=".url", dir=target_dir)
-    os.close(fd)
+    # Only one process downloads a given destination at a time; the others
+    # wait for it and then reuse its result.
+    with _lock(dest):
+        if os.path.exists(dest):
+            logger.debug("%s was downloaded by another process", dest)
+            return dest
+
+        # Only the lock holder writes here, so anything already present was
+        # left behind by a process which died mid-download.
+        local_tmp = f"{dest}.part"
+        try:
+            timeout = mirror_timeout()
+            for mirror in mirror_urls(url, sha256):
+                try:
+                    _retrieve(mirror, local_tmp, sha256, timeout=timeout)
+                    break
+                except (
+                    httpclient.HTTPError,
+                    http.client.HTTPException,
+                    OSError,
+                    RuntimeError,
+                ) as e:
+                    logger.warning("Mirror %s failed: %s", mirror, e)
+            else:
+                retrieve_file(url, local_tmp, sha256=sha256)
+
+            # Swap!
+            atomic_replace(local_tmp, dest)
+
+        finally:
+            if os.path.exists(local_tmp):
+                os.remove(local_tmp)
+    return dest
+
+
+UNPACK_MANIFEST = ".devtools-unpack.json"
+
+# (kind, size, mode) as observed on disk right after extraction
+MemberState: TypeAlias = "tuple[str, int, int]"
+
+
+def _member_kind(member: tarfile.TarInfo) -> str:
+    if member.isdir():
+        return "d"
+    if member.issym():
+        return "l"
+    if member.isfile():
+        return "f"
+    return "o"
+
+
+def _observe(path: str, kind: str) -> MemberState:
+    st = os.lstat(path)
+    size = st.st_size if kind == "f" else 0
+    return kind, size, stat.S_IMODE(st.st_mode)
+
+
+def _is_intact(path: str, state: MemberState) -> bool:
+    kind, size, mode = state
     try:
-        retrieve_file(url, local_tmp, sha256=sha256)
+        st = os.lstat(path)
+    except FileNotFoundError:
+        return False
 
-        # Swap!
-        atomic_replace(local_tmp, dest)
+    if kind == "f":
+        return (
+            stat.S_ISREG(st.st_mode)
+            and st.st_size == size
+            and stat.S_IMODE(st.st_mode) == mode
+        )
+    if kind == "d":
+        return stat.S_ISDIR(st.st_mode)
+    if kind == "l":
+        return stat.S_ISLNK(st.st_mode)
+    return True
 
-    finally:
-        if os.path.exists(local_tmp):
-            os.remove(local_tmp)
-    return dest
+
+def _is_dir(path: str) -> bool:
+    return stat.S_ISDIR(os.lstat(path).st_mode)
+
+
+def _read_manifest(into: str, sha256: str) -> dict[str, MemberState] | None:
+    try:
+        with open(os.path.join(into, UNPACK_MANIFEST)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if manifest.get("sha256") != sha256:
+        return None
+
+    return {
+        name: (kind, size, mode)
+        for name, (kind, size, mode) in manifest["members"].items()
+    }
+
+
+def _write_manifest(
+    into: str, sha256: str, members: dict[str, MemberState]
+) -> None:
+    with atomic_path(os.path.join(into, UNPACK_MANIFEST)) as tmp:
+        with open(tmp, "w") as f:
+            json.dump({"sha256": sha256, "members": members}, f)
 
 
-def unpack(path: str, into: str) -> None:
+def unpack(path: str, into: str, sha256: str | None = None) -> None:
+    """
+    Extracts a tarball into a directory.
+
+    A manifest of the extracted members, tagged with the archive's sha256,
+    is left behind in `into`. When the same archive is unpacked again, the
+    members are verified with a stat each and only missing or damaged ones
+    are extracted; an intact tree is left untouched.
+    """
     os.makedirs(into, exist_ok=True)
+    sha256 = sha256 or checksum(path)
+
+    manifest = _read_manifest(into, sha256)
+    if manifest is not None:
+        damaged = {
+            name
+            for name, state in manifest.items()
+            if not _is_intact(os.path.join(into, name), state)
+        }
+        if not damaged:
+            logger.debug("%s already unpacked into %s", path, into)
+            return
+        logger.debug("Re-extracting %d damaged members", len(damaged))
+    else:
+        damaged = None
+
     with tarfile.open(name=path, mode="r:*") as tarf:
-        tarf.extractall(into)
+        members = tarf.getmembers()
+        if damaged is not None:
+            members = [m for m in members if m.name in damaged]
+            for member in members:
+                target = os.path.join(into, member.name)
+                if os.path.lexists(target) and not _is_dir(target):
+                    os.remove(target)
+        tarf.extractall(into, members=members)
+
+    if manifest is None:
+        manifest = {}
+    for member in members:
+        kind = _member_kind(member)
+        manifest[member.name] = _observe(os.path.join(into, member.name), kind)
+
+    _write_manifest(into, sha256, manifest)
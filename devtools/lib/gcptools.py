@@ -1,17 +1,28 @@
 from __future__ import annotations
 
 import configparser
+import datetime
 import json
 import logging
+import os
+import re
+import subprocess
 import sys
-import urllib.error
+import time
 import urllib.parse
-import urllib.request
 from collections import namedtuple
+from collections.abc import Callable
 from collections.abc import Sequence
+from typing import cast
 from typing import Dict
 
+from devtools import constants
+from devtools.lib import fs
+from devtools.lib import httpclient
+from devtools.lib import parallel
 from devtools.lib import proc
+from devtools.lib.config import get_value
+from devtools.lib.config import load_snapshot
 from devtools.lib.proc import CommandError
 from devtools.lib.repository import Repository
 
@@ -20,9 +31,128 @@ logger = logging.getLogger(__name__)
 
 Identity = namedtuple("Identity", ["account", "token", "expiration"])
 
+IAM_API = "https://iamcredentials.googleapis.com/v1"
+DEFAULT_SCOPES = (
+    "profile",
+    "email",
+    "https://www.googleapis.com/auth/userinfo.email",
+    "https://www.googleapis.com/auth/userinfo.profile",
+    "https://www.googleapis.com/auth/cloud-platform",
+)
+
+# concurrent generateAccessToken calls in sudo_many
+MINT_JOBS = 8
+
+# seconds before expiry at which a cached token is no longer handed out
+TOKEN_MARGIN = 300
+TOKEN_CACHE_VERSION = 1
+
+# how often a token refresher checks on the process it serves, and waits
+# at least between renewals
+REFRESH_POLL = 5.0
+REFRESH_MIN_INTERVAL = 30.0
+
+
+def gcloud_config_dir() -> str:
+    return constants.user_environ.get("CLOUDSDK_CONFIG") or os.path.join(
+        constants.home, ".config", "gcloud"
+    )
+
+
+def current_account() -> str | None:
+    """
+    The active gcloud account, read from gcloud's configuration files
+    rather than by running gcloud
+    """
+    env = constants.user_environ
+    if env.get("CLOUDSDK_CORE_ACCOUNT"):
+        return env["CLOUDSDK_CORE_ACCOUNT"]
+
+    config_dir = gcloud_config_dir()
+    name = env.get("CLOUDSDK_ACTIVE_CONFIG_NAME")
+    if not name:
+        try:
+            with open(os.path.join(config_dir, "active_config")) as f:
+                name = f.read().strip()
+        except OSError:
+            name = "default"
+
+    parser = configparser.ConfigParser()
+    try:
+        parser.read(
+            os.path.join(config_dir, "configurations", f"config_{name}")
+        )
+    except configparser.Error:
+        return None
+    return parser.get("core", "account", fallback=None) or None
+
+
+def token_margin() -> int:
+    """Seconds of validity a cached token must have left to be reused"""
+    value = get_value("gcp_token_margin")
+    try:
+        return int(value) if value else TOKEN_MARGIN
+    except ValueError:
+        logger.warning("Ignoring invalid gcp_token_margin %r", value)
+        return TOKEN_MARGIN
+
+
+def _expires_at(expiration: str) -> float:
+    # RFC 3339, with up to nanoseconds: 2014-10-02T15:01:23.045123456Z
+    return datetime.datetime.fromisoformat(
+        re.sub(r"\.\d+", "", expiration)
+    ).timestamp()
+
+
+def identity_cache_path() -> str:
+    return os.path.join(constants.root, "cache", "gcloud-identity.json")
+
+
+def cached_identity() -> Identity | None:
+    """
+    The identity saved by the last `get_identity`, if it is still the
+    active account and its token is valid for `token_margin()` more seconds
+    """
+    account = current_account()
+    data = fs.read_json(identity_cache_path(), version=TOKEN_CACHE_VERSION)
+    entry = cast("list[str] | None", data.get("identity"))
+    if account is None or entry is None:
+        return None
+    identity = Identity(*entry)
+    if identity.account != account or not identity.expiration:
+        return None
+    if _expires_at(identity.expiration) - token_margin() <= time.time():
+        return None
+    return identity
+
+
+def forget_identity() -> None:
+    """Drops the identity saved by `get_identity`"""
+    try:
+        os.remove(identity_cache_path())
+    except FileNotFoundError:
+        pass
+
+
+def _is_rejected(error: BaseException | None) -> bool:
+    """Whether the IAM API refused the caller's own credentials"""
+    return isinstance(error, httpclient.HTTPError) and error.status in (
+        401,
+        403,
+    )
+
+
+def get_identity(refresh: bool = False) -> Identity:
+    """
+    Pulls the current identity from gcloud, reusing the one from a previous
+    call while its token is valid (unless `refresh`)
+    """
+    if not refresh:
+        cached = cached_identity()
+        if cached is not None:
+            logger.debug("Using cached identity for %s", cached.account)
+            return cached
 
-def get_identity() -> Identity:
-    """Pulls the current identity from gcloud"""
     parser = configparser.ConfigParser()
     try:
         _, stdout, stderr = proc.run(
@@ -31,7 +161,7 @@ def get_identity() -> Identity:
                 "config",
                 "config-helper",
                 "--format",
-                "config(configuration.properties.core.account,credential.access_token)",
+                "config(configuration.properties.core.account,credential.access_token,credential.token_expiry)",
             ),
             stderr=sys.stderr,
         )
@@ -43,20 +173,21 @@ def get_identity() -> Identity:
 
     account = parser.get("configuration.properties.core", "account")
     token = parser.get("credential", "access_token")
+    expiration = parser.get("credential", "token_expiry", fallback=None)
 
-    return Identity(account, token, None)
+    identity = Identity(account, token, expiration)
+    if expiration:
+        fs.write_json(
+            identity_cache_path(),
+            {"version": TOKEN_CACHE_VERSION, "identity": list(identity)},
+        )
+    return identity
 
 
 def create_token(
     current: Identity,
     target: str,
-    scopes: Sequence[str] = (
-        "profile",
-        "email",
-        "https://www.googleapis.com/auth/userinfo.email",
-        "https://www.googleapis.com/auth/userinfo.profile",
-        "https://www.googleapis.com/auth/cloud-platform",
-    ),
+    scopes: Sequence[str] = DEFAULT_SCOPES,
     lifetime: int = 3600,
 ) -> Identity:
     """
@@ -66,74 +197,280 @@ def create_token(
         raise SystemExit("GCP requires at least one scope")
     if not target.endswith("iam.gserviceaccount.com"):
         raise SystemExit("GCP sudo only works for service accounts")
-    iam_api = "https://iamcredentials.googleapis.com/v1"
-
     data = {"lifetime": f"{lifetime}s", "scope": scopes}
 
-    data = json.dumps(data).encode("utf-8")
-
     url = "{}/projects/-/serviceAccounts/{}:generateAccessToken".format(
-        iam_api, urllib.parse.quote_plus(target)
+        IAM_API, urllib.parse.quote_plus(target)
     )
-    req = urllib.request.Request(url, data=data, method="POST")
 
     logger.debug("Calling GCP with %s", data)
-    req.add_header("Authorization", "Bearer " + current.token)
-    req.add_header("Accept", "application/json")
-    req.add_header("Content-Type", "application/json")
-
-    output = {}
     try:
-        with urllib.request.urlopen(req) as f:
-            response = f.read()
-            logger.debug("Response from GCP API: %s", response)
-            output.update(json.loads(response))
-    except urllib.error.HTTPError as e:
-        print(e.read())
+        output = cast(
+            "dict[str, str]",
+            httpclient.post_json(
+                url, data, headers={"Authorization": "Bearer " + current.token}
+            ),
+        )
+    except httpclient.HTTPError as e:
+        print(e.body)
         raise e
+    logger.debug("Response from GCP API: %s", output)
 
     return Identity(target, output["accessToken"], output["expireTime"])
 
 
-def sudo(
+def token_cache_path() -> str:
+    return os.path.join(constants.root, "cache", "gcp-tokens.json")
+
+
+def _token_key(
+    account: str, target: str, scopes: Sequence[str], lifetime: int
+) -> str:
+    return json.dumps([account, target, sorted(scopes), lifetime])
+
+
+def _load_tokens() -> dict[str, list[str]]:
+    data = fs.read_json(token_cache_path(), version=TOKEN_CACHE_VERSION)
+    return cast("dict[str, list[str]]", data.get("tokens", {}))
+
+
+def cached_token(
+    account: str, target: str, scopes: Sequence[str], lifetime: int
+) -> Identity | None:
+    """
+    A token previously minted by `account` for `target`, if it is valid for
+    at least `token_margin()` seconds more
+    """
+    entry = _load_tokens().get(_token_key(account, target, scopes, lifetime))
+    if entry is None:
+        return None
+    identity = Identity(*entry)
+    if _expires_at(identity.expiration) - token_margin() <= time.time():
+        return None
+    return identity
+
+
+def cache_token(
+    account: str,
     target: str,
-    scopes: Sequence[str] = (
-        "profile",
-        "email",
-        "https://www.googleapis.com/auth/userinfo.email",
-        "https://www.googleapis.com/auth/userinfo.profile",
-        "https://www.googleapis.com/auth/cloud-platform",
-    ),
-    lifetime: int = 3600,
+    scopes: Sequence[str],
+    lifetime: int,
+    identity: Identity,
+) -> None:
+    """
+    Stores an impersonated token in a file readable only by the user,
+    dropping any tokens which have expired
+    """
+    now = time.time()
+    tokens = {
+        key: entry
+        for key, entry in _load_tokens().items()
+        if _expires_at(entry[2]) > now
+    }
+    tokens[_token_key(account, target, scopes, lifetime)] = list(identity)
+    fs.write_json(
+        token_cache_path(), {"version": TOKEN_CACHE_VERSION, "tokens": tokens}
+    )
+
+
+def sudo(
+    target: str, scopes: Sequence[str] = DEFAULT_SCOPES, lifetime: int = 3600
 ) -> Identity:
-    identity = get_identity()
-    new_token = create_token(identity, target, scopes, lifetime)
+    """
+    Impersonates `target`, reusing the token from a previous call while it
+    is still valid
+    """
+    account = current_account()
+    if account is not None:
+        cached = cached_token(account, target, scopes, lifetime)
+        if cached is not None:
+            logger.debug("Using cached token for %s", target)
+            return cached
+
+    cached_user = cached_identity()
+    identity = cached_user or get_identity()
+    try:
+        new_token = create_token(identity, target, scopes, lifetime)
+    except httpclient.HTTPError as e:
+        # the saved token may have been revoked, e.g. by logging in again
+        if cached_user is None or not _is_rejected(e):
+            raise
+        logger.info("The saved gcloud token was rejected; refreshing it")
+        forget_identity()
+        identity = get_identity(refresh=True)
+        new_token = create_token(identity, target, scopes, lifetime)
+    cache_token(identity.account, target, scopes, lifetime, new_token)
 
     return new_token
 
 
+def resolve_alias(repo: Repository, alias: str) -> tuple[str, list[str]]:
+    """The service account and scopes of a `gcpsudo.<alias>` section"""
+    config = load_snapshot(repo.path)
+    section = f"gcpsudo.{alias}"
+    if not config.has_section(section):
+        raise SystemExit(
+            f"Account {alias} not found in {repo.config_path}/config.ini"
+        )
+
+    target_account = config.get(section, "account") or ""
+    target_scopes = (config.get(section, "scopes") or "").split()
+    return target_account, target_scopes
+
+
 def sudo_alias(repo: Repository, target: str) -> Identity:
     """
     Ported from Tacos-GHA
 
     Generates the tokens necessary to masquerade as another account on GCP
     """
-    config = repo.config()
-    section = f"gcpsudo.{target}"
-    if not config.has_section(section):
-        raise SystemExit(
-            f"Account {target} not found in {repo.config_path}/config.ini"
+    return sudo(*resolve_alias(repo, target))
+
+
+def sudo_many(
+    repo: Repository,
+    aliases: Sequence[str],
+    lifetime: int = 3600,
+    jobs: int | None = None,
+) -> dict[str, Identity]:
+    """
+    Impersonates several aliases at once, returning a token for each.
+    Cached tokens are reused; the rest are minted concurrently with a single
+    lookup of the current identity.
+    """
+    targets = {alias: resolve_alias(repo, alias) for alias in aliases}
+    account = current_account()
+
+    tokens: dict[str, Identity] = {}
+    for alias, (target, scopes) in targets.items():
+        cached = (
+            cached_token(account, target, scopes, lifetime)
+            if account is not None
+            else None
+        )
+        if cached is not None:
+            tokens[alias] = cached
+    missing = [alias for alias in targets if alias not in tokens]
+    if not missing:
+        return tokens
+
+    def mint(
+        identity: Identity, aliases: Sequence[str]
+    ) -> list[parallel.Outcome[str, Identity]]:
+        return parallel.run_all(
+            lambda alias: create_token(identity, *targets[alias], lifetime),
+            aliases,
+            jobs=jobs or min(len(aliases), MINT_JOBS),
         )
 
-    target_account = config.get(section, "account")
-    target_scopes = config.get(section, "scopes").split()
+    cached_user = cached_identity()
+    identity = cached_user or get_identity()
+    outcomes = mint(identity, missing)
+    rejected = [o.item for o in outcomes if _is_rejected(o.error)]
+    if cached_user is not None and rejected:
+        # the saved token may have been revoked, e.g. by logging in again
+        logger.info("The saved gcloud token was rejected; refreshing it")
+        forget_identity()
+        identity = get_identity(refresh=True)
+        retried = {o.item: o for o in mint(identity, rejected)}
+        outcomes = [retried.get(o.item, o) for o in outcomes]
+
+    for outcome in outcomes:
+        if outcome.error is not None:
+            raise SystemExit(
+                f"Could not impersonate {outcome.item}: {outcome.error}"
+            )
+        assert outcome.value is not None
+        target, scopes = targets[outcome.item]
+        cache_token(identity.account, target, scopes, lifetime, outcome.value)
+        tokens[outcome.item] = outcome.value
+    return {alias: tokens[alias] for alias in aliases}
+
+
+def token_file_path(target: str, pid: int) -> str:
+    return os.path.join(constants.root, "tokens", f"{target}.{pid}")
+
+
+def write_token_file(path: str, identity: Identity) -> None:
+    """Atomically replaces `path` with the token, readable only by the user"""
+    os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+    with fs.atomic_path(path) as tmp, open(tmp, "w") as f:
+        f.write(identity.token)
+
+
+def _is_running(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
 
-    return sudo(target_account, target_scopes)
+def keep_token_file(path: str, mint: Callable[[], Identity], pid: int) -> None:
+    """
+    Keeps a fresh token from `mint` in `path` for as long as process `pid`
+    runs, renewing it `token_margin()` seconds before it expires. The file
+    is removed afterwards.
+    """
+    try:
+        while _is_running(pid):
+            renew_at = time.time() + REFRESH_MIN_INTERVAL
+            try:
+                identity = mint()
+                write_token_file(path, identity)
+                logger.info("Renewed token in %s", path)
+                renew_at = max(
+                    renew_at, _expires_at(identity.expiration) - token_margin()
+                )
+            except (SystemExit, httpclient.HTTPError, OSError) as e:
+                logger.warning("Could not renew token in %s: %s", path, e)
+
+            while _is_running(pid) and time.time() < renew_at:
+                time.sleep(min(REFRESH_POLL, renew_at - time.time()))
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def start_refresher(user: str, path: str, pid: int) -> int:
+    """
+    Starts `devtools gcloud refresh-token` detached from this process, to
+    keep a token for `user` (an account or alias) in `path` while `pid`
+    runs. Returns the refresher's pid.
+    """
+    os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+    with open(os.path.join(os.path.dirname(path), "refresher.log"), "a") as log:
+        child = subprocess.Popen(
+            (
+                sys.executable,
+                "-m",
+                constants.APP_NAME,
+                "gcloud",
+                "refresh-token",
+                "-u",
+                user,
+                "--file",
+                path,
+                "--pid",
+                str(pid),
+            ),
+            stdin=subprocess.DEVNULL,
+            stdout=log,
+            stderr=subprocess.STDOUT,
+            start_new_session=True,
+        )
+    return child.pid
 
 
-def to_env(identity: Identity) -> Dict[str, str]:
-    return {
+def to_env(identity: Identity, token_file: str | None = None) -> Dict[str, str]:
+    env = {
         "CLOUDSDK_CORE_ACCOUNT": identity.account,
         "GOOGLE_OAUTH_ACCESS_TOKEN": identity.token,
         "CLOUDSDK_AUTH_ACCESS_TOKEN": identity.token,
     }
+    if token_file:
+        # read by gcloud on every invocation, so it sees renewed tokens
+        env["CLOUDSDK_AUTH_ACCESS_TOKEN_FILE"] = token_file
+    return env
@@ -0,0 +1,143 @@
+"""
+A shared, local object cache for git clones.
+
+The cache is a single bare repository under the devtools root with one
+remote per GitHub repository. Clones borrow its objects through git's
+alternates (`git clone --reference-if-able`), so only objects the cache
+doesn't have yet are downloaded, and they're stored once on disk.
+
+Since clones depend on the cache's objects, it is configured to never
+prune them.
+"""
+from __future__ import annotations
+
+import fcntl
+import logging
+import os
+import subprocess
+import sys
+from collections.abc import Sequence
+
+from devtools import constants
+from devtools.lib import config
+from devtools.lib import proc
+
+logger = logging.getLogger(__name__)
+
+CACHE_CONFIG = {
+    # clones may reference any object in the cache, reachable or not
+    "gc.pruneExpire": "never",
+    "gc.worktreePruneExpire": "never",
+    "gc.reflogExpire": "never",
+    "gc.reflogExpireUnreachable": "never",
+    "fetch.prune": "false",
+    "fetch.pruneTags": "false",
+}
+
+
+def cache_path() -> str:
+    return os.path.join(constants.root, "git-cache.git")
+
+
+def is_enabled() -> bool:
+    """Whether clones should use the cache (the `git_cache` setting)"""
+    value = config.get_value("git_cache") or ""
+    return value.lower() in ("1", "true", "yes", "on")
+
+
+def _git(*args: str) -> str:
+    _, out, _ = proc.run(("git", "--git-dir", cache_path(), *args))
+    return out or ""
+
+
+def ensure() -> str:
+    """Creates the cache repository if needed, and returns its path"""
+    path = cache_path()
+    if not os.path.exists(os.path.join(path, "HEAD")):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        proc.run(("git", "init", "--quiet", "--bare", path))
+        for key, value in CACHE_CONFIG.items():
+            _git("config", key, value)
+    return path
+
+
+def remotes() -> list[str]:
+    if not os.path.exists(cache_path()):
+        return []
+    return _git("remote").split()
+
+
+def add(repo: str, url: str) -> None:
+    """
+    Registers `repo` (owner/name) with the cache. Its branches and tags are
+    kept under refs/remotes/<owner/name>/ so repositories can't collide.
+    """
+    ensure()
+    if repo in remotes():
+        _git("remote", "set-url", repo, url)
+        return
+
+    _git("remote", "add", "--no-tags", repo, url)
+    _git(
+        "config",
+        "--add",
+        f"remote.{repo}.fetch",
+        f"+refs/tags/*:refs/remotes/{repo}/tags/*",
+    )
+
+
+def refresh(repos: Sequence[str] | None = None, jobs: int = 4) -> bool:
+    """
+    Fetches new objects for `repos` (default: every registered repository)
+    into the cache. Returns False if another refresh is already running.
+    """
+    names = list(repos) if repos is not None else remotes()
+    if not names:
+        return True
+
+    with open(f"{ensure()}.lock", "a") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            logger.info("A git cache refresh is already running")
+            return False
+
+        logger.info("Refreshing git cache: %s", ", ".join(names))
+        _git(
+            "fetch",
+            "--quiet",
+            "--no-prune",
+            f"--jobs={jobs}",
+            "--multiple",
+            *names,
+        )
+    return True
+
+
+def refresh_in_background(repos: Sequence[str] | None = None) -> int:
+    """
+    Starts `devtools cache refresh-git` detached from this process, logging
+    to a file next to the cache. Returns the pid.
+    """
+    path = ensure()
+    with open(f"{path}.log", "a") as log:
+        child = subprocess.Popen(
+            (
+                sys.executable,
+                "-m",
+                constants.APP_NAME,
+                "cache",
+                "refresh-git",
+                *(repos or ()),
+            ),
+            stdin=subprocess.DEVNULL,
+            stdout=log,
+            stderr=subprocess.STDOUT,
+            start_new_session=True,
+        )
+    return child.pid
+
+
+def clone_args() -> tuple[str, ...]:
+    """Extra `git clone` arguments to borrow objects from the cache"""
+    return ("--reference-if-able", cache_path())
@@ -0,0 +1,336 @@
+"""
+A small keep-alive HTTP client.
+
+Connections are pooled per (scheme, host, port) for the lifetime of the
+process, and HTTPS connections resume the TLS session of their predecessor,
+so a command which makes several requests to the same host pays for a
+single full handshake.
+"""
+from __future__ import annotations
+
+import contextlib
+import gzip
+import http.client
+import json
+import logging
+import ssl
+import threading
+import urllib.parse
+import urllib.request
+from collections.abc import Iterator
+from collections.abc import Mapping
+from dataclasses import dataclass
+from typing import TypeAlias
+
+from devtools import constants
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = 30.0
+MAX_REDIRECTS = 5
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+
+# (scheme, host, port, proxy)
+_PoolKey: TypeAlias = "tuple[str, str, int, str]"
+_Connection: TypeAlias = "http.client.HTTPConnection"
+
+# errors raised when a pooled connection was closed by the server while idle
+_STALE_ERRORS = (
+    http.client.RemoteDisconnected,
+    http.client.BadStatusLine,
+    ConnectionResetError,
+    BrokenPipeError,
+)
+
+
+class HTTPError(Exception):
+    def __init__(self, url: str, status: int, reason: str, body: bytes):
+        super().__init__(f"HTTP Error {status}: {reason} ({url})")
+        self.url = url
+        self.status = status
+        self.reason = reason
+        self.body = body
+
+
+@dataclass(frozen=True)
+class Response:
+    url: str
+    status: int
+    headers: Mapping[str, str]
+    body: bytes
+
+    def json(self) -> object:
+        return json.loads(self.body)
+
+
+class _TLSSession:
+    """Holder for the most recent TLS session negotiated with a host"""
+
+    def __init__(self) -> None:
+        self.session: ssl.SSLSession | None = None
+
+    def save(self, conn: _Connection) -> None:
+        if isinstance(conn.sock, ssl.SSLSocket) and conn.sock.session:
+            self.session = conn.sock.session
+
+
+class _HTTPSConnection(http.client.HTTPSConnection):
+    """HTTPS connection which resumes a previously negotiated TLS session"""
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        *,
+        server_hostname: str,
+        tls_session: _TLSSession,
+        timeout: float,
+        context: ssl.SSLContext,
+    ) -> None:
+        super().__init__(host, port, timeout=timeout, context=context)
+        self.ssl_context = context
+        self.server_hostname = server_hostname
+        self.tls_session = tls_session
+
+    def connect(self) -> None:
+        # plain TCP connection (and proxy tunnel, if any)
+        http.client.HTTPConnection.connect(self)
+
+        self.sock = self.ssl_context.wrap_socket(
+            self.sock,
+            server_hostname=self.server_hostname,
+            session=self.tls_session.session,
+        )
+        self.tls_session.save(self)
+
+
+class _Pool:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._idle: dict[_PoolKey, list[_Connection]] = {}
+        self._sessions: dict[_PoolKey, _TLSSession] = {}
+        self._context: ssl.SSLContext | None = None
+
+    def _ssl_context(self) -> ssl.SSLContext:
+        if self._context is None:
+            self._context = ssl.create_default_context()
+        return self._context
+
+    def acquire(
+        self, key: _PoolKey, timeout: float
+    ) -> tuple[_Connection, bool]:
+        """Returns an idle connection for `key`, or a new one"""
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                pooled = idle.pop()
+                pooled.timeout = timeout
+                if pooled.sock is not None:
+                    pooled.sock.settimeout(timeout)
+                return pooled, True
+
+            scheme, host, port, proxy = key
+            if proxy:
+                proxy_host, proxy_port = _split_netloc(proxy, 80)
+            else:
+                proxy_host, proxy_port = host, port
+
+            conn: _Connection
+            if scheme == "https":
+                session = self._sessions.setdefault(key, _TLSSession())
+                conn = _HTTPSConnection(
+                    proxy_host,
+                    proxy_port,
+                    server_hostname=host,
+                    tls_session=session,
+                    timeout=timeout,
+                    context=self._ssl_context(),
+                )
+                if proxy:
+                    conn.set_tunnel(host, port)
+            else:
+                conn = http.client.HTTPConnection(
+                    proxy_host, proxy_port, timeout=timeout
+                )
+            return conn, False
+
+    def release(self, key: _PoolKey, conn: _Connection) -> None:
+        if isinstance(conn, _HTTPSConnection):
+            conn.tls_session.save(conn)
+        with self._lock:
+            self._idle.setdefault(key, []).append(conn)
+
+    def clear(self) -> None:
+        with self._lock:
+            for idle in self._idle.values():
+                for conn in idle:
+                    conn.close()
+            self._idle.clear()
+
+
+_pool = _Pool()
+
+
+def close_all() -> None:
+    """Closes every idle pooled connection"""
+    _pool.clear()
+
+
+def _split_netloc(netloc: str, default_port: int) -> tuple[str, int]:
+    parts = urllib.parse.urlsplit(f"//{netloc}")
+    return parts.hostname or "", parts.port or default_port
+
+
+def _proxy_for(scheme: str, host: str) -> str:
+    proxies = urllib.request.getproxies()
+    proxy = proxies.get(scheme, "")
+    if not proxy or urllib.request.proxy_bypass(host):
+        return ""
+    return urllib.parse.urlsplit(proxy).netloc or proxy
+
+
+@contextlib.contextmanager
+def urlopen(
+    method: str,
+    url: str,
+    *,
+    body: bytes | None = None,
+    headers: Mapping[str, str] | None = None,
+    timeout: float = DEFAULT_TIMEOUT,
+) -> Iterator[http.client.HTTPResponse]:
+    """
+    Performs a request over a pooled connection, following redirects.
+
+    Raises HTTPError for error statuses. The connection is returned to the
+    pool on exit if the response body was read to completion.
+    """
+    headers = {"User-Agent": constants.APP_FULLNAME, **(headers or {})}
+
+    for _ in range(MAX_REDIRECTS + 1):
+        parts = urllib.parse.urlsplit(url)
+        scheme = parts.scheme
+        if scheme not in ("http", "https"):
+            raise ValueError(f"unsupported url scheme: {url}")
+
+        host = parts.hostname or ""
+        port = parts.port or (443 if scheme == "https" else 80)
+        proxy = _proxy_for(scheme, host)
+        key = (scheme, host, port, proxy)
+
+        target = parts.path or "/"
+        if parts.query:
+            target = f"{target}?{parts.query}"
+        if proxy and scheme == "http":
+            target = urllib.parse.urlunsplit(parts._replace(fragment=""))
+
+        conn, resp = _send(key, method, target, body, headers, timeout)
+
+        if resp.status in REDIRECT_STATUSES and resp.getheader("Location"):
+            resp.read()
+            _finish(key, conn, resp)
+            url = urllib.parse.urljoin(url, resp.getheader("Location"))
+            if resp.status == 303 or (
+                resp.status in (301, 302) and method == "POST"
+            ):
+                method, body = "GET", None
+            logger.debug("Redirected to %s", url)
+            continue
+
+        try:
+            if resp.status >= 400:
+                raise HTTPError(url, resp.status, resp.reason, resp.read())
+            resp.url = url
+            yield resp
+        finally:
+            _finish(key, conn, resp)
+        return
+
+    raise HTTPError(url, 310, "Too many redirects", b"")
+
+
+def _send(
+    key: _PoolKey,
+    method: str,
+    target: str,
+    body: bytes | None,
+    headers: Mapping[str, str],
+    timeout: float,
+) -> tuple[_Connection, http.client.HTTPResponse]:
+    while True:
+        conn, reused = _pool.acquire(key, timeout)
+        try:
+            conn.request(method, target, body=body, headers=dict(headers))
+            return conn, conn.getresponse()
+        except _STALE_ERRORS:
+            conn.close()
+            if not reused:
+                raise
+            logger.debug("Pooled connection to %s went stale; retrying", key[1])
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            raise
+
+
+def _finish(
+    key: _PoolKey, conn: _Connection, resp: http.client.HTTPResponse
+) -> None:
+    if resp.isclosed() and not resp.will_close:
+        _pool.release(key, conn)
+    else:
+        conn.close()
+
+
+def request(
+    method: str,
+    url: str,
+    *,
+    body: bytes | None = None,
+    headers: Mapping[str, str] | None = None,
+    timeout: float = DEFAULT_TIMEOUT,
+) -> Response:
+    """Performs a request, reading and decompressing the whole response"""
+    headers = {"Accept-Encoding": "gzip", **(headers or {})}
+    with urlopen(
+        method, url, body=body, headers=headers, timeout=timeout
+    ) as resp:
+        data = resp.read()
+        if resp.getheader("Content-Encoding") == "gzip":
+            data = gzip.decompress(data)
+        return Response(
+            url=resp.url,
+            status=resp.status,
+            headers=dict(resp.getheaders()),
+            body=data,
+        )
+
+
+def get(
+    url: str,
+    *,
+    headers: Mapping[str, str] | None = None,
+    timeout: float = DEFAULT_TIMEOUT,
+) -> Response:
+    return request("GET", url, headers=headers, timeout=timeout)
+
+
+def post_json(
+    url: str,
+    data: object,
+    *,
+    headers: Mapping[str, str] | None = None,
+    timeout: float = DEFAULT_TIMEOUT,
+) -> object:
+    """POSTs `data` as JSON and returns the decoded JSON response"""
+    headers = {
+        "Accept": "application/json",
+        "Content-Type": "application/json",
+        **(headers or {}),
+    }
+    response = request(
+        "POST",
+        url,
+        body=json.dumps(data).encode("utf-8"),
+        headers=headers,
+        timeout=timeout,
+    )
+    return response.json()
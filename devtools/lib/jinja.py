@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import logging
 import os
 from collections.abc import Callable
 from os.path import getmtime
@@ -7,14 +8,19 @@ from typing import Optional
 from typing import Tuple
 
 from jinja2 import BaseLoader
+from jinja2 import BytecodeCache
 from jinja2 import Environment
+from jinja2 import FileSystemBytecodeCache
 from jinja2 import select_autoescape
 from jinja2 import TemplateNotFound
 
+from devtools import constants
 from devtools.lib.modules import Action
 from devtools.lib.modules import find_resource
 from devtools.lib.modules import ModuleAction
 
+logger = logging.getLogger(__name__)
+
 
 class ResourceLoader(BaseLoader):  # type: ignore
     def __init__(self, action: Action) -> None:
@@ -23,17 +29,65 @@ class ResourceLoader(BaseLoader):  # type: ignore
         else:
             self.action = action
 
+        # template name -> resolved resource path
+        self.paths: dict[str, str] = {}
+
     def get_source(self, environment: Environment, path: str) -> Tuple[str, Optional[str], Optional[Callable[[], bool]]]:  # type: ignore
-        template = find_resource(self.action, path)
-        if not os.path.exists(template):
+        template = self.paths.get(path)
+        if template is None:
+            try:
+                template = find_resource(self.action, path)
+            except FileNotFoundError:
+                raise TemplateNotFound(path)
+            self.paths[path] = template
+
+        try:
+            mtime = getmtime(template)
+            with open(template) as f:
+                source = f.read()
+        except FileNotFoundError:
+            del self.paths[path]
             raise TemplateNotFound(template)
-        mtime = getmtime(template)
-        with open(template) as f:
-            source = f.read()
+
         return source, path, lambda: mtime == getmtime(template)
 
 
+_bytecode_cache: BytecodeCache | None = None
+_environments: dict[tuple[str, str], Environment] = {}
+
+
+def _get_bytecode_cache() -> BytecodeCache | None:
+    """Compiled templates persist across invocations under the devtools root"""
+    global _bytecode_cache
+
+    if _bytecode_cache is None:
+        directory = os.path.join(constants.root, "cache", "jinja")
+        try:
+            os.makedirs(directory, exist_ok=True)
+        except OSError as e:
+            logger.debug("Template bytecode cache disabled: %s", e)
+            return None
+        _bytecode_cache = FileSystemBytecodeCache(directory)
+    return _bytecode_cache
+
+
 def get_env(action: Action) -> Environment:  # type: ignore
-    return Environment(
-        loader=ResourceLoader(action), autoescape=select_autoescape()
-    )
+    """
+    Returns the process-wide template environment for a command.
+
+    Environments are shared per command since resources are resolved per
+    command (see find_resource), so every scaffold rendered by the same
+    command reuses its compiled templates.
+    """
+    if isinstance(action, ModuleAction):
+        action = action.action
+
+    key = action.__module__, action.__name__
+    env = _environments.get(key)
+    if env is None:
+        env = _environments[key] = Environment(
+            loader=ResourceLoader(action),
+            autoescape=select_autoescape(),
+            bytecode_cache=_get_bytecode_cache(),
+        )
+    return env
@@ -0,0 +1,125 @@
+"""
+Background `git maintenance` for the repositories in the workspace.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import os
+import shutil
+import time
+from collections.abc import Mapping
+from collections.abc import Sequence
+from dataclasses import asdict
+from dataclasses import dataclass
+
+from devtools import constants
+from devtools.constants import DARWIN
+from devtools.lib import fs
+from devtools.lib import proc
+from devtools.lib.workspace import WorkspaceRepo
+
+logger = logging.getLogger(__name__)
+
+TASKS = ("prefetch", "commit-graph", "loose-objects", "incremental-repack")
+
+
+@dataclass(frozen=True)
+class RunStats:
+    started: float
+    duration: float
+    code: int
+    tasks: Sequence[str]
+    error: str | None = None
+
+
+def stats_path() -> str:
+    return os.path.join(constants.root, "maintenance.json")
+
+
+def load_stats() -> dict[str, RunStats]:
+    """The most recent maintenance run of each repository, by path"""
+    try:
+        with open(stats_path()) as f:
+            return {
+                path: RunStats(**stats) for path, stats in json.load(f).items()
+            }
+    except (OSError, ValueError, TypeError):
+        return {}
+
+
+def save_stats(stats: Mapping[str, RunStats]) -> None:
+    """Merges `stats` into the recorded stats"""
+    merged = {**load_stats(), **stats}
+    with fs.atomic_path(stats_path()) as tmp, open(tmp, "w") as f:
+        json.dump({path: asdict(s) for path, s in merged.items()}, f, indent=2)
+
+
+def low_priority() -> tuple[str, ...]:
+    """A command prefix which runs at the lowest CPU and I/O priority"""
+    if DARWIN and shutil.which("taskpolicy"):
+        # background QoS also throttles disk and network I/O
+        return ("taskpolicy", "-b")
+    prefix: tuple[str, ...] = ("nice", "-n", "19")
+    if shutil.which("ionice"):
+        prefix = ("ionice", "-c", "3", *prefix)
+    return prefix
+
+
+def is_worktree(repo: WorkspaceRepo) -> bool:
+    """Linked worktrees share the objects of their main checkout"""
+    return bool(repo.git_dir) and os.path.exists(
+        os.path.join(repo.git_dir or "", "commondir")
+    )
+
+
+def register(repo: WorkspaceRepo, tasks: Sequence[str] = TASKS) -> None:
+    """
+    Registers `repo` for scheduled maintenance (see `git maintenance
+    start`) and enables `tasks` for it.
+    """
+    proc.run(("git", "-C", repo.path, "maintenance", "register"))
+    for task in TASKS:
+        enabled = "true" if task in tasks else "false"
+        proc.run(
+            (
+                "git",
+                "-C",
+                repo.path,
+                "config",
+                f"maintenance.{task}.enabled",
+                enabled,
+            )
+        )
+
+
+def schedule() -> None:
+    """Installs the system scheduler (cron, launchd, systemd) for git"""
+    proc.run(("git", "maintenance", "start"), cwd=constants.home)
+
+
+def run(repo: WorkspaceRepo, tasks: Sequence[str] = TASKS) -> RunStats:
+    """Runs maintenance `tasks` for `repo` now, at low priority"""
+    cmd = (
+        *low_priority(),
+        "git",
+        "-C",
+        repo.path,
+        "maintenance",
+        "run",
+        "--quiet",
+        *(f"--task={task}" for task in tasks),
+    )
+    started = time.time()
+    start = time.monotonic()
+    try:
+        proc.run(cmd)
+    except proc.CommandError as e:
+        return RunStats(
+            started,
+            time.monotonic() - start,
+            int(e.code or 1),
+            list(tasks),
+            e.stderr or str(e),
+        )
+    return RunStats(started, time.monotonic() - start, 0, list(tasks))
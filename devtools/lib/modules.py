@@ -212,6 +212,30 @@ def require(var: str, message: str) -> Callable[[Action], Action]:
 require_repo = require("repo", "This devtool requires a repository")
 
 
+# resources directory -> (directory mtime, {file name: path})
+_resource_index: dict[str, Tuple[int, dict[str, str]]] = {}
+
+
+def resource_index(resource_path: str) -> dict[str, str]:
+    """ Index the files of a resources directory, rescanning when it changes """
+    try:
+        mtime = os.stat(resource_path).st_mtime_ns
+    except FileNotFoundError:
+        return {}
+
+    cached = _resource_index.get(resource_path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    index = {
+        entry.name: entry.path
+        for entry in os.scandir(resource_path)
+        if entry.is_file()
+    }
+    _resource_index[resource_path] = mtime, index
+    return index
+
+
 def find_resource(command: Action, name: str) -> str:
     """ Search the command's `resources` directory for files
 
@@ -234,15 +258,23 @@ def find_resource(command: Action, name: str) -> str:
     filename1 = os.path.join(
         resource_path, f"{resource_path}/{command.__name__}_{name}"
     )  # todo: should this be command or fn name?
-    if os.path.exists(filename1):
-        logger.debug("Located resource %s at %s", name, filename1)
-        return filename1
-
     # Module name
     filename2 = os.path.join(resource_path, f"{resource_path}/{name}")
-    if os.path.exists(filename2):
-        logger.debug("Located resource %s at %s", name, filename2)
-        return filename2
+
+    if os.sep in name:
+        # nested resources aren't indexed
+        candidates = [f for f in (filename1, filename2) if os.path.exists(f)]
+    else:
+        index = resource_index(resource_path)
+        candidates = [
+            index[f]
+            for f in (f"{command.__name__}_{name}", name)
+            if f in index
+        ]
+
+    if candidates:
+        logger.debug("Located resource %s at %s", name, candidates[0])
+        return candidates[0]
 
     raise FileNotFoundError(
         f"Could not find resource; tried {filename1} and {filename2}"
@@ -0,0 +1,92 @@
+"""
+Bounded parallel execution of independent tasks.
+"""
+from __future__ import annotations
+
+import dataclasses
+import os
+import threading
+import time
+from collections.abc import Callable
+from collections.abc import Iterable
+from concurrent.futures import as_completed
+from concurrent.futures import ThreadPoolExecutor
+from typing import Generic
+from typing import TypeVar
+
+K = TypeVar("K")
+T = TypeVar("T")
+
+
+def default_jobs() -> int:
+    return os.cpu_count() or 4
+
+
+@dataclasses.dataclass(frozen=True)
+class Outcome(Generic[K, T]):
+    item: K
+    value: T | None = None
+    error: Exception | None = None
+    duration: float = 0.0
+    skipped: bool = False
+
+
+def run_all(
+    fn: Callable[[K], T],
+    items: Iterable[K],
+    *,
+    jobs: int | None = None,
+    fail_fast: bool = False,
+    failed: Callable[[Outcome[K, T]], bool] | None = None,
+    on_done: Callable[[Outcome[K, T]], None] | None = None,
+) -> list[Outcome[K, T]]:
+    """
+    Calls `fn` for every item on at most `jobs` threads and returns the
+    outcomes in the order of `items`.
+
+    `on_done` is called on the calling thread as each item completes. With
+    `fail_fast`, items which haven't started by the time one fails (it
+    raised, or `failed` returned True for it) are skipped; items already
+    running are left to finish.
+    """
+    items = list(items)
+    failed = failed or _raised
+    stop = threading.Event()
+
+    def call(item: K) -> Outcome[K, T]:
+        if stop.is_set():
+            return Outcome(item, skipped=True)
+        start = time.monotonic()
+        try:
+            outcome = Outcome[K, T](item, value=fn(item))
+        except Exception as e:
+            outcome = Outcome(item, error=e)
+        outcome = dataclasses.replace(
+            outcome, duration=time.monotonic() - start
+        )
+        # checked here rather than as results are collected, so that no
+        # worker can pick up another item in between
+        if fail_fast and failed(outcome):
+            stop.set()
+        return outcome
+
+    outcomes: dict[int, Outcome[K, T]] = {}
+    with ThreadPoolExecutor(max_workers=jobs or default_jobs()) as pool:
+        futures = {pool.submit(call, item): i for i, item in enumerate(items)}
+        try:
+            for future in as_completed(futures):
+                outcome = outcomes[futures[future]] = future.result()
+                if outcome.skipped:
+                    continue
+                if on_done is not None:
+                    on_done(outcome)
+        except BaseException:
+            # e.g. KeyboardInterrupt: don't start anything else
+            stop.set()
+            raise
+
+    return [outcomes[i] for i in range(len(items))]
+
+
+def _raised(outcome: Outcome[K, T]) -> bool:
+    return outcome.error is not None
@@ -1,12 +1,16 @@
 from __future__ import annotations
 
 import logging
+import os
 import sys
+import threading
+from collections.abc import Callable
 from collections.abc import Sequence
 from pathlib import Path
 from subprocess import CalledProcessError
 from subprocess import PIPE
 from subprocess import run as subprocess_run
+from typing import NoReturn
 from typing import TextIO
 from typing import Tuple
 
@@ -48,6 +52,41 @@ class CommandError(SystemExit):
         self.stderr = err
 
 
+def build_env(
+    env: dict[str, str] | None = None, pathprepend: str = ""
+) -> dict[str, str]:
+    """
+    The environment commands run in: the user's original environment with
+    our base paths, then `env`
+    """
+    env = {**constants.user_environ, **base_env, **(env or {})}
+    if pathprepend:
+        env["PATH"] = f"{pathprepend}:{env['PATH']}"
+    return env
+
+
+def exec_replace(
+    cmd: Sequence[str],
+    *,
+    pathprepend: str = "",
+    env: dict[str, str] | None = None,
+) -> NoReturn:
+    """
+    Replaces this process with a command, so its exit code, signals and
+    terminal are the command's own. Buffered output is flushed first.
+    """
+    env = build_env(env, pathprepend)
+
+    logger.debug(xtrace(cmd))
+    sys.stdout.flush()
+    sys.stderr.flush()
+    try:
+        os.execvpe(cmd[0], list(cmd), env)
+    except OSError as e:
+        # the command wasn't found, or can't be executed
+        raise SystemExit(f"{e}") from e
+
+
 def run(
     cmd: Sequence[str],
     *,
@@ -59,12 +98,7 @@ def run(
     input: str | None = None,
 ) -> Tuple[int, str, str]:
     """Wraps command invocation with a small amount of logging"""
-    if env is None:
-        env = {}
-    env = {**constants.user_environ, **base_env, **env}
-
-    if pathprepend:
-        env["PATH"] = f"{pathprepend}:{env['PATH']}"
+    env = build_env(env, pathprepend)
 
     logger.debug(xtrace(cmd))
     try:
@@ -93,6 +127,49 @@ def run(
         return proc.returncode, out, err
 
 
+def run_lines(
+    cmd: Sequence[str],
+    on_line: Callable[[str], None],
+    *,
+    pathprepend: str = "",
+    env: dict[str, str] | None = None,
+    cwd: Path | str | None = None,
+) -> int:
+    """
+    Runs a command with its stdout and stderr merged, calling `on_line` from
+    a reader thread for each line of output as it arrives. Progress updates
+    terminated by a carriage return count as lines.
+    """
+    read_fd, write_fd = os.pipe()
+
+    def pump() -> None:
+        with open(read_fd, "rb") as f:
+            pending = b""
+            while chunk := f.read1(65536):
+                lines = (pending + chunk).replace(b"\r\n", b"\n")
+                *complete, pending = lines.replace(b"\r", b"\n").split(b"\n")
+                for line in complete:
+                    on_line(line.decode(errors="replace"))
+            if pending:
+                on_line(pending.decode(errors="replace"))
+
+    reader = threading.Thread(target=pump, daemon=True)
+    reader.start()
+    try:
+        with open(write_fd, "w") as out:
+            code, _, _ = run(
+                cmd,
+                pathprepend=pathprepend,
+                env=env,
+                cwd=cwd,
+                stdout=out,
+                stderr=out,
+            )
+    finally:
+        reader.join()
+    return code
+
+
 def invoke_pipe(script: Sequence[str], data: str) -> str:
     """Executes a script with parameters passed via a strings"""
     ret, out, _ = run(script, stderr=sys.stderr, input=data)
@@ -3,6 +3,7 @@ from __future__ import annotations
 import os.path
 from collections.abc import Sequence
 from configparser import ConfigParser
+from dataclasses import dataclass
 from functools import lru_cache
 
 from devtools import constants
@@ -14,6 +15,43 @@ from devtools.lib.fs import ensure_binroot
 DEFAULT_ORG = "getsentry"
 
 
+@dataclass(frozen=True)
+class Venv:
+    name: str
+    path: str
+    interpreter: str
+    python_version: str | None
+    exists: bool
+
+    @classmethod
+    def from_path(cls, path: str) -> Venv:
+        name = os.path.basename(path).split("-", 1)[1]
+        interpreter = os.path.join(path, "bin", "python")
+
+        python_version = None
+        try:
+            with open(os.path.join(path, "pyvenv.cfg")) as f:
+                for line in f:
+                    key, _, value = line.partition("=")
+                    if key.strip() in ("version", "version_info"):
+                        python_version = value.strip()
+                        break
+        except FileNotFoundError:
+            pass
+
+        return cls(
+            name=name,
+            path=path,
+            interpreter=interpreter,
+            python_version=python_version,
+            exists=os.path.exists(interpreter),
+        )
+
+
+# repository root -> (root mtime, venvs)
+_venv_cache: dict[str, tuple[int, Sequence[Venv]]] = {}
+
+
 class Repository:
     def __init__(self, org: str, name: str, root: str = "") -> None:
         self.name = os.path.basename(root)
@@ -49,16 +87,38 @@ class Repository:
         """Get a specific venv by name"""
         return os.path.join(self.path, f".venv-{name}")
 
-    def find_venvs(self) -> Sequence[str]:
+    def venvs(self) -> Sequence[Venv]:
+        """
+        All `.venv-<name>` virtual environments in the repository root
+
+        Discovery is a single scandir pass, memoized until the root
+        directory's mtime changes.
+        """
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return []
+
+        cached = _venv_cache.get(self.path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
         result = []
-        for f in os.scandir(self.path):
-            if not f.name.startswith(".venv-"):
-                continue
-            if not os.path.isdir(f):
-                continue
-            result.append(f.name.split("-", 1)[1])
+        with os.scandir(self.path) as entries:
+            for entry in entries:
+                if not entry.name.startswith(".venv-"):
+                    continue
+                if not entry.is_dir():
+                    continue
+                result.append(Venv.from_path(entry.path))
+        result.sort(key=lambda venv: venv.name)
+
+        _venv_cache[self.path] = mtime, result
         return result
 
+    def find_venvs(self) -> Sequence[str]:
+        return [venv.name for venv in self.venvs()]
+
     @classmethod
     def from_root_path(cls, root: str) -> Repository:
         name = os.path.basename(root)
@@ -1,10 +1,14 @@
 from __future__ import annotations
 
 import readline
+import sys
 import textwrap
+import threading
+import time
 from collections.abc import Sequence
 from typing import List
 from typing import NamedTuple
+from typing import TextIO
 
 from devtools import constants
 
@@ -228,3 +232,48 @@ def yes(
         if response == "" and default_value is not None:
             return default_value
         continue
+
+
+class StatusLine:
+    """
+    A single status line summarizing several concurrent tasks, redrawn in
+    place as they progress. Messages are printed above it. When the stream
+    isn't a terminal, only the messages are printed.
+    """
+
+    interval = 0.1
+
+    def __init__(self, stream: TextIO | None = None) -> None:
+        self.stream = stream or sys.stdout
+        self.enabled = self.stream.isatty()
+        self._lock = threading.Lock()
+        self._status: dict[str, str] = {}
+        self._drawn = 0.0
+
+    def update(self, key: str, status: str) -> None:
+        with self._lock:
+            self._status[key] = status
+            if time.monotonic() - self._drawn >= self.interval:
+                self._draw()
+
+    def message(self, message: str, done: str | None = None) -> None:
+        """Prints a message, optionally dropping the status of `done`"""
+        with self._lock:
+            if done is not None:
+                self._status.pop(done, None)
+            if self.enabled:
+                self.stream.write("\r\x1b[K")
+            self.stream.write(f"{message}\n")
+            self._draw()
+
+    def close(self) -> None:
+        with self._lock:
+            self._status.clear()
+            self._draw()
+
+    def _draw(self) -> None:
+        self._drawn = time.monotonic()
+        if self.enabled:
+            line = " | ".join(f"{k}: {v}" for k, v in self._status.items())
+            self.stream.write(f"\r\x1b[K{line[: constants.TERM_WIDTH - 1]}")
+        self.stream.flush()
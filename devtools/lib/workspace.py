@@ -0,0 +1,388 @@
+"""
+Discovery of the repositories checked out in the workspace.
+
+Discovery results are cached on disk and revalidated per directory by
+mtime, and repository status (branch, dirty state) is read straight from
+the git directory instead of forking git for every repository.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import stat
+import struct
+from collections.abc import Sequence
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+from devtools import constants
+from devtools.lib import fs
+from devtools.lib import proc
+from devtools.lib.repository import Repository
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_JOBS = 16
+
+CACHE_VERSION = 1
+
+# index entry flags, and extended flags (index v3+)
+_EXTENDED = 0x4000
+_STAGE_MASK = 0x3000
+_SKIP_WORKTREE = 0x4000
+_INTENT_TO_ADD = 0x2000
+
+_GITLINK = 0o160000
+
+# index extensions which change what the entries mean: a split index
+# (entries live partly in a shared index) and a sparse index (entries may
+# be whole directories)
+_UNSUPPORTED_EXTENSIONS = (b"link", b"sdir")
+
+
+class UnsupportedIndex(ValueError):
+    """An index which only git itself can interpret"""
+
+
+@dataclass(frozen=True)
+class WorkspaceRepo:
+    name: str
+    path: str
+    git_dir: str | None
+    has_devtools: bool
+
+    @property
+    def repository(self) -> Repository:
+        return Repository.from_root_path(self.path)
+
+    def branch(self) -> str | None:
+        """The checked out branch, or the commit if HEAD is detached"""
+        if not self.git_dir:
+            return None
+        try:
+            with open(os.path.join(self.git_dir, "HEAD")) as f:
+                head = f.read().strip()
+        except OSError:
+            return None
+
+        if head.startswith("ref: "):
+            return head[5:].removeprefix("refs/heads/")
+        return head[:12]
+
+    def is_dirty(self) -> bool | None:
+        """
+        Whether any tracked file differs from the index, judged by the stat
+        data recorded in the index (the same quick check git performs before
+        comparing contents). Untracked files and staged changes are not
+        considered. Indexes this can't interpret (split or sparse indexes,
+        SHA-256 repositories) are left to `git status`. Returns None if the
+        state can't be determined.
+        """
+        if not self.git_dir:
+            return None
+        try:
+            if _object_format(self.git_dir) != "sha1":
+                raise UnsupportedIndex("not a SHA-1 repository")
+            for name, mode, mtime, size, flags, extended in _index_entries(
+                os.path.join(self.git_dir, "index")
+            ):
+                if extended & _SKIP_WORKTREE or mode == _GITLINK:
+                    continue
+                if flags & _STAGE_MASK or extended & _INTENT_TO_ADD:
+                    return True
+                if _changed(os.path.join(self.path, name), mode, mtime, size):
+                    return True
+        except FileNotFoundError:
+            # a fresh repository without an index
+            return False
+        except UnsupportedIndex as e:
+            logger.debug("Asking git for the status of %s: %s", self.path, e)
+            return self._git_status_dirty()
+        except (OSError, ValueError, struct.error) as e:
+            logger.debug("Could not read index of %s: %s", self.path, e)
+            return None
+        return False
+
+    def _git_status_dirty(self) -> bool | None:
+        try:
+            _, out, _ = proc.run(
+                (
+                    "git",
+                    "-C",
+                    self.path,
+                    "status",
+                    "--porcelain",
+                    "--untracked-files=no",
+                )
+            )
+        except SystemExit as e:
+            logger.debug("git status failed in %s: %s", self.path, e)
+            return None
+        return bool(out)
+
+
+@dataclass(frozen=True)
+class RepoStatus:
+    repo: WorkspaceRepo
+    branch: str | None
+    dirty: bool | None
+
+
+def _changed(path: str, mode: int, mtime: tuple[int, int], size: int) -> bool:
+    try:
+        st = os.lstat(path)
+    except (FileNotFoundError, NotADirectoryError):
+        return True
+
+    if stat.S_ISLNK(mode) != stat.S_ISLNK(st.st_mode):
+        return True
+    if st.st_size & 0xFFFFFFFF != size:
+        return True
+
+    seconds, nanoseconds = mtime
+    if int(st.st_mtime) != seconds:
+        return True
+    # git may be built without sub-second timestamps
+    return bool(nanoseconds) and st.st_mtime_ns % 1_000_000_000 != nanoseconds
+
+
+def _index_entries(
+    path: str,
+) -> list[tuple[str, int, tuple[int, int], int, int, int]]:
+    """
+    Returns (name, mode, (mtime s, ns), size, flags, extended flags) for
+    each entry of a git index (see gitformat-index(5)) of a SHA-1
+    repository. Raises UnsupportedIndex for split and sparse indexes.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+
+    signature, version, count = struct.unpack_from(">4sLL", data)
+    if signature != b"DIRC" or version not in (2, 3, 4):
+        raise ValueError(f"unsupported index {signature!r} v{version}")
+
+    entries = []
+    pos = 12
+    previous = b""
+    for _ in range(count):
+        (_, _, mtime_s, mtime_ns, _, _, mode, _, _, size) = struct.unpack_from(
+            ">10L", data, pos
+        )
+        # 40 bytes of stat data, a sha1, then 16 bits of flags
+        (flags,) = struct.unpack_from(">H", data, pos + 60)
+        name_pos = pos + 62
+        extended = 0
+        if version >= 3 and flags & _EXTENDED:
+            (extended,) = struct.unpack_from(">H", data, name_pos)
+            name_pos += 2
+
+        if version == 4:
+            # the name is prefix-compressed against the previous entry's
+            strip, name_pos = _varint(data, name_pos)
+            end = data.index(b"\0", name_pos)
+            name = previous[: len(previous) - strip] + data[name_pos:end]
+            pos = end + 1
+        else:
+            end = data.index(b"\0", name_pos)
+            name = data[name_pos:end]
+            # entries are NUL-padded to a multiple of 8 bytes
+            pos += (end - pos + 8) & ~7
+
+        previous = name
+        mtime = (mtime_s, mtime_ns)
+        entries.append((os.fsdecode(name), mode, mtime, size, flags, extended))
+
+    # extensions follow the entries, then a trailing sha1 of the index
+    while pos + 8 <= len(data) - 20:
+        extension, extension_size = struct.unpack_from(">4sL", data, pos)
+        if extension in _UNSUPPORTED_EXTENSIONS:
+            raise UnsupportedIndex(f"{extension.decode()} index extension")
+        pos += 8 + extension_size
+    return entries
+
+
+def _object_format(git_dir: str) -> str:
+    """The repository's extensions.objectFormat, read from its config"""
+    common_dir = git_dir
+    try:
+        # linked worktrees share the main repository's config
+        with open(os.path.join(git_dir, "commondir")) as f:
+            common_dir = os.path.join(git_dir, f.read().strip())
+    except OSError:
+        pass
+
+    try:
+        with open(os.path.join(common_dir, "config")) as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return "sha1"
+
+    section = ""
+    for line in lines:
+        line = line.strip()
+        if line.startswith("["):
+            section = line.strip("[]").strip().lower()
+            continue
+        key, _, value = line.partition("=")
+        if section == "extensions" and key.strip().lower() == "objectformat":
+            return value.split("#")[0].strip().lower()
+    return "sha1"
+
+
+def _varint(data: bytes, pos: int) -> tuple[int, int]:
+    byte = data[pos]
+    pos += 1
+    value = byte & 0x7F
+    while byte & 0x80:
+        byte = data[pos]
+        pos += 1
+        value = ((value + 1) << 7) | (byte & 0x7F)
+    return value, pos
+
+
+def _git_dir(path: str) -> str | None:
+    dotgit = os.path.join(path, ".git")
+    try:
+        st = os.stat(dotgit)
+    except OSError:
+        return None
+
+    if stat.S_ISDIR(st.st_mode):
+        return dotgit
+
+    # worktrees and submodules point elsewhere: "gitdir: <path>"
+    try:
+        with open(dotgit) as f:
+            line = f.readline().strip()
+    except OSError:
+        return None
+    if not line.startswith("gitdir: "):
+        return None
+    return os.path.normpath(os.path.join(path, line[8:]))
+
+
+# name -> (directory mtime, git dir, has .devtools)
+_CacheEntry = tuple[int, str | None, bool]
+
+
+class Workspace:
+    def __init__(self, path: str) -> None:
+        self.path = os.path.normpath(os.path.expanduser(path))
+
+    def __repr__(self) -> str:
+        return f"Workspace: {self.path}"
+
+    def cache_path(self) -> str:
+        digest = hashlib.sha1(self.path.encode()).hexdigest()[:16]
+        return os.path.join(constants.root, "cache", f"workspace-{digest}.json")
+
+    def _load_cache(self) -> tuple[int, dict[str, _CacheEntry]]:
+        try:
+            with open(self.cache_path()) as f:
+                data = json.load(f)
+            if data["version"] != CACHE_VERSION or data["path"] != self.path:
+                return 0, {}
+            return data["mtime"], {
+                name: (mtime, git_dir, has_devtools)
+                for name, (mtime, git_dir, has_devtools) in data[
+                    "entries"
+                ].items()
+            }
+        except (OSError, ValueError, KeyError, TypeError):
+            return 0, {}
+
+    def _save_cache(self, mtime: int, entries: dict[str, _CacheEntry]) -> None:
+        try:
+            with fs.atomic_path(self.cache_path()) as tmp, open(tmp, "w") as f:
+                json.dump(
+                    {
+                        "version": CACHE_VERSION,
+                        "path": self.path,
+                        "mtime": mtime,
+                        "entries": entries,
+                    },
+                    f,
+                )
+        except OSError as e:
+            logger.debug("Could not write workspace cache: %s", e)
+
+    def _scan(
+        self, name: str, cached: _CacheEntry | None
+    ) -> _CacheEntry | None:
+        path = os.path.join(self.path, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if not stat.S_ISDIR(st.st_mode):
+            return None
+
+        # adding or removing .git or .devtools changes the directory's mtime
+        if cached is not None and cached[0] == st.st_mtime_ns:
+            return cached
+
+        return (
+            st.st_mtime_ns,
+            _git_dir(path),
+            os.path.isdir(os.path.join(path, constants.APP_DIR)),
+        )
+
+    def repos(self, jobs: int = DEFAULT_JOBS) -> Sequence[WorkspaceRepo]:
+        """Repositories (git checkouts or .devtools directories), by name"""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return []
+
+        cached_mtime, cached = self._load_cache()
+        if mtime == cached_mtime:
+            names = list(cached)
+        else:
+            names = [
+                entry.name
+                for entry in os.scandir(self.path)
+                if not entry.name.startswith(".")
+            ]
+
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            scanned = pool.map(
+                lambda name: (name, self._scan(name, cached.get(name))), names
+            )
+            entries = {
+                name: entry for name, entry in scanned if entry is not None
+            }
+
+        if (mtime, entries) != (cached_mtime, cached):
+            self._save_cache(mtime, entries)
+
+        return [
+            WorkspaceRepo(
+                name=name,
+                path=os.path.join(self.path, name),
+                git_dir=git_dir,
+                has_devtools=has_devtools,
+            )
+            for name, (_, git_dir, has_devtools) in sorted(entries.items())
+            if git_dir or has_devtools
+        ]
+
+    def status(
+        self,
+        repos: Sequence[WorkspaceRepo] | None = None,
+        jobs: int = DEFAULT_JOBS,
+    ) -> Sequence[RepoStatus]:
+        """Branch and dirty state of each repository, read in parallel"""
+        if repos is None:
+            repos = self.repos(jobs=jobs)
+
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            return list(
+                pool.map(
+                    lambda repo: RepoStatus(
+                        repo=repo, branch=repo.branch(), dirty=repo.is_dirty()
+                    ),
+                    repos,
+                )
+            )
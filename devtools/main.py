@@ -10,8 +10,8 @@ import sentry_sdk
 from devtools import constants
 from devtools.lib import proc
 from devtools.lib.config import ConfigOpt
-from devtools.lib.config import get_config
-from devtools.lib.config import verify_config
+from devtools.lib.config import is_complete
+from devtools.lib.config import load_snapshot
 from devtools.lib.context import Context
 from devtools.lib.modules import CommandLoader
 from devtools.lib.modules import ExitCode
@@ -69,17 +69,21 @@ def devtools(argv: Sequence[str]) -> ExitCode:
 
         readline.parse_and_bind("bind ^I rl_complete")
 
-    if not verify_config("devtools", CONFIG_OPTS):
+    current_root = _default_current_root()
+
+    # only the user's configuration; a repository mustn't be able to
+    # change the workspace or satisfy the completeness check
+    config = load_snapshot()
+
+    if not is_complete(config, "devtools", CONFIG_OPTS):
         logger.warning(
             "Configuration requires init; run %s",
             proc.xtrace(("devtools", "config", "init")),
         )
         logger.warning("Continuing with defaults...")
 
-    config = get_config()
-
-    workspace = config.get(
-        constants.APP_NAME, "workspace", fallback=_default_workspace()
+    workspace = (
+        config.get(constants.APP_NAME, "workspace") or _default_workspace()
     )
 
     sentry_sdk.set_user(
@@ -98,7 +102,6 @@ def devtools(argv: Sequence[str]) -> ExitCode:
     )
 
     # load repo-specific commands
-    current_root = _default_current_root()
     if current_root:
         loader.add_source(
             "devtools.repocommands",
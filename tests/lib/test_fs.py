@@ -1,17 +1,24 @@
 from __future__ import annotations
 
+import hashlib
+import http.server
 import os
 import pathlib
 import subprocess
+import sys
 import tarfile
 import tempfile
+import time
+from unittest import mock
 
 import pytest
 
+from devtools.commands.cache import CacheRequestHandler
 from devtools.lib import fs
 from devtools.lib import proc
 from devtools.lib import repository
 from tests.utils import chdir
+from tests.utils import http_server
 
 
 def test_gitroot(tmp_path: pathlib.Path) -> None:
@@ -98,6 +105,79 @@ def test_idempotent_add(tmp_path: pathlib.Path) -> None:
         )
 
 
+SNIPPETS = (
+    "**/*.pyc\n.idea/\n",
+    ".idea/",
+    ".idea",
+    "**/*.pyc\n.idea/\n",
+    "**/*.pyc\n.idea\n",
+    ".last",
+    ".last",
+    "\n    **/*.pyc    \n   .idea/     \n\n    ",
+    "",
+)
+
+
+@pytest.mark.parametrize("trim", (True, False))
+@pytest.mark.parametrize("initial", (None, "", "existing", "existing\n"))
+def test_idempotent_add_many(
+    tmp_path: pathlib.Path, trim: bool, initial: str | None
+) -> None:
+    batched = tmp_path.joinpath("batched")
+    sequential = tmp_path.joinpath("sequential")
+    if initial is not None:
+        batched.write_text(initial)
+        sequential.write_text(initial)
+
+    fs.idempotent_add_many(str(batched), SNIPPETS, trim=trim)
+    for snippet in SNIPPETS:
+        fs.idempotent_add(str(sequential), snippet, trim=trim)
+
+    assert batched.read_text() == sequential.read_text()
+
+
+def test_idempotent_add_many_symlink(tmp_path: pathlib.Path) -> None:
+    target = tmp_path.joinpath("dotfiles", "bashrc")
+    target.parent.mkdir()
+    target.write_text("export A=1\n")
+    target.chmod(0o640)
+
+    rc = tmp_path.joinpath(".bashrc")
+    rc.symlink_to(target)
+
+    fs.idempotent_add_many(str(rc), ("export A=1", "export B=2"))
+
+    assert rc.is_symlink()
+    assert target.read_text() == "export A=1\nexport B=2\n"
+    assert target.stat().st_mode & 0o777 == 0o640
+
+
+def test_atomic_path(tmp_path: pathlib.Path) -> None:
+    target = tmp_path / "sub" / "state.json"
+
+    with fs.atomic_path(str(target)) as tmp:
+        pathlib.Path(tmp).write_text("new")
+        assert not target.exists()
+    assert target.read_text() == "new"
+    assert oct(target.stat().st_mode & 0o777) == oct(0o600)
+
+    with pytest.raises(ValueError):
+        with fs.atomic_path(str(target)) as tmp:
+            pathlib.Path(tmp).write_text("partial")
+            raise ValueError()
+    # untouched, and nothing left behind
+    assert target.read_text() == "new"
+    assert os.listdir(tmp_path / "sub") == ["state.json"]
+
+
+@pytest.mark.parametrize(
+    "value,timeout", ((None, 10.0), ("2.5", 2.5), ("soon", 10.0))
+)
+def test_mirror_timeout(value: str | None, timeout: float) -> None:
+    with mock.patch("devtools.lib.config.get_value", return_value=value):
+        assert fs.mirror_timeout() == timeout
+
+
 def test_retrieve_temp_file() -> None:
     with fs.retrieve_temp_file(
         "https://raw.githubusercontent.com/getsentry/sentry-devtools/main/install-devtools.sh"
@@ -124,3 +204,157 @@ def test_unpack_tar(tar: pathlib.Path, tmp_path: pathlib.Path) -> None:
     dest = tmp_path.joinpath("dest")
     fs.unpack(str(tar), str(dest))
     assert dest.joinpath("hello.txt").read_text() == "hello world\n"
+
+
+def test_unpack_tar_noop(tar: pathlib.Path, tmp_path: pathlib.Path) -> None:
+    dest = tmp_path.joinpath("dest")
+    fs.unpack(str(tar), str(dest))
+    assert dest.joinpath(fs.UNPACK_MANIFEST).exists()
+
+    hello = dest.joinpath("hello.txt")
+    os.utime(hello, ns=(0, 0))
+
+    fs.unpack(str(tar), str(dest))
+    # untouched; nothing was re-extracted
+    assert hello.stat().st_mtime_ns == 0
+
+
+def test_unpack_tar_repairs(tar: pathlib.Path, tmp_path: pathlib.Path) -> None:
+    dest = tmp_path.joinpath("dest")
+    fs.unpack(str(tar), str(dest))
+
+    hello = dest.joinpath("hello.txt")
+    hello.write_text("truncated")
+    fs.unpack(str(tar), str(dest))
+    assert hello.read_text() == "hello world\n"
+
+    hello.unlink()
+    fs.unpack(str(tar), str(dest))
+    assert hello.read_text() == "hello world\n"
+
+
+def test_unpack_tar_new_archive(tmp_path: pathlib.Path) -> None:
+    dest = tmp_path.joinpath("dest")
+    plain = tmp_path.joinpath("plain")
+
+    for version in ("v1", "v2"):
+        plain.write_text(f"{version}\n")
+        tar = tmp_path.joinpath(f"{version}.tar")
+        with tarfile.open(tar, "w:tar") as tarf:
+            tarf.add(plain, arcname="version.txt")
+        fs.unpack(str(tar), str(dest))
+
+    assert dest.joinpath("version.txt").read_text() == "v2\n"
+
+
+ARTIFACT = b"artifact" * 1024
+ARTIFACT_SHA256 = hashlib.sha256(ARTIFACT).hexdigest()
+
+
+class SlowArtifactHandler(http.server.BaseHTTPRequestHandler):
+    transfers = 0
+
+    def log_message(self, format: str, *args: object) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        SlowArtifactHandler.transfers += 1
+        time.sleep(0.5)
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(ARTIFACT)))
+        self.end_headers()
+        self.wfile.write(ARTIFACT)
+
+
+def test_download_dedup(tmp_path: pathlib.Path) -> None:
+    dest = tmp_path.joinpath("cache", ARTIFACT_SHA256)
+    SlowArtifactHandler.transfers = 0
+
+    with http_server(SlowArtifactHandler) as url:
+        script = (
+            "import sys; from devtools.lib import fs; "
+            "print(fs.download(sys.argv[1], sys.argv[2], sys.argv[3]))"
+        )
+        procs = [
+            subprocess.Popen(
+                (sys.executable, "-c", script, url, ARTIFACT_SHA256, str(dest)),
+                cwd=pathlib.Path(__file__).parents[2],
+            )
+            for _ in range(4)
+        ]
+        assert [p.wait() for p in procs] == [0, 0, 0, 0]
+
+    assert SlowArtifactHandler.transfers == 1
+    assert dest.read_bytes() == ARTIFACT
+
+
+def test_download_after_crash(tmp_path: pathlib.Path) -> None:
+    dest = tmp_path.joinpath(ARTIFACT_SHA256)
+
+    # leftovers of a process which died mid-download
+    tmp_path.joinpath(f"{ARTIFACT_SHA256}.lock").write_text("99999999\n")
+    tmp_path.joinpath(f"{ARTIFACT_SHA256}.part").write_bytes(b"partial")
+
+    with http_server(SlowArtifactHandler) as url:
+        assert fs.download(url, ARTIFACT_SHA256, str(dest)) == str(dest)
+
+    assert dest.read_bytes() == ARTIFACT
+    assert not tmp_path.joinpath(f"{ARTIFACT_SHA256}.part").exists()
+
+
+class BrokenMirrorHandler(http.server.BaseHTTPRequestHandler):
+    def log_message(self, format: str, *args: object) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        if self.path.startswith("/garbage/"):
+            self.wfile.write(b"garbage\r\n\r\n")
+            return
+        # closes the connection halfway through a chunked body
+        self.protocol_version = "HTTP/1.1"
+        self.send_response(200)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        half = ARTIFACT[: len(ARTIFACT) // 2]
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(half), half))
+        self.close_connection = True
+
+
+def test_download_mirrors(tmp_path: pathlib.Path) -> None:
+    mirror_root = tmp_path.joinpath("mirror")
+    mirror_root.mkdir()
+    mirror_root.joinpath(ARTIFACT_SHA256).write_bytes(ARTIFACT)
+
+    class Handler(CacheRequestHandler):
+        cache_root = str(mirror_root)
+
+    config_path = tmp_path.joinpath("config.ini")
+    dest = tmp_path.joinpath("dest")
+
+    with http_server(Handler) as mirror, http_server(
+        BrokenMirrorHandler
+    ) as broken, mock.patch("devtools.constants.config", str(config_path)):
+        config_path.write_text(
+            "[devtools]\n"
+            "mirrors =\n"
+            # nothing listens here
+            "    http://127.0.0.1:1/\n"
+            f"    https://upstream.invalid/ {mirror}/missing/\n"
+            f"    {broken}/truncated/\n"
+            f"    {broken}/garbage/\n"
+            f"    {mirror}\n"
+        )
+
+        assert fs.mirror_urls("https://upstream.invalid/a.tgz", "abc") == [
+            "http://127.0.0.1:1/abc",
+            f"{mirror}/missing/a.tgz",
+            f"{broken}/truncated/abc",
+            f"{broken}/garbage/abc",
+            f"{mirror}/abc",
+        ]
+
+        fs.download(
+            "https://upstream.invalid/a.tgz", ARTIFACT_SHA256, str(dest)
+        )
+
+    assert dest.read_bytes() == ARTIFACT
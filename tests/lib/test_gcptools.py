@@ -0,0 +1,338 @@
+from __future__ import annotations
+
+import datetime
+import http.server
+import json
+import os
+import pathlib
+import stat
+import subprocess
+import threading
+from collections.abc import Iterator
+from unittest import mock
+
+import pytest
+
+from devtools.lib import gcptools
+from devtools.lib import httpclient
+from devtools.lib.repository import Repository
+from tests.utils import http_server
+
+TARGET = "deploy@project.iam.gserviceaccount.com"
+SCOPES = ("email", "https://www.googleapis.com/auth/cloud-platform")
+
+
+def expire_time(seconds: float) -> str:
+    expiry = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(
+        seconds=seconds
+    )
+    # as GCP formats it, with nanoseconds
+    return expiry.strftime("%Y-%m-%dT%H:%M:%S.123456789Z")
+
+
+@pytest.fixture
+def gcloud(tmp_path: pathlib.Path) -> Iterator[pathlib.Path]:
+    """A gcloud configuration directory, logged in as me@example.com"""
+    config_dir = tmp_path / "gcloud"
+    config_dir.joinpath("configurations").mkdir(parents=True)
+    config_dir.joinpath("active_config").write_text("work\n")
+    config_dir.joinpath("configurations", "config_work").write_text(
+        "[core]\naccount = me@example.com\nproject = p\n"
+    )
+
+    env = {"CLOUDSDK_CONFIG": str(config_dir)}
+    root = tmp_path / "root"
+    with mock.patch("devtools.constants.root", str(root)), mock.patch(
+        "devtools.constants.config", str(root / "config.ini")
+    ):
+        with mock.patch.dict("devtools.constants.user_environ", env):
+            yield config_dir
+
+
+def test_current_account(gcloud: pathlib.Path) -> None:
+    assert gcptools.current_account() == "me@example.com"
+
+    env = {"CLOUDSDK_ACTIVE_CONFIG_NAME": "other"}
+    with mock.patch.dict("devtools.constants.user_environ", env):
+        assert gcptools.current_account() is None
+
+    env = {"CLOUDSDK_CORE_ACCOUNT": "you@example.com"}
+    with mock.patch.dict("devtools.constants.user_environ", env):
+        assert gcptools.current_account() == "you@example.com"
+
+
+def test_sudo_reuses_tokens(gcloud: pathlib.Path) -> None:
+    identity = gcptools.Identity("me@example.com", "user-token", None)
+    minted = [
+        gcptools.Identity(TARGET, "token-1", expire_time(3600)),
+        gcptools.Identity(TARGET, "token-2", expire_time(200)),
+        gcptools.Identity(TARGET, "token-3", expire_time(3600)),
+    ]
+
+    with mock.patch.object(
+        gcptools, "get_identity", return_value=identity
+    ) as get_identity, mock.patch.object(
+        gcptools, "create_token", side_effect=minted
+    ) as create_token:
+        assert gcptools.sudo(TARGET, SCOPES).token == "token-1"
+        # neither gcloud nor the IAM API are needed again
+        assert gcptools.sudo(TARGET, SCOPES).token == "token-1"
+        assert gcptools.sudo(TARGET, tuple(reversed(SCOPES))).token == "token-1"
+        assert get_identity.call_count == 1
+
+        # other scopes are another token
+        assert gcptools.sudo(TARGET, SCOPES[:1]).token == "token-2"
+        # which expires within the margin
+        assert gcptools.sudo(TARGET, SCOPES[:1]).token == "token-3"
+        assert create_token.call_count == 3
+
+    mode = os.stat(gcptools.token_cache_path()).st_mode
+    assert stat.S_IMODE(mode) == 0o600
+
+
+def test_token_margin(gcloud: pathlib.Path) -> None:
+    expiry = expire_time(600)
+    gcptools.cache_token(
+        "me@example.com",
+        TARGET,
+        SCOPES,
+        3600,
+        gcptools.Identity(TARGET, "token", expiry),
+    )
+
+    assert gcptools.cached_token("me@example.com", TARGET, SCOPES, 3600)
+    assert not gcptools.cached_token("you@example.com", TARGET, SCOPES, 3600)
+    with mock.patch.object(gcptools, "get_value", return_value="900"):
+        assert gcptools.token_margin() == 900
+        assert not gcptools.cached_token("me@example.com", TARGET, SCOPES, 3600)
+
+
+def config_helper(token: str, expiry: str) -> tuple[int, str, str]:
+    return (
+        0,
+        "[configuration.properties.core]\n"
+        "account = me@example.com\n"
+        "[credential]\n"
+        f"access_token = {token}\n"
+        f"token_expiry = {expiry}\n",
+        "",
+    )
+
+
+def test_get_identity(gcloud: pathlib.Path) -> None:
+    outputs = [
+        config_helper("token-1", expire_time(3600)),
+        config_helper("token-2", expire_time(3600)),
+        config_helper("token-3", expire_time(3600)),
+    ]
+    with mock.patch("devtools.lib.proc.run", side_effect=outputs) as run:
+        assert gcptools.get_identity().token == "token-1"
+        # without running gcloud again
+        assert gcptools.get_identity().token == "token-1"
+        assert run.call_count == 1
+
+        assert gcptools.get_identity(refresh=True).token == "token-2"
+
+        # another account was activated
+        env = {"CLOUDSDK_CORE_ACCOUNT": "you@example.com"}
+        with mock.patch.dict("devtools.constants.user_environ", env):
+            assert gcptools.get_identity().token == "token-3"
+        assert run.call_count == 3
+
+    mode = os.stat(gcptools.identity_cache_path()).st_mode
+    assert stat.S_IMODE(mode) == 0o600
+
+
+def test_sudo_with_revoked_identity(gcloud: pathlib.Path) -> None:
+    outputs = [
+        config_helper("revoked-token", expire_time(3600)),
+        config_helper("user-token", expire_time(3600)),
+    ]
+    rejected = httpclient.HTTPError("https://iam", 401, "Unauthorized", b"")
+    minted = gcptools.Identity(TARGET, "token", expire_time(3600))
+    with mock.patch(
+        "devtools.lib.proc.run", side_effect=outputs
+    ) as run, mock.patch.object(
+        gcptools, "create_token", side_effect=[rejected, minted]
+    ) as create_token:
+        gcptools.get_identity()
+        assert gcptools.sudo(TARGET, SCOPES) == minted
+
+    # gcloud was asked again, once
+    assert run.call_count == 2
+    assert [c.args[0].token for c in create_token.call_args_list] == [
+        "revoked-token",
+        "user-token",
+    ]
+    assert gcptools.cached_identity() == gcptools.Identity(
+        "me@example.com", "user-token", mock.ANY
+    )
+
+
+def test_get_identity_expired(gcloud: pathlib.Path) -> None:
+    outputs = [
+        config_helper("token-1", expire_time(60)),
+        config_helper("token-2", expire_time(3600)),
+    ]
+    with mock.patch("devtools.lib.proc.run", side_effect=outputs):
+        assert gcptools.get_identity().token == "token-1"
+        assert gcptools.get_identity().token == "token-2"
+        assert gcptools.cached_identity() == gcptools.get_identity()
+
+
+def test_keep_token_file(gcloud: pathlib.Path) -> None:
+    tokens = iter(range(100))
+
+    def mint() -> gcptools.Identity:
+        # expires within the margin, so it is renewed at once
+        return gcptools.Identity(
+            TARGET, f"token-{next(tokens)}", expire_time(1)
+        )
+
+    path = gcptools.token_file_path(TARGET, 1)
+    seen = set()
+    session = subprocess.Popen(("sleep", "1"))
+    with mock.patch.object(gcptools, "REFRESH_POLL", 0.01), mock.patch.object(
+        gcptools, "REFRESH_MIN_INTERVAL", 0.1
+    ):
+        refresher = threading.Thread(
+            target=gcptools.keep_token_file, args=(path, mint, session.pid)
+        )
+        refresher.start()
+        while session.poll() is None:
+            if os.path.exists(path):
+                seen.add(pathlib.Path(path).read_text())
+                assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+        refresher.join(timeout=5)
+
+    assert not refresher.is_alive()
+    assert len(seen) > 2
+    # cleaned up with the session
+    assert not os.path.exists(path)
+
+
+def test_to_env() -> None:
+    identity = gcptools.Identity(TARGET, "token", None)
+    assert "CLOUDSDK_AUTH_ACCESS_TOKEN_FILE" not in gcptools.to_env(identity)
+    env = gcptools.to_env(identity, "/tmp/token")
+    assert env["CLOUDSDK_AUTH_ACCESS_TOKEN_FILE"] == "/tmp/token"
+
+
+class IAMHandler(http.server.BaseHTTPRequestHandler):
+    """Stands in for iamcredentials' generateAccessToken"""
+
+    protocol_version = "HTTP/1.1"
+    requests: list[tuple[str, dict[str, object]]] = []
+    barrier: threading.Barrier | None = None
+
+    def log_message(self, format: str, *args: object) -> None:
+        pass
+
+    def do_POST(self) -> None:
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if self.headers["Authorization"] != "Bearer user-token":
+            self.send_response(401)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        account = self.path.split("/")[-1].split(":")[0].replace("%40", "@")
+        IAMHandler.requests.append((account, body))
+        if IAMHandler.barrier is not None:
+            # every request is in flight at once
+            IAMHandler.barrier.wait(timeout=5)
+
+        reply = json.dumps(
+            {"accessToken": f"token-{account}", "expireTime": expire_time(3600)}
+        ).encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+
+
+@pytest.fixture
+def iam(gcloud: pathlib.Path) -> Iterator[type[IAMHandler]]:
+    IAMHandler.requests = []
+    IAMHandler.barrier = None
+    httpclient.close_all()
+    with http_server(IAMHandler) as url:
+        with mock.patch.object(gcptools, "IAM_API", f"{url}/v1"):
+            yield IAMHandler
+    httpclient.close_all()
+
+
+def test_sudo_many(iam: type[IAMHandler], tmp_path: pathlib.Path) -> None:
+    reporoot = tmp_path / "repo"
+    reporoot.joinpath(".devtools").mkdir(parents=True)
+    reporoot.joinpath(".devtools", "config.ini").write_text(
+        "".join(
+            f"[gcpsudo.sa{i}]\n"
+            f"account = sa{i}@project.iam.gserviceaccount.com\n"
+            "scopes = email\n"
+            for i in range(4)
+        )
+    )
+    repo = Repository("org", "repo", str(reporoot))
+    identity = gcptools.Identity("me@example.com", "user-token", None)
+
+    with mock.patch.object(
+        gcptools, "get_identity", return_value=identity
+    ) as get_identity:
+        # sa0 was minted before
+        gcptools.sudo(*gcptools.resolve_alias(repo, "sa0"))
+        iam.requests = []
+
+        iam.barrier = threading.Barrier(3)
+        tokens = gcptools.sudo_many(repo, ["sa3", "sa0", "sa1", "sa2"])
+
+    assert list(tokens) == ["sa3", "sa0", "sa1", "sa2"]
+    assert tokens["sa1"] == gcptools.Identity(
+        "sa1@project.iam.gserviceaccount.com",
+        "token-sa1@project.iam.gserviceaccount.com",
+        mock.ANY,
+    )
+    assert sorted(account for account, _ in iam.requests) == [
+        f"sa{i}@project.iam.gserviceaccount.com" for i in (1, 2, 3)
+    ]
+    assert iam.requests[0][1] == {"lifetime": "3600s", "scope": ["email"]}
+    assert get_identity.call_count == 2
+
+    # all cached now
+    with mock.patch.object(gcptools, "get_identity") as get_identity:
+        assert gcptools.sudo_many(repo, ["sa1", "sa2"]) == {
+            "sa1": tokens["sa1"],
+            "sa2": tokens["sa2"],
+        }
+    get_identity.assert_not_called()
+
+    with pytest.raises(SystemExit):
+        gcptools.sudo_many(repo, ["sa1", "nope"])
+
+
+def test_sudo_many_with_revoked_identity(
+    iam: type[IAMHandler], tmp_path: pathlib.Path
+) -> None:
+    reporoot = tmp_path / "repo"
+    reporoot.joinpath(".devtools").mkdir(parents=True)
+    reporoot.joinpath(".devtools", "config.ini").write_text(
+        "".join(
+            f"[gcpsudo.sa{i}]\n"
+            f"account = sa{i}@project.iam.gserviceaccount.com\n"
+            "scopes = email\n"
+            for i in range(2)
+        )
+    )
+    repo = Repository("org", "repo", str(reporoot))
+    outputs = [
+        config_helper("revoked-token", expire_time(3600)),
+        config_helper("user-token", expire_time(3600)),
+    ]
+    with mock.patch("devtools.lib.proc.run", side_effect=outputs) as run:
+        gcptools.get_identity()
+        tokens = gcptools.sudo_many(repo, ["sa0", "sa1"])
+
+    assert run.call_count == 2
+    assert [t.token for t in tokens.values()] == [
+        "token-sa0@project.iam.gserviceaccount.com",
+        "token-sa1@project.iam.gserviceaccount.com",
+    ]
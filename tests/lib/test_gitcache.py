@@ -0,0 +1,104 @@
+from __future__ import annotations
+
+import fcntl
+import pathlib
+import subprocess
+from collections.abc import Iterator
+from unittest import mock
+
+import pytest
+
+from devtools.commands import github
+from devtools.lib import gitcache
+
+
+def git(*args: str) -> str:
+    return subprocess.run(
+        ("git", "-c", "user.name=t", "-c", "user.email=t@t", *args),
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout.strip()
+
+
+@pytest.fixture
+def origin(tmp_path: pathlib.Path) -> Iterator[pathlib.Path]:
+    """A repository standing in for git@github.com:org/a"""
+    origin = tmp_path / "origin"
+    work = tmp_path / "work"
+    git("init", "-q", "-b", "main", str(work))
+    for i in range(3):
+        work.joinpath(f"file{i}").write_text(f"{i}\n" * 1000)
+        git("-C", str(work), "add", ".")
+        git("-C", str(work), "commit", "-q", "-m", str(i))
+    git("-C", str(work), "tag", "v1")
+    git("clone", "-q", "--bare", str(work), str(origin / "org" / "a"))
+
+    env = {
+        "GIT_CONFIG_COUNT": "1",
+        "GIT_CONFIG_KEY_0": f"url.file://{origin}/.insteadOf",
+        "GIT_CONFIG_VALUE_0": "git@github.com:",
+    }
+    with mock.patch("devtools.constants.root", str(tmp_path / "root")):
+        with mock.patch.dict("devtools.constants.user_environ", env):
+            yield origin
+
+
+def test_refresh(origin: pathlib.Path) -> None:
+    gitcache.add("org/a", "git@github.com:org/a")
+    # registering again is a no-op
+    gitcache.add("org/a", "git@github.com:org/a")
+    assert gitcache.remotes() == ["org/a"]
+
+    assert gitcache.refresh()
+
+    cache = gitcache.cache_path()
+    refs = git("--git-dir", cache, "for-each-ref", "--format=%(refname)")
+    assert refs.splitlines() == [
+        "refs/remotes/org/a/main",
+        "refs/remotes/org/a/tags/v1",
+    ]
+    assert git("--git-dir", cache, "config", "gc.pruneExpire") == "never"
+
+    # only one refresh at a time
+    with open(f"{cache}.lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        assert not gitcache.refresh()
+
+
+def local_objects(clone: pathlib.Path) -> tuple[str, str]:
+    """Loose and packed object counts of a clone, excluding alternates"""
+    stats = dict(
+        line.split(": ")
+        for line in git(
+            "--git-dir", str(clone / ".git"), "count-objects", "-v"
+        ).splitlines()
+    )
+    return stats["count"], stats["in-pack"]
+
+
+def test_fetch_with_cache(origin: pathlib.Path, tmp_path: pathlib.Path) -> None:
+    workspace = tmp_path / "ws"
+    workspace.mkdir()
+    alternates = workspace / "a" / ".git" / "objects" / "info" / "alternates"
+
+    # the first clone registers the repository with the cache and fills it,
+    # so it already borrows every object from it
+    with mock.patch.object(
+        gitcache, "refresh", wraps=gitcache.refresh
+    ) as refresh:
+        github.fetch_many(str(workspace), ["org/a"], git_cache=True)
+    refresh.assert_called_once_with(["org/a"], jobs=github.FETCH_JOBS)
+    assert gitcache.remotes() == ["org/a"]
+    assert alternates.read_text().strip() == f"{gitcache.cache_path()}/objects"
+    assert local_objects(workspace / "a") == ("0", "0")
+
+    # so do later clones, without fetching into the cache again
+    (workspace / "a").rename(workspace / "old")
+    with mock.patch.object(gitcache, "refresh") as refresh:
+        github.fetch_many(str(workspace), ["org/a"], git_cache=True)
+    refresh.assert_not_called()
+
+    assert alternates.read_text().strip() == f"{gitcache.cache_path()}/objects"
+    assert local_objects(workspace / "a") == ("0", "0")
+    assert git("-C", str(workspace / "a"), "log", "--format=%s") == "2\n1\n0"
@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+import gzip
+import http.server
+import json
+from collections.abc import Generator
+
+import pytest
+
+from devtools.lib import httpclient
+from tests.utils import http_server
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    connections: set[tuple[str, int]] = set()
+
+    def log_message(self, format: str, *args: object) -> None:
+        pass
+
+    def reply(
+        self, status: int, body: bytes, headers: dict[str, str] | None = None
+    ) -> None:
+        Handler.connections.add(self.client_address)
+        self.send_response(status)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        if self.path == "/hello":
+            self.reply(200, b"hello")
+        elif self.path == "/gzip":
+            assert self.headers["Accept-Encoding"] == "gzip"
+            self.reply(
+                200, gzip.compress(b"hello"), {"Content-Encoding": "gzip"}
+            )
+        elif self.path == "/drop":
+            # reply as if keeping the connection alive, then hang up
+            self.reply(200, b"dropped")
+            self.close_connection = True
+        elif self.path == "/redirect":
+            self.reply(302, b"", {"Location": "/hello"})
+        else:
+            self.reply(404, b"not found")
+
+    def do_POST(self) -> None:
+        data = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.reply(200, json.dumps({"echo": data}).encode())
+
+
+@pytest.fixture
+def server() -> Generator[str, None, None]:
+    Handler.connections = set()
+    httpclient.close_all()
+    with http_server(Handler) as url:
+        yield url
+    httpclient.close_all()
+
+
+def test_get(server: str) -> None:
+    response = httpclient.get(f"{server}/hello")
+    assert response.status == 200
+    assert response.body == b"hello"
+
+
+def test_keepalive(server: str) -> None:
+    for _ in range(3):
+        assert httpclient.get(f"{server}/hello").body == b"hello"
+    httpclient.post_json(f"{server}/post", {})
+
+    assert len(Handler.connections) == 1
+
+
+def test_gzip(server: str) -> None:
+    assert httpclient.get(f"{server}/gzip").body == b"hello"
+
+
+def test_redirect(server: str) -> None:
+    response = httpclient.get(f"{server}/redirect")
+    assert response.body == b"hello"
+    assert response.url == f"{server}/hello"
+
+
+def test_error(server: str) -> None:
+    with pytest.raises(httpclient.HTTPError) as e:
+        httpclient.get(f"{server}/missing")
+    assert e.value.status == 404
+    assert e.value.body == b"not found"
+
+    # the connection survives the error
+    assert httpclient.get(f"{server}/hello").body == b"hello"
+    assert len(Handler.connections) == 1
+
+
+def test_post_json(server: str) -> None:
+    assert httpclient.post_json(f"{server}/post", {"a": [1]}) == {
+        "echo": {"a": [1]}
+    }
+
+
+def test_stale_connection(server: str) -> None:
+    assert httpclient.get(f"{server}/drop").body == b"dropped"
+    assert httpclient.get(f"{server}/hello").body == b"hello"
+    assert len(Handler.connections) == 2
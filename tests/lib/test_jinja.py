@@ -0,0 +1,35 @@
+from __future__ import annotations
+
+import os
+import pathlib
+from unittest import mock
+
+import pytest
+from jinja2 import TemplateNotFound
+
+from devtools.commands import meta
+from devtools.commands import repo
+from devtools.lib import jinja
+
+
+def test_get_env(tmp_path: pathlib.Path) -> None:
+    with mock.patch("devtools.constants.root", str(tmp_path)), mock.patch(
+        "devtools.lib.jinja._bytecode_cache", None
+    ), mock.patch.dict(jinja._environments, clear=True):
+        env = jinja.get_env(repo.mkscript)
+        assert jinja.get_env(repo.mkscript) is env
+
+        # action specific resources resolve per command
+        script = env.get_template("script.jinja")
+        assert script.filename == "script.jinja"
+        assert "argparse" in script.render(
+            name="x", interpreter="python", arguments=[]
+        )
+        assert "json" in jinja.get_env(meta.mkpipe).get_template(
+            "script.jinja"
+        ).render(interpreter="python")
+
+        with pytest.raises(TemplateNotFound):
+            env.get_template("missing.jinja")
+
+        assert os.listdir(tmp_path.joinpath("cache", "jinja"))
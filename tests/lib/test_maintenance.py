@@ -0,0 +1,65 @@
+from __future__ import annotations
+
+import pathlib
+import subprocess
+from collections.abc import Iterator
+from unittest import mock
+
+import pytest
+
+from devtools.lib import maintenance
+from devtools.lib.workspace import Workspace
+
+
+def git(*args: str) -> str:
+    return subprocess.run(
+        ("git", "-c", "user.name=t", "-c", "user.email=t@t", *args),
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout.strip()
+
+
+@pytest.fixture
+def ws(tmp_path: pathlib.Path) -> Iterator[pathlib.Path]:
+    ws = tmp_path / "ws"
+    origin = tmp_path / "origin.git"
+    git("init", "-q", "--bare", "-b", "main", str(origin))
+    git("clone", "-q", str(origin), str(ws / "app"))
+    ws.joinpath("app", "file").write_text("a\n")
+    git("-C", str(ws / "app"), "add", ".")
+    git("-C", str(ws / "app"), "commit", "-q", "-m", "init")
+    git("-C", str(ws / "app"), "push", "-q", "origin", "main")
+    git("-C", str(ws / "app"), "worktree", "add", "-q", str(ws / "app-wt"))
+
+    env = {"GIT_CONFIG_GLOBAL": str(tmp_path / "gitconfig")}
+    with mock.patch("devtools.constants.root", str(tmp_path / "root")):
+        with mock.patch.dict("devtools.constants.user_environ", env):
+            yield ws
+
+
+def test_maintain(ws: pathlib.Path, tmp_path: pathlib.Path) -> None:
+    repos = Workspace(str(ws)).repos()
+    assert [maintenance.is_worktree(r) for r in repos] == [False, True]
+    app = repos[0]
+
+    maintenance.register(app, ("prefetch", "commit-graph"))
+    registered = git(
+        "config", "--file", str(tmp_path / "gitconfig"), "maintenance.repo"
+    )
+    assert registered == str(ws / "app")
+    assert (
+        git("-C", app.path, "config", "maintenance.prefetch.enabled") == "true"
+    )
+    assert (
+        git("-C", app.path, "config", "maintenance.loose-objects.enabled")
+        == "false"
+    )
+
+    stats = maintenance.run(app, ("prefetch", "commit-graph"))
+    assert stats.code == 0, stats.error
+    assert git("-C", app.path, "for-each-ref", "refs/prefetch/")
+    assert (ws / "app" / ".git" / "objects" / "info" / "commit-graphs").is_dir()
+
+    maintenance.save_stats({app.path: stats})
+    assert maintenance.load_stats() == {app.path: stats}
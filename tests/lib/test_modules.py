@@ -0,0 +1,37 @@
+from __future__ import annotations
+
+import os
+
+import pytest
+
+from devtools.commands import gcloud
+from devtools.commands import meta
+from devtools.lib import modules
+
+
+def test_find_resource() -> None:
+    scopes = modules.find_resource(gcloud.create_alias, "scopes.csv")
+    assert os.path.basename(scopes) == "scopes.csv"
+
+    # action specific resources are preferred
+    script = modules.find_resource(meta.mkpipe, "script.jinja")
+    assert os.path.basename(script) == "mkpipe_script.jinja"
+
+    with pytest.raises(FileNotFoundError):
+        modules.find_resource(meta.mkcommand, "script.jinja")
+
+
+def test_resource_index(tmp_path: str) -> None:
+    assert modules.resource_index(f"{tmp_path}/missing") == {}
+
+    index = modules.resource_index(str(tmp_path))
+    assert index == {}
+    assert modules.resource_index(str(tmp_path)) is index
+
+    with open(f"{tmp_path}/a.jinja", "w"):
+        pass
+    os.utime(tmp_path, ns=(0, 0))
+
+    assert modules.resource_index(str(tmp_path)) == {
+        "a.jinja": f"{tmp_path}/a.jinja"
+    }
@@ -0,0 +1,62 @@
+from __future__ import annotations
+
+import threading
+import time
+
+from devtools.lib import parallel
+
+
+def test_run_all_order_and_errors() -> None:
+    def fn(n: int) -> int:
+        time.sleep(0.01 * (5 - n))
+        if n == 3:
+            raise ValueError(n)
+        return n * 2
+
+    done: list[int] = []
+    outcomes = parallel.run_all(
+        fn, range(5), jobs=5, on_done=lambda o: done.append(o.item)
+    )
+
+    assert [o.item for o in outcomes] == [0, 1, 2, 3, 4]
+    assert [o.value for o in outcomes] == [0, 2, 4, None, 8]
+    assert isinstance(outcomes[3].error, ValueError)
+    assert sorted(done) == [0, 1, 2, 3, 4]
+    # completion order, shortest sleep first
+    assert done[0] == 4
+
+
+def test_run_all_bounded() -> None:
+    lock = threading.Lock()
+    running = peak = 0
+
+    def fn(n: int) -> None:
+        nonlocal running, peak
+        with lock:
+            running += 1
+            peak = max(peak, running)
+        time.sleep(0.01)
+        with lock:
+            running -= 1
+
+    parallel.run_all(fn, range(12), jobs=3)
+    assert peak == 3
+
+
+def test_run_all_fail_fast() -> None:
+    outcomes = parallel.run_all(
+        lambda n: n,
+        range(6),
+        jobs=1,
+        fail_fast=True,
+        failed=lambda o: o.value == 2,
+    )
+
+    assert [o.skipped for o in outcomes] == [
+        False,
+        False,
+        False,
+        True,
+        True,
+        True,
+    ]
@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import os
+import subprocess
 import sys
 
 import pytest
@@ -72,3 +73,24 @@ def test_run_command_failed() -> None:
 
     with pytest.raises(proc.CommandError):
         proc.run(cmd)
+
+
+def test_exec_replace() -> None:
+    script = (
+        "from devtools.lib import proc\n"
+        "print('before', end='')\n"
+        "proc.exec_replace(('sh', '-c', 'echo \" $VAR1 $$\"; exit 3'), env={'VAR1': 'value1'})\n"
+    )
+    child = subprocess.Popen(
+        (sys.executable, "-c", script), stdout=subprocess.PIPE, text=True
+    )
+    out, _ = child.communicate()
+
+    # buffered output comes first, then the command runs in the same process
+    assert out == f"before value1 {child.pid}\n"
+    assert child.returncode == 3
+
+
+def test_exec_replace_command_not_found() -> None:
+    with pytest.raises(SystemExit):
+        proc.exec_replace(("invalid_command",))
@@ -0,0 +1,38 @@
+from __future__ import annotations
+
+import os
+import pathlib
+
+from devtools.lib.repository import Repository
+
+
+def make_venv(root: pathlib.Path, name: str, cfg: str | None) -> None:
+    venv = root.joinpath(f".venv-{name}")
+    venv.joinpath("bin").mkdir(parents=True)
+    if cfg is not None:
+        venv.joinpath("pyvenv.cfg").write_text(cfg)
+        venv.joinpath("bin", "python").touch()
+
+
+def test_venvs(tmp_path: pathlib.Path) -> None:
+    make_venv(tmp_path, "default", "home = /usr/bin\nversion = 3.11.6\n")
+    make_venv(tmp_path, "uv", "version_info = 3.12.1\n")
+    make_venv(tmp_path, "broken", None)
+    tmp_path.joinpath(".venv-file").touch()
+
+    repo = Repository.from_root_path(str(tmp_path))
+    venvs = repo.venvs()
+
+    assert [(v.name, v.python_version, v.exists) for v in venvs] == [
+        ("broken", None, False),
+        ("default", "3.11.6", True),
+        ("uv", "3.12.1", True),
+    ]
+    assert venvs[1].interpreter == repo.get_venv("default") + "/bin/python"
+    assert repo.find_venvs() == ["broken", "default", "uv"]
+
+    # memoized until the root changes
+    assert repo.venvs() is venvs
+    make_venv(tmp_path, "new", "version = 3.13.0\n")
+    os.utime(tmp_path, ns=(0, 0))
+    assert "new" in repo.find_venvs()
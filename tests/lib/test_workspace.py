@@ -0,0 +1,160 @@
+from __future__ import annotations
+
+import os
+import pathlib
+import subprocess
+from collections.abc import Iterator
+from unittest import mock
+
+import pytest
+
+from devtools.lib import workspace
+from devtools.lib.workspace import Workspace
+
+
+def git(cwd: pathlib.Path, *args: str) -> None:
+    subprocess.run(
+        ("git", "-c", "user.name=t", "-c", "user.email=t@t", *args),
+        cwd=cwd,
+        check=True,
+        capture_output=True,
+    )
+
+
+def make_repo(path: pathlib.Path, index_version: int = 2) -> None:
+    path.mkdir()
+    git(path, "init", "-q", "-b", "main")
+    git(path, "config", "index.version", str(index_version))
+    path.joinpath("a.txt").write_text("a\n")
+    path.joinpath("dir").mkdir()
+    path.joinpath("dir", "a-rather-long-file-name.txt").write_text("b\n")
+    git(path, "add", ".")
+    git(path, "commit", "-q", "-m", "init")
+
+
+@pytest.fixture
+def root(tmp_path: pathlib.Path) -> Iterator[pathlib.Path]:
+    with mock.patch("devtools.constants.root", str(tmp_path / "root")):
+        ws = tmp_path / "ws"
+        ws.mkdir()
+        make_repo(ws / "app")
+        make_repo(ws / "lib", index_version=4)
+        git(ws / "lib", "checkout", "-q", "-b", "feature")
+        git(ws / "app", "worktree", "add", "-q", str(ws / "app-wt"))
+        ws.joinpath("tools", ".devtools").mkdir(parents=True)
+        ws.joinpath("notes").mkdir()
+        ws.joinpath("README").touch()
+        yield ws
+
+
+def test_repos(root: pathlib.Path) -> None:
+    repos = Workspace(str(root)).repos()
+
+    assert [(r.name, r.git_dir is not None, r.has_devtools) for r in repos] == [
+        ("app", True, False),
+        ("app-wt", True, False),
+        ("lib", True, False),
+        ("tools", False, True),
+    ]
+    assert repos[1].git_dir == str(
+        root / "app" / ".git" / "worktrees" / "app-wt"
+    )
+
+
+def test_repos_cache(root: pathlib.Path) -> None:
+    ws = Workspace(str(root))
+    ws.repos()
+
+    with mock.patch.object(workspace, "_git_dir") as git_dir:
+        assert [r.name for r in ws.repos()] == ["app", "app-wt", "lib", "tools"]
+        git_dir.assert_not_called()
+
+    # only the changed directory is rescanned
+    make_repo(root / "new")
+    root.joinpath("tools", ".devtools").rmdir()
+    with mock.patch.object(
+        workspace, "_git_dir", wraps=workspace._git_dir
+    ) as git_dir:
+        assert [r.name for r in ws.repos()] == ["app", "app-wt", "lib", "new"]
+        assert sorted(c.args[0] for c in git_dir.call_args_list) == [
+            str(root / "new"),
+            str(root / "tools"),
+        ]
+
+
+def test_status(root: pathlib.Path) -> None:
+    ws = Workspace(str(root))
+
+    def status() -> dict[str, tuple[str | None, bool | None]]:
+        return {s.repo.name: (s.branch, s.dirty) for s in ws.status()}
+
+    assert status() == {
+        "app": ("main", False),
+        "app-wt": ("app-wt", False),
+        "lib": ("feature", False),
+        "tools": (None, None),
+    }
+
+    root.joinpath("app", "a.txt").write_text("changed\n")
+    os.remove(root / "lib" / "dir" / "a-rather-long-file-name.txt")
+    root.joinpath("app-wt", "untracked").touch()
+    assert status() == {
+        "app": ("main", True),
+        "app-wt": ("app-wt", False),
+        "lib": ("feature", True),
+        "tools": (None, None),
+    }
+
+    git(root / "app", "checkout", "-q", "--detach")
+    git(root / "app", "checkout", "-q", "a.txt")
+    (branch, dirty) = status()["app"]
+    assert len(branch or "") == 12
+    assert dirty is False
+
+
+@pytest.mark.parametrize(
+    "setup",
+    (
+        # a split index keeps entries in a shared index
+        [
+            ("config", "core.splitIndex", "true"),
+            ("update-index", "--split-index"),
+        ],
+        # a sparse index has entries for whole directories
+        [("sparse-checkout", "set", "--cone", "--sparse-index", "other")],
+    ),
+)
+def test_status_needs_git(
+    tmp_path: pathlib.Path, setup: list[tuple[str, ...]]
+) -> None:
+    make_repo(tmp_path / "app")
+    for args in setup:
+        git(tmp_path / "app", *args)
+    with mock.patch("devtools.constants.root", str(tmp_path / ".root")):
+        repo = Workspace(str(tmp_path)).repos()[0]
+
+    with pytest.raises(workspace.UnsupportedIndex):
+        workspace._index_entries(os.path.join(repo.git_dir or "", "index"))
+    assert repo.is_dirty() is False
+
+    tmp_path.joinpath("app", "a.txt").write_text("changed\n")
+    assert repo.is_dirty() is True
+
+
+def test_status_sha256(tmp_path: pathlib.Path) -> None:
+    path = tmp_path / "app"
+    path.mkdir()
+    git(path, "init", "-q", "--object-format=sha256")
+    path.joinpath("a.txt").write_text("a\n")
+    git(path, "add", ".")
+    git(path, "commit", "-q", "-m", "init")
+    with mock.patch("devtools.constants.root", str(tmp_path / ".root")):
+        repo = Workspace(str(tmp_path)).repos()[0]
+
+    with mock.patch.object(
+        workspace, "_index_entries", wraps=workspace._index_entries
+    ) as index_entries:
+        assert repo.is_dirty() is False
+        path.joinpath("a.txt").write_text("changed\n")
+        assert repo.is_dirty() is True
+    index_entries.assert_not_called()
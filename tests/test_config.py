@@ -1,12 +1,28 @@
 from __future__ import annotations
 
 import os
+import pathlib
+import subprocess
+from collections.abc import Iterator
 from unittest import mock
 
 import pytest
 
 from devtools import main
+from devtools.lib.config import clear_config_cache
+from devtools.lib.config import get_config
+from devtools.lib.config import load_snapshot
 from devtools.lib.config import read_config
+from tests.utils import chdir
+
+
+@pytest.fixture(autouse=True)
+def root(tmp_path: pathlib.Path) -> Iterator[pathlib.Path]:
+    """Keeps config snapshots out of the real data directory"""
+    root = tmp_path / "root"
+    root.mkdir()
+    with mock.patch("devtools.constants.root", str(root)):
+        yield root
 
 
 def test_init(tmp_path: str) -> None:
@@ -42,3 +58,83 @@ def test_rm(tmp_path: str) -> None:
 
         main.devtools(("config", "rm"))
         assert not os.path.exists(config_path)
+
+
+def test_get_config_cache(tmp_path: str) -> None:
+    config_path = f"{tmp_path}/config.ini"
+
+    assert not get_config(config_path).sections()
+
+    with open(config_path, "w") as f:
+        f.write("[devtools]\nworkspace = a\n")
+
+    config = get_config(config_path)
+    assert config.get("devtools", "workspace") == "a"
+    # unchanged files aren't parsed again
+    assert get_config(config_path) is config
+
+    with open(config_path, "w") as f:
+        f.write("[devtools]\nworkspace = abc\n")
+
+    assert get_config(config_path).get("devtools", "workspace") == "abc"
+
+
+def test_snapshot(tmp_path: str) -> None:
+    config_path = f"{tmp_path}/config.ini"
+    reporoot = f"{tmp_path}/repo"
+    os.makedirs(f"{reporoot}/.devtools")
+
+    with open(config_path, "w") as f:
+        f.write("[devtools]\nworkspace = a\n")
+    with open(f"{reporoot}/.devtools/config.ini", "w") as f:
+        f.write("[gcpsudo.x]\naccount = x@iam.gserviceaccount.com\n")
+
+    with mock.patch("devtools.constants.config", config_path):
+        snapshot = load_snapshot(reporoot)
+        assert snapshot.get("devtools", "workspace") == "a"
+        assert (
+            snapshot.get("gcpsudo.x", "account") == "x@iam.gserviceaccount.com"
+        )
+        assert snapshot.get("gcpsudo.x", "scopes") is None
+        assert os.listdir(f"{tmp_path}/root/cache")
+
+        # the compiled snapshot is used without parsing the ini files
+        with mock.patch("devtools.lib.config.read_config") as read:
+            clear_config_cache()
+            assert load_snapshot(reporoot).get("devtools", "workspace") == "a"
+            read.assert_not_called()
+
+        with open(config_path, "w") as f:
+            f.write("[devtools]\nworkspace = abc\n")
+
+        assert load_snapshot(reporoot).get("devtools", "workspace") == "abc"
+        # without a repo, only the user configuration is loaded
+        assert not load_snapshot().has_section("gcpsudo.x")
+
+
+def test_snapshot_unwritable(tmp_path: str) -> None:
+    config_path = f"{tmp_path}/config.ini"
+    with open(config_path, "w") as f:
+        f.write("[devtools]\nworkspace = a\n")
+
+    with mock.patch("devtools.constants.config", config_path), mock.patch(
+        "tempfile.mkstemp", side_effect=OSError(28, "No space left on device")
+    ):
+        assert load_snapshot().get("devtools", "workspace") == "a"
+
+
+def test_repo_cannot_configure_devtools(
+    tmp_path: str, caplog: pytest.LogCaptureFixture
+) -> None:
+    config_path = f"{tmp_path}/config/config.ini"
+    reporoot = f"{tmp_path}/repo"
+    os.makedirs(f"{reporoot}/.devtools")
+    subprocess.run(("git", "init", "-q", reporoot), check=True)
+    with open(f"{reporoot}/.devtools/config.ini", "w") as f:
+        f.write(
+            "[devtools]\nworkspace = /elsewhere\nusername = x\nemail = x@x\n"
+        )
+
+    with mock.patch("devtools.constants.config", config_path), chdir(reporoot):
+        main.devtools(("config", "show"))
+    assert "Configuration requires init" in caplog.text
@@ -0,0 +1,481 @@
+from __future__ import annotations
+
+import argparse
+import http.server
+import json
+import os
+import pathlib
+import re
+import subprocess
+import time
+from collections.abc import Iterator
+from typing import cast
+from unittest import mock
+
+import pytest
+
+from devtools.commands import github
+from devtools.lib import httpclient
+from devtools.lib.context import Context
+from tests.utils import http_server
+
+EMPTY_TREE = "4b825dc642cb6eb9a060e54bf8d69288fbee4904"
+
+
+@pytest.fixture
+def origin(tmp_path: pathlib.Path) -> Iterator[pathlib.Path]:
+    """Bare repositories standing in for git@github.com:org/<name>"""
+    origin = tmp_path / "origin"
+    for name in ("a", "b", "c"):
+        bare = str(origin / "org" / name)
+        subprocess.run(("git", "init", "-q", "--bare", bare), check=True)
+        # a commit of the empty tree, so there is something to check out
+        sha = subprocess.run(
+            ("git", "-C", bare, "-c", "user.name=t", "-c", "user.email=t@t")
+            + ("commit-tree", "-m", "init", EMPTY_TREE),
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+        subprocess.run(
+            ("git", "-C", bare, "update-ref", "HEAD", sha), check=True
+        )
+
+    env = {
+        "GIT_CONFIG_COUNT": "1",
+        "GIT_CONFIG_KEY_0": f"url.file://{origin}/.insteadOf",
+        "GIT_CONFIG_VALUE_0": "git@github.com:",
+    }
+    with mock.patch.dict("devtools.constants.user_environ", env):
+        with mock.patch.object(github, "FETCH_BACKOFF", 0):
+            yield origin
+
+
+def test_read_manifest(tmp_path: pathlib.Path) -> None:
+    manifest = tmp_path / "repos.txt"
+    manifest.write_text("# onboarding\norg/a\n\norg/b  # the other one\n")
+    assert github.read_manifest(str(manifest)) == ["org/a", "org/b"]
+
+
+def test_fetch_many(
+    origin: pathlib.Path,
+    tmp_path: pathlib.Path,
+    capsys: pytest.CaptureFixture[str],
+) -> None:
+    workspace = tmp_path / "ws"
+    workspace.joinpath("c").mkdir(parents=True)
+
+    results = github.fetch_many(
+        str(workspace), ["org/a", "org/b", "org/c", "org/missing"], retries=1
+    )
+
+    assert [(r.repo, r.cloned, r.attempts, bool(r.error)) for r in results] == [
+        ("org/a", True, 1, False),
+        ("org/b", True, 1, False),
+        ("org/c", False, 0, False),
+        ("org/missing", False, 2, True),
+    ]
+    assert os.path.isdir(workspace / "a" / ".git")
+    assert os.path.isdir(workspace / "b" / ".git")
+    assert not os.path.exists(workspace / "missing")
+
+    out = capsys.readouterr().out
+    assert "retrying" in out
+    assert "failed after 2 attempts" in out
+
+
+def test_fetch_many_same_name(
+    origin: pathlib.Path, tmp_path: pathlib.Path
+) -> None:
+    workspace = tmp_path / "ws"
+    workspace.mkdir()
+
+    with pytest.raises(SystemExit, match="org/a, other/a"):
+        github.fetch_many(str(workspace), ["org/a", "org/b", "other/a"])
+    assert list(workspace.iterdir()) == []
+
+    # the same repository twice is only cloned once
+    results = github.fetch_many(str(workspace), ["org/a", "org/a"])
+    assert [r.repo for r in results] == ["org/a"]
+
+
+def pin_context(files: list[str], **kwargs: object) -> Context:
+    args = argparse.Namespace(
+        files=files, jobs=2, refresh=False, check=False, resolver="ls-remote"
+    )
+    vars(args).update(kwargs)
+    return cast(Context, {"args": args})
+
+
+@pytest.fixture
+def actions(tmp_path: pathlib.Path) -> Iterator[dict[str, dict[str, str]]]:
+    """
+    Bare repositories standing in for https://github.com/org/action<n>, each
+    with a main branch and tags v1 and v2. Yields their refs' SHAs.
+    """
+    work = tmp_path / "work"
+    subprocess.run(("git", "init", "-q", "-b", "main", str(work)), check=True)
+    shas = {}
+    for tag in ("v1", "v2"):
+        subprocess.run(
+            (
+                "git",
+                "-C",
+                str(work),
+                "-c",
+                "user.name=t",
+                "-c",
+                "user.email=t@t",
+            )
+            + ("commit", "-q", "--allow-empty", "-m", tag),
+            check=True,
+        )
+        subprocess.run(("git", "-C", str(work), "tag", tag), check=True)
+        shas[tag] = subprocess.run(
+            ("git", "-C", str(work), "rev-parse", "HEAD"),
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+    shas["main"] = shas["v2"]
+    subprocess.run(
+        ("git", "-C", str(work), "-c", "user.name=t", "-c", "user.email=t@t")
+        + ("tag", "-a", "-m", "release", "v2.0.0", "v2"),
+        check=True,
+    )
+
+    origin = tmp_path / "github"
+    for i in range(20):
+        bare = str(origin / "org" / f"action{i}")
+        subprocess.run(("git", "init", "-q", "--bare", bare), check=True)
+        subprocess.run(
+            ("git", "-C", str(work), "push", "-q", bare, "main", "--tags"),
+            check=True,
+        )
+
+    env = {
+        "GIT_CONFIG_COUNT": "1",
+        "GIT_CONFIG_KEY_0": f"url.file://{origin}/.insteadOf",
+        "GIT_CONFIG_VALUE_0": "https://github.com/",
+    }
+    with mock.patch.dict(os.environ, env), mock.patch(
+        "devtools.constants.root", str(tmp_path / "root")
+    ):
+        yield {f"org/action{i}": shas for i in range(20)}
+
+
+def test_pin_gha(
+    actions: dict[str, dict[str, str]], tmp_path: pathlib.Path
+) -> None:
+    """Pins a few hundred workflows, resolving each distinct ref once"""
+    workflows = tmp_path / "workflows"
+    workflows.mkdir()
+    refs = ("v1", "v2", "main")
+    files = []
+    for n in range(300):
+        lines = ["jobs:\n", "  test:\n", "    steps:\n"]
+        for step in range(5):
+            action = f"org/action{(n + step) % 20}"
+            if step == 4:
+                action += "/subdir"
+            lines.append(f"      - uses: {action}@{refs[(n + step) % 3]}\n")
+        lines.append("      - run: make test\n")
+        path = workflows / f"workflow{n}.yml"
+        path.write_text("".join(lines))
+        files.append(str(path))
+
+    context = pin_context(files, jobs=8)
+    with mock.patch.object(
+        github, "_ls_remote", wraps=github._ls_remote
+    ) as ls_remote:
+        assert github.pin_gha(context, None) == 0
+
+    # one listing per action repository, for all 3 refs
+    assert ls_remote.call_count == 20
+    pinned = workflows.joinpath("workflow1.yml").read_text().splitlines()
+    assert (
+        pinned[3]
+        == f"      - uses: org/action1@{actions['org/action1']['v2']} # v2"
+    )
+    assert pinned[7].startswith("      - uses: org/action5/subdir@")
+    assert pinned[8] == "      - run: make test"
+
+    # already pinned: nothing to resolve
+    before = workflows.joinpath("workflow1.yml").read_text()
+    with mock.patch.object(github, "_ls_remote") as ls_remote:
+        assert github.pin_gha(context, None) == 0
+    ls_remote.assert_not_called()
+    assert workflows.joinpath("workflow1.yml").read_text() == before
+
+
+def test_pin_gha_unknown_ref(
+    actions: dict[str, dict[str, str]], tmp_path: pathlib.Path
+) -> None:
+    workflow = tmp_path / "workflow.yml"
+    workflow.write_text(
+        "- uses: org/action0@v2.0.0\n- uses: org/action0@nope\n"
+    )
+
+    assert github.pin_gha(pin_context([str(workflow)]), None) == 1
+    assert workflow.read_text() == (
+        f"- uses: org/action0@{actions['org/action0']['v2']} # v2.0.0\n"
+        "- uses: org/action0@nope\n"
+    )
+
+
+def test_ref_cache(
+    actions: dict[str, dict[str, str]], tmp_path: pathlib.Path
+) -> None:
+    workflow = tmp_path / "workflow.yml"
+    content = (
+        "- uses: org/action0@v1\n"
+        "- uses: org/action0@main\n"
+        "- uses: org/action1@v1\n"
+    )
+
+    def pin(refresh: bool = False) -> list[tuple[object, ...]]:
+        workflow.write_text(content)
+        context = pin_context([str(workflow)], refresh=refresh)
+        with mock.patch.object(
+            github, "_ls_remote", wraps=github._ls_remote
+        ) as ls_remote:
+            assert github.pin_gha(context, None) == 0
+        return sorted(c.args for c in ls_remote.call_args_list)
+
+    assert pin() == [("org/action0",), ("org/action1",)]
+    # shared across runs, and written for other invocations
+    assert pin() == []
+    assert os.path.exists(github.RefCache().path)
+
+    # branches expire first
+    later = time.time() + github.REF_TTL["branch"] + 1
+    with mock.patch("time.time", return_value=later):
+        assert pin() == [("org/action0",)]
+
+    assert len(pin(refresh=True)) == 2
+
+
+def test_ref_table() -> None:
+    table = github.RefTable.parse(
+        "org/a",
+        "a" * 40
+        + "\trefs/heads/main\n"
+        + "b" * 40
+        + "\trefs/heads/v1\n"
+        + "c" * 40
+        + "\trefs/tags/v1\n"
+        + "d" * 40
+        + "\trefs/tags/v2.0.0\n"
+        + "e" * 40
+        + "\trefs/tags/v2.0.0^{}\n",
+    )
+
+    assert table.resolve("main") == ("a" * 40, "branch")
+    # tags shadow branches of the same name
+    assert table.resolve("v1") == ("c" * 40, "tag")
+    # annotated tags resolve to their commit
+    assert table.resolve("v2.0.0") == ("e" * 40, "release")
+    with pytest.raises(LookupError):
+        table.resolve("v3")
+
+
+@pytest.mark.parametrize(
+    "refname,kind",
+    (
+        ("refs/heads/main", "branch"),
+        ("refs/tags/v4", "tag"),
+        ("refs/tags/v4.1", "tag"),
+        ("refs/tags/v4.1.7", "release"),
+        ("refs/tags/1.0.0", "release"),
+    ),
+)
+def test_ref_kind(refname: str, kind: str) -> None:
+    assert github.ref_kind(refname) == kind
+
+
+def test_find_workflows(tmp_path: pathlib.Path) -> None:
+    for path in (
+        "a/.github/workflows/test.yml",
+        "a/.github/workflows/README.md",
+        "a/.github/actions/setup/action.yaml",
+        "a/src/.github.yml",
+        "a/node_modules/x/.github/workflows/ci.yml",
+        "a/.venv/lib/.github/workflows/ci.yml",
+        "b/.github/workflows/lint.yml",
+    ):
+        tmp_path.joinpath(path).parent.mkdir(parents=True, exist_ok=True)
+        tmp_path.joinpath(path).touch()
+
+    def find(*paths: str) -> list[str]:
+        found = github.find_workflows([f"{tmp_path}/{p}" for p in paths])
+        return [os.path.relpath(f, tmp_path) for f in found]
+
+    assert find(".") == [
+        "a/.github/actions/setup/action.yaml",
+        "a/.github/workflows/test.yml",
+        "b/.github/workflows/lint.yml",
+    ]
+    assert find("*/.github/workflows", "a/src/.github.yml") == [
+        "a/.github/workflows/test.yml",
+        "b/.github/workflows/lint.yml",
+        "a/src/.github.yml",
+    ]
+    with pytest.raises(SystemExit):
+        find("c")
+
+
+def test_pin_gha_incremental(
+    actions: dict[str, dict[str, str]], tmp_path: pathlib.Path
+) -> None:
+    workflows = tmp_path / "repo" / ".github" / "workflows"
+    workflows.mkdir(parents=True)
+    unpinned = workflows / "unpinned.yml"
+    unpinned.write_text("- uses: org/action0@v1\n")
+    plain = workflows / "plain.yml"
+    plain.write_text("- run: make\n")
+    before = os.stat(plain)
+
+    # --check needs no network
+    with mock.patch.object(github, "_ls_remote") as ls_remote:
+        assert (
+            github.pin_gha(pin_context([str(tmp_path)], check=True), None) == 1
+        )
+    ls_remote.assert_not_called()
+
+    inode = os.stat(unpinned).st_ino
+    assert github.pin_gha(pin_context([str(tmp_path)]), None) == 0
+    # replaced atomically, and only where something changed
+    assert os.stat(unpinned).st_ino != inode
+    after = os.stat(plain)
+    assert (after.st_ino, after.st_mtime_ns) == (
+        before.st_ino,
+        before.st_mtime_ns,
+    )
+
+    # fully pinned files aren't even read again
+    with mock.patch.object(github, "scan_refs") as scan_refs:
+        assert (
+            github.pin_gha(pin_context([str(tmp_path)], check=True), None) == 0
+        )
+        assert github.pin_gha(pin_context([str(tmp_path)]), None) == 0
+    scan_refs.assert_not_called()
+
+    # until they change
+    unpinned.write_text(unpinned.read_text() + "- uses: org/action1@v2\n")
+    assert github.pin_gha(pin_context([str(tmp_path)], check=True), None) == 1
+
+
+class GraphQLHandler(http.server.BaseHTTPRequestHandler):
+    """Answers ref lookups from `refs`: {(repo, qualified name): oid}"""
+
+    protocol_version = "HTTP/1.1"
+    refs: dict[tuple[str, str], str] = {}
+    queries: list[str] = []
+
+    def log_message(self, format: str, *args: object) -> None:
+        pass
+
+    def do_POST(self) -> None:
+        assert self.headers["Authorization"] == "bearer t0ken"
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        query = json.loads(body)["query"]
+        GraphQLHandler.queries.append(query)
+
+        data: dict[str, dict[str, object]] = {}
+        repo = ""
+        for m in re.finditer(
+            r'(r\d+): repository\(owner: "(.*?)", name: "(.*?)"\)'
+            r'|([th]\d+): ref\(qualifiedName: "(.*?)"\)',
+            query,
+        ):
+            if m[1]:
+                repo = f"{m[2]}/{m[3]}"
+                data[m[1]] = {}
+                current = data[m[1]]
+                continue
+            oid = self.refs.get((repo, m[5]))
+            if oid is None:
+                current[m[4]] = None
+            elif oid.startswith("tag:"):
+                # an annotated tag object and the commit it points at
+                target = {"oid": "f" * 40, "target": {"oid": oid[4:]}}
+                current[m[4]] = {"target": target}
+            else:
+                current[m[4]] = {"target": {"oid": oid}}
+
+        reply = json.dumps({"data": data}).encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+
+
+@pytest.fixture
+def graphql() -> Iterator[type[GraphQLHandler]]:
+    GraphQLHandler.refs = {}
+    GraphQLHandler.queries = []
+    httpclient.close_all()
+    with http_server(GraphQLHandler) as url:
+        with mock.patch.object(github, "GRAPHQL_URL", f"{url}/graphql"):
+            yield GraphQLHandler
+    httpclient.close_all()
+
+
+def test_pin_gha_graphql(
+    actions: dict[str, dict[str, str]],
+    graphql: type[GraphQLHandler],
+    tmp_path: pathlib.Path,
+) -> None:
+    shas = actions["org/action0"]
+    graphql.refs = {
+        ("org/action0", "refs/tags/v1"): shas["v1"],
+        ("org/action0", "refs/heads/main"): shas["main"],
+        ("org/action1", "refs/tags/v2.0.0"): f"tag:{shas['v2']}",
+    }
+    workflow = tmp_path / "workflow.yml"
+    workflow.write_text(
+        "- uses: org/action0@v1\n"
+        "- uses: org/action0@main\n"
+        "- uses: org/action1@v2.0.0\n"
+        "- uses: org/action2@v1\n"
+    )
+
+    context = pin_context([str(workflow)], resolver="graphql")
+    with mock.patch.dict(os.environ, {"GITHUB_TOKEN": "t0ken"}):
+        with mock.patch.object(
+            github, "_ls_remote", wraps=github._ls_remote
+        ) as ls_remote:
+            assert github.pin_gha(context, None) == 0
+
+    # one request for every ref; only what it didn't find is listed
+    assert len(graphql.queries) == 1
+    assert [c.args for c in ls_remote.call_args_list] == [("org/action2",)]
+    assert workflow.read_text() == (
+        f"- uses: org/action0@{shas['v1']} # v1\n"
+        f"- uses: org/action0@{shas['main']} # main\n"
+        f"- uses: org/action1@{shas['v2']} # v2.0.0\n"
+        f"- uses: org/action2@{shas['v1']} # v1\n"
+    )
+    # resolved refs are cached as usual
+    assert github.RefCache().get("org/action1", "v2.0.0") == shas["v2"]
+
+
+def test_pin_gha_graphql_without_token(
+    actions: dict[str, dict[str, str]],
+    graphql: type[GraphQLHandler],
+    tmp_path: pathlib.Path,
+) -> None:
+    workflow = tmp_path / "workflow.yml"
+    workflow.write_text("- uses: org/action0@v1\n")
+
+    context = pin_context([str(workflow)], resolver="graphql")
+    env = {
+        k: v
+        for k, v in os.environ.items()
+        if k not in ("GITHUB_TOKEN", "GH_TOKEN")
+    }
+    with mock.patch.dict(os.environ, env, clear=True):
+        assert github.pin_gha(context, None) == 0
+
+    assert graphql.queries == []
+    assert actions["org/action0"]["v1"] in workflow.read_text()
@@ -1,8 +1,10 @@
 from __future__ import annotations
 
 import contextlib
+import http.server
 import os
 import pathlib
+import threading
 from collections.abc import Generator
 
 
@@ -15,3 +17,18 @@ def chdir(d: str | pathlib.Path) -> Generator[None, None, None]:
         yield
     finally:
         os.chdir(curdir)
+
+
+@contextlib.contextmanager
+def http_server(
+    handler: type[http.server.BaseHTTPRequestHandler],
+) -> Generator[str, None, None]:
+    """Serves `handler` on a random local port, yielding the base url"""
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}"
+    finally:
+        server.shutdown()
+        server.server_close()